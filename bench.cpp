@@ -0,0 +1,461 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+// Headless benchmark of the callback hot path.
+//
+// Acts as the game, loading the plug-ins in bench/plugins/python, which
+// register listeners on every channel and event. Calls each registered
+// channel and event with synthetic values, with 1, 5 and 20 Python
+// listeners each. Prints one JSON object per line, with the time and the
+// number of Python allocations per callback, aggregated per value type
+// and event, the cost of acquiring the GIL and the peak memory use. Each
+// listener count runs in a process of its own, so the peak memory use is
+// that of the run.
+// Run from the top source directory.
+
+#include <chrono>
+#include <cstdlib>
+#include <cstring>
+#include <iostream>
+#include <map>
+#include <string>
+#include <vector>
+
+#include <sys/resource.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include "scssdk_telemetry.h"
+#include "eurotrucks2/scssdk_eut2.h"
+#include "eurotrucks2/scssdk_telemetry_eut2.h"
+#include "amtrucks/scssdk_ats.h"
+#include "amtrucks/scssdk_telemetry_ats.h"
+
+// Calls per channel and event, for each listener count
+static const int ITERATIONS = 2000;
+static const int GIL_ITERATIONS = 1000000;
+static const int LISTENER_COUNTS[] = {1, 5, 20};
+
+static void log(const scs_log_type_t type, const scs_string_t message) {
+    std::cerr << "LOG: " << message << std::endl;
+}
+
+struct channel_registration {
+    std::string name;
+    scs_u32_t index;
+    scs_value_type_t type;
+    scs_telemetry_channel_callback_t callback;
+    scs_context_t context;
+};
+static std::vector<channel_registration> channels_;
+
+static SCSAPI_RESULT register_for_channel(const scs_string_t name, const scs_u32_t index, const scs_value_type_t type, const scs_u32_t flags, const scs_telemetry_channel_callback_t callback, const scs_context_t context) {
+    channels_.push_back({name, index, type, callback, context});
+    return SCS_RESULT_ok;
+}
+
+struct event_registration {
+    scs_event_t event;
+    scs_telemetry_event_callback_t callback;
+    scs_context_t context;
+};
+static std::vector<event_registration> events_;
+
+static SCSAPI_RESULT register_for_event(const scs_event_t event, const scs_telemetry_event_callback_t callback, const scs_context_t context) {
+    events_.push_back({event, callback, context});
+    return SCS_RESULT_ok;
+}
+
+static SCSAPI_RESULT unregister_from_channel(const scs_string_t name, const scs_u32_t index, const scs_value_type_t type) {
+    for (auto it = channels_.begin(); it != channels_.end(); ++it) {
+        if (it->name == name && it->index == index) {
+            channels_.erase(it);
+            return SCS_RESULT_ok;
+        }
+    }
+    return SCS_RESULT_not_found;
+}
+
+static SCSAPI_RESULT unregister_from_event(const scs_event_t event) {
+    for (auto it = events_.begin(); it != events_.end(); ++it) {
+        if (it->event == event) {
+            events_.erase(it);
+            return SCS_RESULT_ok;
+        }
+    }
+    return SCS_RESULT_not_found;
+}
+
+// Allocation counting, by hooking the Python allocators
+
+static const PyMemAllocatorDomain DOMAINS[] = {
+    PYMEM_DOMAIN_RAW, PYMEM_DOMAIN_MEM, PYMEM_DOMAIN_OBJ
+};
+static PyMemAllocatorEx base_allocators_[3];
+static size_t allocation_count_ = 0;
+
+static void *count_malloc(void *ctx, size_t size) {
+    ++allocation_count_;
+    auto base = static_cast<PyMemAllocatorEx*>(ctx);
+    return base->malloc(base->ctx, size);
+}
+
+static void *count_calloc(void *ctx, size_t nelem, size_t elsize) {
+    ++allocation_count_;
+    auto base = static_cast<PyMemAllocatorEx*>(ctx);
+    return base->calloc(base->ctx, nelem, elsize);
+}
+
+static void *count_realloc(void *ctx, void *ptr, size_t new_size) {
+    ++allocation_count_;
+    auto base = static_cast<PyMemAllocatorEx*>(ctx);
+    return base->realloc(base->ctx, ptr, new_size);
+}
+
+static void count_free(void *ctx, void *ptr) {
+    auto base = static_cast<PyMemAllocatorEx*>(ctx);
+    base->free(base->ctx, ptr);
+}
+
+static void set_allocation_hooks(bool enable) {
+    for (int i = 0; i < 3; ++i) {
+        if (enable) {
+            PyMem_GetAllocator(DOMAINS[i], &base_allocators_[i]);
+            PyMemAllocatorEx hook = {&base_allocators_[i], count_malloc,
+                                     count_calloc, count_realloc, count_free};
+            PyMem_SetAllocator(DOMAINS[i], &hook);
+        } else {
+            PyMem_SetAllocator(DOMAINS[i], &base_allocators_[i]);
+        }
+    }
+}
+
+// Synthetic values
+
+static const char *type_name(scs_value_type_t type) {
+    switch (type) {
+        case SCS_VALUE_TYPE_bool: return "bool";
+        case SCS_VALUE_TYPE_s32: return "s32";
+        case SCS_VALUE_TYPE_u32: return "u32";
+        case SCS_VALUE_TYPE_u64: return "u64";
+        case SCS_VALUE_TYPE_s64: return "s64";
+        case SCS_VALUE_TYPE_float: return "float";
+        case SCS_VALUE_TYPE_double: return "double";
+        case SCS_VALUE_TYPE_fvector: return "fvector";
+        case SCS_VALUE_TYPE_dvector: return "dvector";
+        case SCS_VALUE_TYPE_euler: return "euler";
+        case SCS_VALUE_TYPE_fplacement: return "fplacement";
+        case SCS_VALUE_TYPE_dplacement: return "dplacement";
+        case SCS_VALUE_TYPE_string: return "string";
+        default: return "invalid";
+    }
+}
+
+static const char *event_name(scs_event_t event) {
+    switch (event) {
+        case SCS_TELEMETRY_EVENT_frame_start: return "frame_start";
+        case SCS_TELEMETRY_EVENT_frame_end: return "frame_end";
+        case SCS_TELEMETRY_EVENT_paused: return "paused";
+        case SCS_TELEMETRY_EVENT_started: return "started";
+        case SCS_TELEMETRY_EVENT_configuration: return "configuration";
+        case SCS_TELEMETRY_EVENT_gameplay: return "gameplay";
+        default: return "invalid";
+    }
+}
+
+static void fill_value(scs_value_type_t type, int i, scs_value_t &value) {
+    value.type = type;
+    float f = i * 0.5f;
+    double d = i * 0.25;
+    scs_value_euler_t euler = {f, f + 1, f + 2};
+    switch (type) {
+        case SCS_VALUE_TYPE_bool:
+            value.value_bool.value = i & 1;
+            break;
+        case SCS_VALUE_TYPE_s32:
+            value.value_s32.value = -i;
+            break;
+        case SCS_VALUE_TYPE_u32:
+            value.value_u32.value = i;
+            break;
+        case SCS_VALUE_TYPE_u64:
+            value.value_u64.value = i;
+            break;
+        case SCS_VALUE_TYPE_s64:
+            value.value_s64.value = -i;
+            break;
+        case SCS_VALUE_TYPE_float:
+            value.value_float.value = f;
+            break;
+        case SCS_VALUE_TYPE_double:
+            value.value_double.value = d;
+            break;
+        case SCS_VALUE_TYPE_fvector:
+            value.value_fvector = {f, f + 1, f + 2};
+            break;
+        case SCS_VALUE_TYPE_dvector:
+            value.value_dvector = {d, d + 1, d + 2};
+            break;
+        case SCS_VALUE_TYPE_euler:
+            value.value_euler = euler;
+            break;
+        case SCS_VALUE_TYPE_fplacement:
+            value.value_fplacement.position = {f, f + 1, f + 2};
+            value.value_fplacement.orientation = euler;
+            break;
+        case SCS_VALUE_TYPE_dplacement:
+            value.value_dplacement.position = {d, d + 1, d + 2};
+            value.value_dplacement.orientation = euler;
+            break;
+        case SCS_VALUE_TYPE_string:
+            value.value_string.value = (i & 1) ? "odd" : "even";
+            break;
+        default:
+            value.type = SCS_VALUE_TYPE_INVALID;
+    }
+}
+
+struct bench_result {
+    size_t count = 0;
+    uint64_t callbacks = 0;
+    double ns = 0;
+    size_t allocations = 0;
+};
+
+static void print_result(const char *bench, const char *key,
+                         const char *name, int listeners,
+                         const char *values, const bench_result &result) {
+    std::cout << "{\"bench\": \"" << bench << "\""
+              << ", \"" << key << "\": \"" << name << "\""
+              << ", \"listeners\": " << listeners;
+    if (values != nullptr) {
+        std::cout << ", \"values\": \"" << values << "\""
+                  << ", \"channels\": " << result.count;
+    }
+    std::cout << ", \"callbacks\": " << result.callbacks
+              << ", \"ns_per_callback\": " << result.ns / result.callbacks
+              << ", \"allocs_per_callback\": "
+              << static_cast<double>(result.allocations) / result.callbacks
+              << "}" << std::endl;
+}
+
+// Calls the channel ITERATIONS times and adds to result.
+// varying=false repeats the same value, like most channels do while the
+// truck is standing still.
+static void bench_channel(const channel_registration &channel, bool varying,
+                          bench_result &result) {
+    std::vector<scs_value_t> values(ITERATIONS);
+    for (int i = 0; i < ITERATIONS; ++i) {
+        fill_value(channel.type, varying ? i : 1, values[i]);
+    }
+
+    allocation_count_ = 0;
+    auto start = std::chrono::steady_clock::now();
+    for (int i = 0; i < ITERATIONS; ++i) {
+        channel.callback(channel.name.c_str(), channel.index, &values[i],
+                         channel.context);
+    }
+    auto end = std::chrono::steady_clock::now();
+    result.ns += std::chrono::duration<double, std::nano>(end - start).count();
+    result.allocations += allocation_count_;
+    result.callbacks += ITERATIONS;
+    ++result.count;
+}
+
+// Event info with a typical number of attributes
+struct config_info {
+    std::vector<scs_named_value_t> attributes;
+    scs_telemetry_configuration_t config;
+
+    config_info() {
+        static const scs_value_type_t types[] = {
+            SCS_VALUE_TYPE_string, SCS_VALUE_TYPE_u32, SCS_VALUE_TYPE_float,
+            SCS_VALUE_TYPE_fvector, SCS_VALUE_TYPE_bool
+        };
+        static const char *names[] = {
+            "name", "count", "mass", "position", "enabled"
+        };
+        for (int i = 0; i < 20; ++i) {
+            scs_named_value_t attr;
+            attr.name = names[i % 5];
+            attr.index = i < 5 ? SCS_U32_NIL : i / 5;
+            fill_value(types[i % 5], i, attr.value);
+            attributes.push_back(attr);
+        }
+        scs_named_value_t terminator;
+        std::memset(&terminator, 0, sizeof(terminator));
+        attributes.push_back(terminator);
+        config.id = "truck";
+        config.attributes = attributes.data();
+    }
+};
+
+static void bench_event(const event_registration &event, int listeners) {
+    scs_telemetry_frame_start_t frame_start;
+    std::memset(&frame_start, 0, sizeof(frame_start));
+    config_info config;
+    const void *event_info = nullptr;
+    if (event.event == SCS_TELEMETRY_EVENT_frame_start) {
+        event_info = &frame_start;
+    } else if (event.event == SCS_TELEMETRY_EVENT_configuration ||
+               event.event == SCS_TELEMETRY_EVENT_gameplay) {
+        event_info = &config.config;
+    }
+
+    bench_result result;
+    allocation_count_ = 0;
+    auto start = std::chrono::steady_clock::now();
+    for (int i = 0; i < ITERATIONS; ++i) {
+        frame_start.render_time = i;
+        event.callback(event.event, event_info, event.context);
+    }
+    auto end = std::chrono::steady_clock::now();
+    result.ns = std::chrono::duration<double, std::nano>(end - start).count();
+    result.allocations = allocation_count_;
+    result.callbacks = ITERATIONS;
+    print_result("event_cb", "event", event_name(event.event), listeners,
+                 nullptr, result);
+}
+
+// Cost of the GIL round trip done by the loader for each callback that
+// enters Python, without any Python code. Like the loader, restores the
+// thread state saved after initializing Python. The GIL must not be held.
+static void bench_gil(PyThreadState *thread_state) {
+    auto start = std::chrono::steady_clock::now();
+    for (int i = 0; i < GIL_ITERATIONS; ++i) {
+        PyEval_RestoreThread(thread_state);
+        thread_state = PyEval_SaveThread();
+    }
+    auto end = std::chrono::steady_clock::now();
+    double ns = std::chrono::duration<double, std::nano>(end - start).count();
+    std::cout << "{\"bench\": \"gil\""
+              << ", \"iterations\": " << GIL_ITERATIONS
+              << ", \"ns_per_acquire\": " << ns / GIL_ITERATIONS
+              << "}" << std::endl;
+}
+
+static long max_rss_kb() {
+    struct rusage usage;
+    getrusage(RUSAGE_SELF, &usage);
+    return usage.ru_maxrss;
+}
+
+static bool bench_listeners(int listeners) {
+    // Peak of the parent process, inherited at fork
+    long baseline_rss_kb = max_rss_kb();
+    setenv("PYETS2_BENCH_LISTENERS", std::to_string(listeners).c_str(), 1);
+    channels_.clear();
+    events_.clear();
+
+    scs_telemetry_init_params_v101_t params;
+    std::memset(&params, 0, sizeof(params));
+    params.common.game_name = "bench";
+    params.common.game_id = "bench";
+    params.common.game_version = 0;
+    params.common.log = log;
+    params.register_for_channel = register_for_channel;
+    params.register_for_event = register_for_event;
+    params.unregister_from_channel = unregister_from_channel;
+    params.unregister_from_event = unregister_from_event;
+    if (scs_telemetry_init(SCS_TELEMETRY_VERSION_1_01, &params) != SCS_RESULT_ok) {
+        std::cerr << "Init failed" << std::endl;
+        return false;
+    }
+
+    set_allocation_hooks(true);
+    for (bool varying : {true, false}) {
+        std::map<scs_value_type_t, bench_result> results;
+        bench_result total;
+        for (const channel_registration &channel : channels_) {
+            bench_channel(channel, varying, results[channel.type]);
+        }
+        for (const auto &type_result : results) {
+            const bench_result &result = type_result.second;
+            print_result("channel_cb", "type", type_name(type_result.first),
+                         listeners, varying ? "varying" : "constant", result);
+            total.count += result.count;
+            total.callbacks += result.callbacks;
+            total.ns += result.ns;
+            total.allocations += result.allocations;
+        }
+        print_result("channel_cb", "type", "all", listeners,
+                     varying ? "varying" : "constant", total);
+    }
+    for (const event_registration &event : events_) {
+        bench_event(event, listeners);
+    }
+    set_allocation_hooks(false);
+
+    scs_telemetry_shutdown();
+
+    long peak_rss_kb = max_rss_kb();
+    std::cout << "{\"bench\": \"memory\""
+              << ", \"listeners\": " << listeners
+              << ", \"peak_rss_kb\": " << peak_rss_kb
+              << ", \"rss_growth_kb\": " << peak_rss_kb - baseline_rss_kb
+              << "}" << std::endl;
+    return true;
+}
+
+// Runs bench_listeners() in a child process
+static bool run_listeners(int listeners) {
+    std::cout.flush();
+    pid_t pid = fork();
+    if (pid < 0) {
+        std::cerr << "fork failed" << std::endl;
+        return false;
+    }
+    if (pid == 0) {
+        bool ok = bench_listeners(listeners);
+        std::cout.flush();
+        _exit(ok ? 0 : 1);
+    }
+    int status;
+    if (waitpid(pid, &status, 0) != pid) {
+        return false;
+    }
+    return WIFEXITED(status) && WEXITSTATUS(status) == 0;
+}
+
+int main(int argc, char *argv[]) {
+    // The loader looks for plug-ins in $PWD/plugins/python
+    std::string bench_dir = std::string(getenv("PWD")) + "/bench";
+    setenv("PWD", bench_dir.c_str(), 1);
+    if (chdir(bench_dir.c_str()) != 0) {
+        std::cerr << "Cannot enter " << bench_dir << std::endl;
+        return 1;
+    }
+
+    for (int listeners : LISTENER_COUNTS) {
+        if (!run_listeners(listeners)) {
+            return 1;
+        }
+    }
+
+    // The loader ran in the child processes, so use a bare interpreter
+    Py_InitializeEx(0);
+    PyThreadState *thread_state = PyEval_SaveThread();
+    bench_gil(thread_state);
+    PyEval_RestoreThread(thread_state);
+    Py_Finalize();
+    return 0;
+}
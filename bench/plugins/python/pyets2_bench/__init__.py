@@ -0,0 +1,67 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Plug-in loaded by the bench binary. Registers PYETS2_BENCH_LISTENERS no-op
+# listeners on every channel in SCS_CHANNELS, on one extra channel for each
+# value type that no SCS channel has, and on every event.
+
+import os
+from pyets2lib.scsdefs import *
+
+# Value types without SCS channels
+EXTRA_TYPES = {
+    SCS_VALUE_TYPE_u64: 'u64',
+    SCS_VALUE_TYPE_s64: 's64',
+    SCS_VALUE_TYPE_double: 'double',
+    SCS_VALUE_TYPE_dvector: 'dvector',
+    SCS_VALUE_TYPE_euler: 'euler',
+    SCS_VALUE_TYPE_string: 'string',
+}
+
+EVENTS = (
+    SCS_TELEMETRY_EVENT_frame_start,
+    SCS_TELEMETRY_EVENT_frame_end,
+    SCS_TELEMETRY_EVENT_paused,
+    SCS_TELEMETRY_EVENT_started,
+    SCS_TELEMETRY_EVENT_configuration,
+    SCS_TELEMETRY_EVENT_gameplay,
+)
+
+def channel_cb(channel, index, value, context):
+    pass
+
+def event_cb(event, event_info, context):
+    pass
+
+def telemetry_init(version, params):
+    listener_count = int(os.environ.get('PYETS2_BENCH_LISTENERS', '1'))
+    channels = list(SCS_CHANNELS)
+    for value_type, type_name in EXTRA_TYPES.items():
+        if not any(channel.type == value_type for channel in channels):
+            channels.append(ScsChannelBase(-1, 'bench.' + type_name, value_type))
+    for channel in channels:
+        index = 0 if channel.indexed else None
+        for _ in range(listener_count):
+            params.register_for_channel(channel, channel_cb, index)
+    for event in EVENTS:
+        for _ in range(listener_count):
+            params.register_for_event(event, event_cb)
+
+def telemetry_shutdown():
+    pass
@@ -0,0 +1,105 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+// Python time budget of a game frame
+
+#ifndef _BUDGET_HPP_
+#define _BUDGET_HPP_
+
+#include <chrono>
+#include <cstdint>
+
+// Listener priorities. Critical listeners are always called. The others
+// are deferred, lowest priority first, when the budget is used up.
+enum listener_priority {
+    PRIORITY_critical = 0,
+    PRIORITY_normal = 1,
+    PRIORITY_low = 2,
+    PRIORITY_COUNT
+};
+
+struct frame_budget {
+    // 0 disables the budget
+    uint64_t budget_ns = 0;
+    // Time spent in Python on the game thread during the current frame
+    uint64_t used_ns = 0;
+    uint64_t max_used_ns = 0;
+    uint64_t frames = 0;
+    // Frames that used more than the budget
+    uint64_t frames_over = 0;
+    // Calls postponed to a later frame
+    uint64_t deferred = 0;
+    // Values or calls dropped, as a newer value replaced a deferred value,
+    // or a frame event listener was skipped
+    uint64_t shed = 0;
+
+    bool enabled() const {
+        return budget_ns != 0;
+    }
+
+    void start_frame() {
+        if (!enabled()) {
+            return;
+        }
+        ++frames;
+        if (used_ns > budget_ns) {
+            ++frames_over;
+        }
+        if (used_ns > max_used_ns) {
+            max_used_ns = used_ns;
+        }
+        used_ns = 0;
+    }
+
+    // Marks the start of Python code on the game thread
+    void enter() {
+        timing_ = enabled();
+        if (timing_) {
+            section_start_ = std::chrono::steady_clock::now();
+        }
+    }
+
+    // Marks the end of Python code on the game thread
+    void leave() {
+        if (timing_) {
+            used_ns += elapsed_ns();
+            timing_ = false;
+        }
+    }
+
+    // Returns true if the budget of the frame is used up
+    bool exceeded() const {
+        uint64_t used = used_ns;
+        if (timing_) {
+            used += elapsed_ns();
+        }
+        return used >= budget_ns;
+    }
+
+private:
+    bool timing_ = false;
+    std::chrono::steady_clock::time_point section_start_;
+
+    uint64_t elapsed_ns() const {
+        return std::chrono::duration_cast<std::chrono::nanoseconds>(
+            std::chrono::steady_clock::now() - section_start_).count();
+    }
+};
+
+#endif
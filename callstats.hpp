@@ -0,0 +1,57 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+// Call statistics of Python listeners
+
+#ifndef _CALLSTATS_HPP_
+#define _CALLSTATS_HPP_
+
+#include <cstdint>
+
+struct call_stats {
+    // Bucket 0 is below 1 us, bucket i is below 2^i us, and the last
+    // bucket has no upper bound
+    static const int HISTOGRAM_SIZE = 16;
+
+    uint64_t calls = 0;
+    uint64_t total_ns = 0;
+    uint64_t max_ns = 0;
+    // Calls that took longer than the slow threshold
+    uint64_t slow_calls = 0;
+    uint64_t histogram[HISTOGRAM_SIZE] = {};
+
+    void add(uint64_t ns, uint64_t slow_threshold_ns) {
+        ++calls;
+        total_ns += ns;
+        if (ns > max_ns) {
+            max_ns = ns;
+        }
+        if (slow_threshold_ns != 0 && ns > slow_threshold_ns) {
+            ++slow_calls;
+        }
+        uint64_t us = ns / 1000;
+        int bucket = us == 0 ? 0 : 64 - __builtin_clzll(us);
+        if (bucket >= HISTOGRAM_SIZE) {
+            bucket = HISTOGRAM_SIZE - 1;
+        }
+        ++histogram[bucket];
+    }
+};
+
+#endif
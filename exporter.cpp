@@ -0,0 +1,305 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+#include "exporter.hpp"
+
+#include <cerrno>
+#include <condition_variable>
+#include <cstdio>
+#include <cstring>
+#include <deque>
+#include <memory>
+#include <mutex>
+#include <thread>
+
+#include <zlib.h>
+
+#include "log.hpp"
+#include "pyvalue.hpp"
+
+namespace exporter {
+
+struct chunk {
+    uint64_t first_frame = 0;
+    size_t rows = 0;
+    // Column-major, each column holding chunk_rows_ values
+    std::vector<uint8_t> data;
+};
+
+static FILE *file_ = nullptr;
+// Value size and offset in a row of each column, frame columns first
+static std::vector<size_t> sizes_;
+static std::vector<size_t> offsets_;
+// Latest values, one row
+static std::vector<uint8_t> row_;
+static size_t chunk_rows_ = 0;
+// Chunk being filled by the game thread
+static std::unique_ptr<chunk> filling_;
+static uint64_t frame_ = 0;
+static bool in_frame_ = false;
+static uint64_t rows_ = 0;
+static uint64_t dropped_rows_ = 0;
+
+// Protected by mutex_
+static std::mutex mutex_;
+static std::condition_variable cond_;
+static std::deque<std::unique_ptr<chunk>> full_;
+static std::vector<std::unique_ptr<chunk>> free_;
+static bool stopping_ = false;
+static uint64_t chunks_ = 0;
+static uint64_t bytes_ = 0;
+
+// Writer thread only
+static std::thread writer_;
+static std::vector<uint8_t> compressed_;
+static std::vector<uint32_t> compressed_sizes_;
+static uint64_t raw_columns_ = 0;
+
+template <class T>
+static void put(const T &value) {
+    std::fwrite(&value, sizeof(value), 1, file_);
+}
+
+static void put_string(const char *value) {
+    size_t length = std::strlen(value);
+    if (length > UINT16_MAX) {
+        length = UINT16_MAX;
+    }
+    put(static_cast<uint16_t>(length));
+    std::fwrite(value, 1, length, file_);
+    std::fputc('\0', file_);
+}
+
+static uint64_t render_time(const chunk &rows, size_t row) {
+    uint64_t value;
+    // render_time is the first frame column
+    std::memcpy(&value, rows.data.data() + row * sizeof(value), sizeof(value));
+    return value;
+}
+
+static uint64_t write_chunk(const chunk &rows) {
+    size_t column_count = sizes_.size();
+    compressed_.clear();
+    compressed_sizes_.clear();
+    for (size_t i = 0; i < column_count; ++i) {
+        const uint8_t *column = rows.data.data() + offsets_[i] * chunk_rows_;
+        uLong column_size = rows.rows * sizes_[i];
+        uLongf compressed_size = compressBound(column_size);
+        size_t start = compressed_.size();
+        compressed_.resize(start + compressed_size);
+        int result = compress2(compressed_.data() + start, &compressed_size,
+                               column, column_size, Z_BEST_SPEED);
+        if (result != Z_OK) {
+            if (raw_columns_++ == 0) {
+                log_loader("Could not compress export column %zu: %s. "
+                           "Storing uncompressed.", i, zError(result));
+            }
+            compressed_.resize(start + column_size);
+            std::memcpy(compressed_.data() + start, column, column_size);
+            compressed_sizes_.push_back(column_size | RAW_COLUMN);
+            continue;
+        }
+        compressed_.resize(start + compressed_size);
+        compressed_sizes_.push_back(compressed_size);
+    }
+    std::fwrite(CHUNK_MAGIC, 1, sizeof(CHUNK_MAGIC), file_);
+    put(static_cast<uint32_t>(rows.rows));
+    put(rows.first_frame);
+    put(render_time(rows, 0));
+    put(render_time(rows, rows.rows - 1));
+    std::fwrite(compressed_sizes_.data(), sizeof(uint32_t),
+                compressed_sizes_.size(), file_);
+    std::fwrite(compressed_.data(), 1, compressed_.size(), file_);
+    // Readers see whole chunks, unless the game crashes
+    std::fflush(file_);
+    return sizeof(CHUNK_MAGIC) + sizeof(uint32_t) + 3 * sizeof(uint64_t) +
+        compressed_sizes_.size() * sizeof(uint32_t) + compressed_.size();
+}
+
+static void run_writer() {
+    std::unique_lock<std::mutex> lock(mutex_);
+    while (true) {
+        cond_.wait(lock, [] { return !full_.empty() || stopping_; });
+        if (full_.empty()) {
+            break;
+        }
+        std::unique_ptr<chunk> rows = std::move(full_.front());
+        full_.pop_front();
+        lock.unlock();
+        uint64_t size = write_chunk(*rows);
+        lock.lock();
+        ++chunks_;
+        bytes_ += size;
+        rows->rows = 0;
+        free_.push_back(std::move(rows));
+    }
+}
+
+bool start(const char *path, const std::vector<column> &columns,
+           size_t chunk_rows, size_t max_pending, const char *game_id,
+           const char *game_name, scs_u32_t game_version) {
+    stop();
+    file_ = std::fopen(path, "wb");
+    if (file_ == nullptr) {
+        log_loader("Could not open export \"%s\": %s", path,
+                   std::strerror(errno));
+        return false;
+    }
+    std::fwrite(EXPORT_MAGIC, 1, sizeof(EXPORT_MAGIC), file_);
+    put(EXPORT_VERSION);
+    put(static_cast<uint32_t>(game_version));
+    put_string(game_id);
+    put_string(game_name);
+    put(static_cast<uint32_t>(columns.size()));
+    sizes_.assign(FRAME_COLUMN_COUNT, sizeof(uint64_t));
+    for (const column &col : columns) {
+        size_t size = pyvalue::raw_size(col.type);
+        put(col.internal_id);
+        put(static_cast<uint32_t>(col.index));
+        put(static_cast<uint32_t>(col.type));
+        put(static_cast<uint32_t>(size));
+        put_string(col.name.c_str());
+        sizes_.push_back(size);
+    }
+    std::fflush(file_);
+    offsets_.clear();
+    size_t row_size = 0;
+    for (size_t size : sizes_) {
+        offsets_.push_back(row_size);
+        row_size += size;
+    }
+    row_.assign(row_size, 0);
+    chunk_rows_ = chunk_rows;
+    // Allocated up front, so memory use is bounded
+    for (size_t i = 0; i < max_pending; ++i) {
+        free_.emplace_back(new chunk());
+        free_.back()->data.resize(row_size * chunk_rows);
+    }
+    filling_.reset(new chunk());
+    filling_->data.resize(row_size * chunk_rows);
+    frame_ = 0;
+    in_frame_ = false;
+    rows_ = 0;
+    dropped_rows_ = 0;
+    chunks_ = 0;
+    bytes_ = 0;
+    raw_columns_ = 0;
+    stopping_ = false;
+    writer_ = std::thread(run_writer);
+    log_loader("Exporting %zu columns to \"%s\"", columns.size(), path);
+    return true;
+}
+
+void stop() {
+    if (file_ == nullptr) {
+        return;
+    }
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        if (filling_->rows != 0) {
+            full_.push_back(std::move(filling_));
+        }
+        stopping_ = true;
+    }
+    cond_.notify_one();
+    writer_.join();
+    std::fclose(file_);
+    file_ = nullptr;
+    log_loader("Export stopped: %llu rows, %llu dropped, %llu chunks, %llu bytes, "
+               "%llu uncompressed columns",
+               static_cast<unsigned long long>(rows_),
+               static_cast<unsigned long long>(dropped_rows_),
+               static_cast<unsigned long long>(chunks_),
+               static_cast<unsigned long long>(bytes_),
+               static_cast<unsigned long long>(raw_columns_));
+    filling_.reset();
+    free_.clear();
+    full_.clear();
+    row_.clear();
+    sizes_.clear();
+    offsets_.clear();
+    compressed_.clear();
+    compressed_.shrink_to_fit();
+}
+
+bool active() {
+    return file_ != nullptr;
+}
+
+void set_value(size_t column_index, const scs_value_t *value) {
+    size_t column = FRAME_COLUMN_COUNT + column_index;
+    uint8_t *target = row_.data() + offsets_[column];
+    if (value == nullptr || value->type == SCS_VALUE_TYPE_INVALID) {
+        std::memset(target, 0, sizes_[column]);
+        return;
+    }
+    // All union members start at the same address
+    std::memcpy(target, &value->value_bool, sizes_[column]);
+}
+
+void start_frame(const scs_telemetry_frame_start_t *frame_start) {
+    uint64_t times[FRAME_COLUMN_COUNT] = {
+        frame_start->render_time,
+        frame_start->simulation_time,
+        frame_start->paused_simulation_time,
+    };
+    std::memcpy(row_.data(), times, sizeof(times));
+    in_frame_ = true;
+}
+
+void end_frame() {
+    if (!in_frame_) {
+        // Started in the middle of a frame
+        return;
+    }
+    in_frame_ = false;
+    chunk &rows = *filling_;
+    if (rows.rows == 0) {
+        rows.first_frame = frame_;
+    }
+    ++frame_;
+    for (size_t i = 0; i < sizes_.size(); ++i) {
+        std::memcpy(rows.data.data() + offsets_[i] * chunk_rows_ + rows.rows * sizes_[i],
+                    row_.data() + offsets_[i], sizes_[i]);
+    }
+    ++rows.rows;
+    ++rows_;
+    if (rows.rows < chunk_rows_) {
+        return;
+    }
+    {
+        std::lock_guard<std::mutex> lock(mutex_);
+        if (free_.empty()) {
+            // The writer is behind. Reuse the chunk.
+            dropped_rows_ += rows.rows;
+            rows.rows = 0;
+            return;
+        }
+        full_.push_back(std::move(filling_));
+        filling_ = std::move(free_.back());
+        free_.pop_back();
+    }
+    cond_.notify_one();
+}
+
+counters get_counters() {
+    std::lock_guard<std::mutex> lock(mutex_);
+    return {rows_, chunks_, dropped_rows_, bytes_, full_.size()};
+}
+
+}
@@ -0,0 +1,116 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+// Columnar export of channel values, one row per frame, for offline
+// analysis, see python/pyets2lib/export.py
+//
+// The game thread keeps the latest value of each column and copies them
+// into a chunk at frame end. Full chunks are compressed with zlib and
+// written by a writer thread. A fixed number of chunks is allocated at
+// start, so memory use is bounded: if the writer falls behind, the rows
+// of a chunk are dropped. Columns carry their value forward until it
+// changes, and are zero until the first value.
+//
+// All numbers are in native byte order. Strings are as in recording.hpp.
+//
+// Header:
+//   char[8] magic EXPORT_MAGIC
+//   u32 format version EXPORT_VERSION
+//   u32 game version
+//   string game id
+//   string game name
+//   u32 column count
+//   columns of u32 internal id (ScsChannel.internal_id), u32 index,
+//   u32 value type, u32 value size, string name
+//
+// Chunks, until the end of the file:
+//   char[4] magic CHUNK_MAGIC
+//   u32 row count
+//   u64 first frame, frames counted from the start of the export
+//   u64 render_time of the first and of the last row
+//   u32 compressed size of each frame column and column, with
+//   RAW_COLUMN set if the column is stored uncompressed
+//   the data of each frame column and column, in that order
+//
+// The frame columns are u64 render_time, simulation_time and
+// paused_simulation_time of the frame_start of each row. Uncompressed, a
+// column is row count values of the value size, see pyvalue::raw_size().
+
+#ifndef _EXPORTER_HPP_
+#define _EXPORTER_HPP_
+
+#include <cstddef>
+#include <cstdint>
+#include <string>
+#include <vector>
+
+#include "scssdk_telemetry.h"
+
+namespace exporter {
+
+static const char EXPORT_MAGIC[8] = {'P', 'Y', 'E', 'T', 'S', '2', 'C', 'O'};
+static const uint32_t EXPORT_VERSION = 2;
+static const char CHUNK_MAGIC[4] = {'C', 'H', 'N', 'K'};
+static const size_t FRAME_COLUMN_COUNT = 3;
+// Flag of a column size, if compression failed. Since format version 2.
+static const uint32_t RAW_COLUMN = 0x80000000;
+
+struct column {
+    uint32_t internal_id;
+    scs_u32_t index;
+    scs_value_type_t type;
+    std::string name;
+};
+
+struct counters {
+    uint64_t rows;
+    uint64_t chunks;
+    // Rows dropped as no chunk was free
+    uint64_t dropped_rows;
+    // Bytes written to the file
+    uint64_t bytes;
+    // Chunks waiting for the writer
+    size_t pending;
+};
+
+// Opens path for writing, replacing any existing file, and writes the
+// header. Chunks hold chunk_rows rows, and up to max_pending full chunks
+// wait for the writer. Returns false if the file cannot be opened.
+bool start(const char *path, const std::vector<column> &columns,
+           size_t chunk_rows, size_t max_pending, const char *game_id,
+           const char *game_name, scs_u32_t game_version);
+
+// Writes the rows so far and closes the file
+void stop();
+
+bool active();
+
+// Game thread. Sets the value of a column, in the order of the columns
+// given to start(). value may be nullptr.
+void set_value(size_t column_index, const scs_value_t *value);
+
+void start_frame(const scs_telemetry_frame_start_t *frame_start);
+
+// Game thread. Adds a row with the current values.
+void end_frame();
+
+counters get_counters();
+
+}
+
+#endif
@@ -0,0 +1,172 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+// Native filtering of channel values before they are delivered to a
+// Python listener
+
+#ifndef _FILTER_HPP_
+#define _FILTER_HPP_
+
+#include <cmath>
+#include <cstdint>
+#include <string>
+
+#include "scssdk_telemetry.h"
+
+#include "pyvalue.hpp"
+
+struct channel_filter {
+    // Deliver only values that differ from the last delivered value
+    bool on_change = false;
+    // Deliver only values where a component differs from the last
+    // delivered value by both more than absolute and more than relative
+    // times its magnitude. Implies on_change. 0 disables either.
+    double absolute = 0;
+    double relative = 0;
+    // Deliver at most one value per interval of render time. 0 disables.
+    uint64_t min_interval_us = 0;
+
+    // Last delivered value
+    bool has_last = false;
+    scs_value_t last;
+    std::string last_string;
+    uint64_t last_time_us = 0;
+
+    uint64_t delivered = 0;
+    uint64_t suppressed = 0;
+
+    // Returns true if value should be delivered, at render time now_us
+    bool pass(const scs_value_t *value, uint64_t now_us) {
+        if (!accept(value, now_us)) {
+            ++suppressed;
+            return false;
+        }
+        ++delivered;
+        last_time_us = now_us;
+        if (value == nullptr) {
+            has_last = false;
+            return true;
+        }
+        has_last = true;
+        last = *value;
+        if (value->type == SCS_VALUE_TYPE_string) {
+            last_string = value->value_string.value;
+            last.value_string.value = last_string.c_str();
+        }
+        return true;
+    }
+
+private:
+    bool accept(const scs_value_t *value, uint64_t now_us) const {
+        if (!has_last || value == nullptr || value->type != last.type) {
+            return true;
+        }
+        // The render time restarts with SCS_TELEMETRY_FRAME_START_FLAG_timer_restart
+        if (min_interval_us != 0 && now_us >= last_time_us &&
+            now_us - last_time_us < min_interval_us) {
+            return false;
+        }
+        if (!on_change && absolute == 0 && relative == 0) {
+            return true;
+        }
+        if (value->type == SCS_VALUE_TYPE_string) {
+            return last_string != value->value_string.value;
+        }
+        if (absolute == 0 && relative == 0) {
+            return !pyvalue::raw_equal(last, *value);
+        }
+        double current[6];
+        double previous[6];
+        int count = components(*value, current);
+        components(last, previous);
+        if (count == 0) {
+            return !pyvalue::raw_equal(last, *value);
+        }
+        for (int i = 0; i < count; ++i) {
+            double difference = std::fabs(current[i] - previous[i]);
+            if (difference > absolute &&
+                difference > relative * std::fabs(previous[i])) {
+                return true;
+            }
+        }
+        return false;
+    }
+
+    // Returns the number of numeric components of value, stored in out
+    static int components(const scs_value_t &value, double *out) {
+        switch (value.type) {
+            case SCS_VALUE_TYPE_bool:
+                out[0] = value.value_bool.value;
+                return 1;
+            case SCS_VALUE_TYPE_s32:
+                out[0] = value.value_s32.value;
+                return 1;
+            case SCS_VALUE_TYPE_u32:
+                out[0] = value.value_u32.value;
+                return 1;
+            case SCS_VALUE_TYPE_u64:
+                out[0] = value.value_u64.value;
+                return 1;
+            case SCS_VALUE_TYPE_s64:
+                out[0] = value.value_s64.value;
+                return 1;
+            case SCS_VALUE_TYPE_float:
+                out[0] = value.value_float.value;
+                return 1;
+            case SCS_VALUE_TYPE_double:
+                out[0] = value.value_double.value;
+                return 1;
+            case SCS_VALUE_TYPE_fvector:
+                out[0] = value.value_fvector.x;
+                out[1] = value.value_fvector.y;
+                out[2] = value.value_fvector.z;
+                return 3;
+            case SCS_VALUE_TYPE_dvector:
+                out[0] = value.value_dvector.x;
+                out[1] = value.value_dvector.y;
+                out[2] = value.value_dvector.z;
+                return 3;
+            case SCS_VALUE_TYPE_euler:
+                out[0] = value.value_euler.heading;
+                out[1] = value.value_euler.pitch;
+                out[2] = value.value_euler.roll;
+                return 3;
+            case SCS_VALUE_TYPE_fplacement:
+                out[0] = value.value_fplacement.position.x;
+                out[1] = value.value_fplacement.position.y;
+                out[2] = value.value_fplacement.position.z;
+                out[3] = value.value_fplacement.orientation.heading;
+                out[4] = value.value_fplacement.orientation.pitch;
+                out[5] = value.value_fplacement.orientation.roll;
+                return 6;
+            case SCS_VALUE_TYPE_dplacement:
+                out[0] = value.value_dplacement.position.x;
+                out[1] = value.value_dplacement.position.y;
+                out[2] = value.value_dplacement.position.z;
+                out[3] = value.value_dplacement.orientation.heading;
+                out[4] = value.value_dplacement.orientation.pitch;
+                out[5] = value.value_dplacement.orientation.roll;
+                return 6;
+            default:
+                return 0;
+        }
+    }
+};
+
+#endif
@@ -0,0 +1,118 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+#include <atomic>
+
+#include "frameclock.hpp"
+
+namespace frameclock {
+
+// Written by the game thread, read by any thread holding the GIL
+static std::atomic<uint64_t> sequence_{0};
+static std::atomic<uint64_t> simulation_time_{0};
+
+// Stamp of the delivery in progress on this thread, nullptr for the
+// current frame
+static thread_local const stamp *delivery_ = nullptr;
+
+static PyTypeObject *clock_type_ = nullptr;
+
+void start_frame(const scs_telemetry_frame_start_t *info) {
+    simulation_time_.store(info->simulation_time, std::memory_order_relaxed);
+    sequence_.store(sequence_.load(std::memory_order_relaxed) + 1,
+                    std::memory_order_relaxed);
+}
+
+void reset() {
+    sequence_.store(0, std::memory_order_relaxed);
+    simulation_time_.store(0, std::memory_order_relaxed);
+}
+
+stamp current() {
+    return stamp{sequence_.load(std::memory_order_relaxed),
+                 simulation_time_.load(std::memory_order_relaxed)};
+}
+
+scoped_delivery::scoped_delivery(const stamp &delivery_stamp)
+    : previous_(delivery_) {
+    delivery_ = &delivery_stamp;
+}
+
+scoped_delivery::~scoped_delivery() {
+    delivery_ = previous_;
+}
+
+static PyObject *clock_sequence(PyObject *self, void *closure) {
+    if (delivery_ != nullptr) {
+        return PyLong_FromUnsignedLongLong(delivery_->sequence);
+    }
+    return PyLong_FromUnsignedLongLong(sequence_.load(std::memory_order_relaxed));
+}
+
+static PyObject *clock_simulation_time(PyObject *self, void *closure) {
+    if (delivery_ != nullptr) {
+        return PyLong_FromUnsignedLongLong(delivery_->simulation_time);
+    }
+    return PyLong_FromUnsignedLongLong(
+        simulation_time_.load(std::memory_order_relaxed));
+}
+
+static PyGetSetDef clock_getset[] = {
+    {"sequence", clock_sequence, nullptr,
+     "Number of the frame of the value being delivered", nullptr},
+    {"simulation_time", clock_simulation_time, nullptr,
+     "Simulation time of the frame of the value being delivered, in microseconds",
+     nullptr},
+    {nullptr}
+};
+
+static PyType_Slot clock_slots[] = {
+    {Py_tp_getset, clock_getset},
+    {0, nullptr}
+};
+
+static PyType_Spec clock_spec = {
+    "_telemetry.frame_clock_t",
+    sizeof(PyObject),
+    0,
+    Py_TPFLAGS_DEFAULT,
+    clock_slots
+};
+
+bool add_clock(PyObject *py_module) {
+    clock_type_ = reinterpret_cast<PyTypeObject*>(PyType_FromSpec(&clock_spec));
+    if (clock_type_ == nullptr) {
+        return false;
+    }
+    PyObject *py_clock = PyType_GenericAlloc(clock_type_, 0);
+    if (py_clock == nullptr) {
+        return false;
+    }
+    if (PyModule_AddObject(py_module, "frame_clock", py_clock) != 0) {
+        Py_DECREF(py_clock);
+        return false;
+    }
+    return true;
+}
+
+void clear_clock() {
+    Py_CLEAR(clock_type_);
+}
+
+}
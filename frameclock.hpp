@@ -0,0 +1,81 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+// Timing of the current game frame, decoded from the frame_start event.
+//
+// Each delivered channel value and event carries the stamp of the frame it
+// belongs to. The stamps are plain structs copied next to the values, so
+// stamping allocates nothing. Python reads the stamp of the delivery in
+// progress through a single frame_clock object.
+
+#ifndef _FRAMECLOCK_HPP_
+#define _FRAMECLOCK_HPP_
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include <cstdint>
+
+#include "scssdk_telemetry.h"
+
+namespace frameclock {
+
+struct stamp {
+    // Number of the frame, counted from 1 at the first frame_start.
+    // 0 before the first frame.
+    uint64_t sequence;
+    // Simulation time of the frame, in microseconds
+    uint64_t simulation_time;
+};
+
+// Game thread. Starts a new frame.
+void start_frame(const scs_telemetry_frame_start_t *info);
+
+// Game thread. Restarts the frame count, at shutdown.
+void reset();
+
+// Stamp of the current frame. On other threads than the game thread, the
+// fields may be from different frames around a frame start.
+stamp current();
+
+// Makes frame_clock report the stamp of a value delivered later than its
+// frame, e.g. by the worker thread, on the calling thread, until
+// destroyed. The GIL must be held.
+class scoped_delivery {
+public:
+    explicit scoped_delivery(const stamp &delivery_stamp);
+    ~scoped_delivery();
+
+    scoped_delivery(const scoped_delivery&) = delete;
+    scoped_delivery &operator=(const scoped_delivery&) = delete;
+
+private:
+    const stamp *previous_;
+};
+
+// Creates the frame clock type and adds its single instance to module as
+// frame_clock. Returns false, with a Python error set, on failure.
+bool add_clock(PyObject *py_module);
+
+// Releases the type. Must be called before Py_Finalize().
+void clear_clock();
+
+}
+
+#endif
@@ -17,11 +17,16 @@
 // along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
 //
 
+#include <chrono>
 #include <cstdarg>
 #include <cstdio>
 #include <cstdlib>
+#include <cstring>
+#include <map>
 #include <memory>
+#include <set>
 #include <string>
+#include <thread>
 #include <utility>
 #include <vector>
 
@@ -35,283 +40,2007 @@
 #include "amtrucks/scssdk_ats.h"
 #include "amtrucks/scssdk_telemetry_ats.h"
 
+#include "budget.hpp"
+#include "callstats.hpp"
+#include "exporter.hpp"
+#include "filter.hpp"
+#include "frameclock.hpp"
 #include "pyhelp.hpp"
+#include "pyvalue.hpp"
+#include "recording.hpp"
+#include "shm.hpp"
+#include "subinterp.hpp"
 #include "log.hpp"
 #include "version.hpp"
+#include "worker.hpp"
 
 static scs_telemetry_init_params_v101_t scs_params_;
 static pyhelp::PyObjRef py_module_;
 static PyThreadState *py_thread_state_ = nullptr;
+// Registrations are only allowed from the game thread, as the SCS callbacks
+// read the slots without holding the GIL
+static std::thread::id game_thread_id_;
+// Listeners of a channel callback of the game are running. The game does
+// not allow unregistering from within its channel callbacks.
+static bool in_channel_callback_ = false;
+// Listener call statistics, see pyets2lib.stats
+static bool profiling_ = false;
+static uint64_t slow_threshold_ns_ = 0;
+// Render time of the current frame, for the minimum interval of filters
+static uint64_t render_time_us_ = 0;
+// Python time budget of the game thread, see pyets2lib.loader.configure_budget()
+static frame_budget budget_;
 
-struct cb_context {
+// A Python listener on a channel or an event
+struct listener {
     pyhelp::PyObjRef py_callback;
     pyhelp::PyObjRef py_context;
+    // Index in frame_sinks_ for batched channel listeners, -1 for
+    // immediate delivery to py_callback
+    int frame_sink = -1;
+    // Called on the worker thread instead of the game thread
+    bool threaded = false;
+    // Optional filter of channel values, checked before taking the GIL
+    std::unique_ptr<channel_filter> filter;
+    // The filter of an immediate listener passed the current value
+    bool pending = false;
+    int priority = PRIORITY_normal;
+    // Over the budget, the listener is called later with the latest value,
+    // see channel_slot::deferred_value
+    bool deferred = false;
+    // Unregistered. The entry is kept, as a call to it may be in progress,
+    // and is reused by the next registration on the slot.
+    bool removed = false;
+    // Separate allocation, so it stays in place when the vector grows
+    // during a call
+    std::unique_ptr<call_stats> stats{new call_stats()};
 };
-static std::vector<cb_context> registered_channels_;
-static std::vector<cb_context> registered_events_;
 
+// Element of an array sink, see array_sink
+struct array_target {
+    uint8_t *data;
+    size_t sink_index;
+};
+
+// There is one SCS registration per (channel, index), no matter how many
+// Python listeners there are. The SCS context is the index of the slot in
+// channel_slots_. The registration is released when the slot is no longer
+// used, and the slot is reused for the next channel.
+struct channel_slot {
+    std::string name;
+    scs_u32_t index;
+    scs_value_type_t type;
+    // Arguments passed as is to every listener, created at registration.
+    // py_channel is the pyets2lib.scsdefs.ScsChannel.
+    pyhelp::PyObjRef py_channel;
+    pyhelp::PyObjRef py_index;
+    // Previous value, and its Python object, for reuse by channel_py_value()
+    scs_value_t last_value;
+    pyhelp::PyObjRef py_last_value;
+    std::vector<listener> listeners;
+    // Number of listeners called on the game thread and on the worker
+    // thread. The rest are batched.
+    size_t immediate_count = 0;
+    size_t threaded_count = 0;
+    size_t batched_count = 0;
+    // The worker may hold values of the slot, so it is not reused once
+    // released
+    bool had_threaded = false;
+    // Number of immediate listeners with a filter
+    size_t filtered_count = 0;
+    // Number of critical immediate listeners
+    size_t critical_count = 0;
+    // Number of deferred listeners, and the latest value for them
+    size_t deferred_count = 0;
+    scs_value_t deferred_value;
+    std::string deferred_string;
+    frameclock::stamp deferred_stamp;
+    // Slot offset in store_, or -1 if the value is not stored
+    ssize_t store_offset = -1;
+    // Column in the export, or -1 if the value is not exported
+    ssize_t export_column = -1;
+    // Elements of array sinks that the value is copied to
+    std::vector<array_target> array_targets;
+    // Isolated plug-in hosts, with their keys for the channel
+    std::vector<std::pair<size_t, uint32_t>> hosts;
+};
+static std::vector<channel_slot> channel_slots_;
+static std::map<std::pair<std::string, scs_u32_t>, size_t> channel_slot_indexes_;
+// Indexes of the slots with deferred listeners
+static std::vector<size_t> deferred_slots_;
+// Indexes of released slots, for reuse
+static std::vector<size_t> free_channel_slots_;
+
+// One SCS registration per event. The SCS context is the index of the slot
+// in event_slots_. Released slots have the event SCS_TELEMETRY_EVENT_invalid.
+struct event_slot {
+    scs_event_t event;
+    // pyets2lib.scsdefs.ScsEvent
+    pyhelp::PyObjRef py_event;
+    std::vector<listener> listeners;
+    // Number of listeners that are not removed, and of those the threaded
+    size_t listener_count = 0;
+    size_t threaded_count = 0;
+    bool had_threaded = false;
+    // Used by the loader itself, so never released
+    bool pinned = false;
+    // Isolated plug-in hosts
+    std::vector<size_t> hosts;
+};
+static std::vector<event_slot> event_slots_;
+static std::vector<size_t> free_event_slots_;
+
+// loader.listener_error(callback, exception), which logs exceptions from
+// listeners to the logger of the plug-in
+static pyhelp::PyObjRef py_listener_error_;
+
+// Channel value buffered until the end of the frame
+struct frame_value {
+    size_t slot_index;
+    // Frame the value was sampled in
+    frameclock::stamp stamp;
+    scs_value_t value;
+    // String values are only valid during the callback, so keep a copy
+    std::string string_value;
+};
+
+// Collects the values of batched channels and delivers them to Python
+// in a single call at frame end
+struct frame_sink {
+    pyhelp::PyObjRef py_callback;
+    pyhelp::PyObjRef py_context;
+    // Elements are reused between frames (value_count is the number of
+    // used elements), so no allocations are done once the buffer has
+    // grown to the size of a frame.
+    std::vector<frame_value> values;
+    size_t value_count = 0;
+    std::unique_ptr<call_stats> stats{new call_stats()};
+    int priority = PRIORITY_normal;
+    // Over the budget, the values are kept until a later frame, one per
+    // channel slot. positions holds the index in values per slot, or -1.
+    bool deferred = false;
+    std::vector<ssize_t> positions;
+};
+static std::vector<frame_sink> frame_sinks_;
+
+// Delivers all indexes of a channel, or of all trailers, as one array at
+// frame end. The values are copied into the buffer of py_array, e.g. a
+// NumPy array laid out by pyets2lib.arrays, so the same object is passed
+// every frame, updated in place.
+struct array_sink {
+    pyhelp::PyObjRef py_callback;
+    pyhelp::PyObjRef py_channel;
+    pyhelp::PyObjRef py_array;
+    pyhelp::PyObjRef py_context;
+    // Writable view of py_array, kept until unloading
+    Py_buffer buffer{};
+    // A value changed during the frame, and the frame of the last change
+    bool changed = false;
+    frameclock::stamp stamp;
+    call_stats stats;
+    int priority = PRIORITY_normal;
+
+    ~array_sink() {
+        if (buffer.obj != nullptr) {
+            PyBuffer_Release(&buffer);
+        }
+    }
+};
+// Separate allocations, as buffer must not be copied
+static std::vector<std::unique_ptr<array_sink>> array_sinks_;
+static size_t changed_array_sinks_ = 0;
+
+// Latest value store, read by Python through a memoryview. Each slot is a
+// valid byte followed by the raw value. The layout is decided by
+// pyets2lib.store.
+static std::vector<uint8_t> store_;
+
+
+// telemetry Python module
+
+// Returns a borrowed reference to the Python object for value. The object
+// of the previous call is reused if the raw value has not changed, which
+// saves the allocations for channels that seldom change.
+// The GIL must be held.
+static PyObject *channel_py_value(channel_slot &slot,
+                                  const scs_value_t *value) {
+    // value might be NULL if user has set SCS_TELEMETRY_CHANNEL_FLAG_no_value
+    if (value == nullptr || value->type == SCS_VALUE_TYPE_INVALID) {
+        return Py_None;
+    }
+    if (slot.py_last_value.get() == nullptr ||
+        !pyvalue::raw_equal(slot.last_value, *value)) {
+        slot.py_last_value = pyvalue::create(value);
+        slot.last_value = *value;
+        if (slot.py_last_value.get() == nullptr) {
+            return Py_None;
+        }
+    }
+    return slot.py_last_value.get();
+}
+
+static void write_store_value(ssize_t offset, const scs_value_t *value) {
+    if (value == nullptr || value->type == SCS_VALUE_TYPE_string) {
+        return;
+    }
+    // All union members start at the same address
+    std::memcpy(&store_[offset + 1], &value->value_bool,
+                pyvalue::raw_size(value->type));
+    store_[offset] = 1;
+}
+
+// Returns true if a listener of priority is to be deferred, as the Python
+// time budget of the frame is used up. Only for the game thread.
+static bool over_budget(int priority) {
+    return priority != PRIORITY_critical && budget_.enabled() &&
+        budget_.exceeded();
+}
+
+static void buffer_frame_value(frame_sink &sink, size_t slot_index,
+                               const scs_value_t *value) {
+    ssize_t position = sink.value_count;
+    if (sink.deferred) {
+        // Keep only the latest value of the slot
+        if (slot_index >= sink.positions.size()) {
+            sink.positions.resize(channel_slots_.size(), -1);
+        }
+        if (sink.positions[slot_index] >= 0) {
+            position = sink.positions[slot_index];
+            ++budget_.shed;
+        } else {
+            sink.positions[slot_index] = position;
+        }
+    }
+    if (position == static_cast<ssize_t>(sink.value_count)) {
+        if (sink.value_count == sink.values.size()) {
+            sink.values.emplace_back();
+        }
+        ++sink.value_count;
+    }
+    frame_value &frame_val = sink.values[position];
+    frame_val.slot_index = slot_index;
+    frame_val.stamp = frameclock::current();
+    if (value == nullptr) {
+        // SCS_TELEMETRY_CHANNEL_FLAG_no_value
+        frame_val.value.type = SCS_VALUE_TYPE_INVALID;
+        return;
+    }
+    frame_val.value = *value;
+    if (value->type == SCS_VALUE_TYPE_string) {
+        frame_val.string_value = value->value_string.value;
+    }
+}
+
+// Calls a listener, timing the call if profiling is enabled.
+// The GIL must be held.
+static void call_listener(PyObject *py_callback, PyObject *const *py_args,
+                          size_t nargs, call_stats *stats) {
+    // The listener may unregister, and be replaced, during the call
+    pyhelp::PyObjRef py_callback_ref(py_callback);
+    if (!profiling_) {
+        pyhelp::try_vectorcall(py_callback, py_args, nargs,
+                               py_listener_error_.get());
+        return;
+    }
+    auto start = std::chrono::steady_clock::now();
+    pyhelp::try_vectorcall(py_callback, py_args, nargs,
+                           py_listener_error_.get());
+    auto elapsed = std::chrono::steady_clock::now() - start;
+    stats->add(std::chrono::duration_cast<std::chrono::nanoseconds>(elapsed).count(),
+               slow_threshold_ns_);
+}
+
+// Keeps the buffered values of a frame sink for a later frame, leaving
+// only the latest value per channel slot
+static void defer_frame_sink(frame_sink &sink) {
+    ++budget_.deferred;
+    if (sink.deferred) {
+        return;
+    }
+    sink.positions.assign(channel_slots_.size(), -1);
+    size_t count = 0;
+    for (size_t i = 0; i < sink.value_count; ++i) {
+        ssize_t &position = sink.positions[sink.values[i].slot_index];
+        if (position >= 0) {
+            std::swap(sink.values[position], sink.values[i]);
+            ++budget_.shed;
+            continue;
+        }
+        position = count;
+        if (i != count) {
+            std::swap(sink.values[count], sink.values[i]);
+        }
+        ++count;
+    }
+    sink.value_count = count;
+    sink.deferred = true;
+}
+
+// Calls the Python callback of each frame sink with the list of
+// (channel, index, value) tuples buffered during the frame, or since it
+// was deferred. frame_clock reports the frame of the newest value.
+// The GIL must be held.
+static void deliver_frame_sinks() {
+    // Callbacks may register more sinks, which reallocates the vector, so
+    // access by index and do not use sink after the call
+    for (size_t j = 0; j < frame_sinks_.size(); ++j) {
+        frame_sink &sink = frame_sinks_[j];
+        if (sink.value_count == 0) {
+            continue;
+        }
+        if (over_budget(sink.priority)) {
+            defer_frame_sink(sink);
+            continue;
+        }
+        sink.deferred = false;
+        frameclock::stamp newest = sink.values[0].stamp;
+        size_t value_count = sink.value_count;
+        sink.value_count = 0;
+        auto py_values(pyhelp::PyObjRef::steal(PyList_New(value_count)));
+        if (py_values.get() == nullptr) {
+            pyhelp::log_and_clear_py_err();
+            continue;
+        }
+        bool ok = true;
+        for (size_t i = 0; i < value_count; ++i) {
+            frame_value &frame_val = sink.values[i];
+            if (frame_val.stamp.sequence > newest.sequence) {
+                newest = frame_val.stamp;
+            }
+            if (frame_val.value.type == SCS_VALUE_TYPE_string) {
+                frame_val.value.value_string.value = frame_val.string_value.c_str();
+            }
+            channel_slot &slot = channel_slots_[frame_val.slot_index];
+            PyObject *py_value = channel_py_value(slot, &frame_val.value);
+            PyObject *py_tuple = PyTuple_Pack(3, slot.py_channel.get(),
+                                              slot.py_index.get(), py_value);
+            if (py_tuple == nullptr) {
+                ok = false;
+                break;
+            }
+            // PyList_SET_ITEM steals the reference to the tuple
+            PyList_SET_ITEM(py_values.get(), i, py_tuple);
+        }
+        if (!ok) {
+            // The values of the frame are lost
+            pyhelp::log_and_clear_py_err();
+            continue;
+        }
+        // Kept, as sink may move during the call
+        pyhelp::PyObjRef py_context(sink.py_context);
+        PyObject *py_args[] = {py_values.get(), py_context.get()};
+        frameclock::scoped_delivery delivery(newest);
+        call_listener(sink.py_callback.get(), py_args, 2, sink.stats.get());
+    }
+}
+
+static void write_array_values(channel_slot &slot, const scs_value_t *value) {
+    if (value == nullptr || value->type == SCS_VALUE_TYPE_string) {
+        return;
+    }
+    size_t size = pyvalue::raw_size(value->type);
+    for (const array_target &target : slot.array_targets) {
+        // All union members start at the same address
+        if (std::memcmp(target.data, &value->value_bool, size) == 0) {
+            continue;
+        }
+        std::memcpy(target.data, &value->value_bool, size);
+        array_sink &sink = *array_sinks_[target.sink_index];
+        sink.stamp = frameclock::current();
+        if (!sink.changed) {
+            sink.changed = true;
+            ++changed_array_sinks_;
+        }
+    }
+}
+
+// Calls the Python callback of each array sink that changed during the
+// frame, or since it was deferred. frame_clock reports the frame of the
+// last change. The GIL must be held.
+static void deliver_array_sinks() {
+    size_t deferred = 0;
+    // Callbacks may register more sinks, so access by index
+    for (size_t i = 0; i < array_sinks_.size(); ++i) {
+        array_sink &sink = *array_sinks_[i];
+        if (!sink.changed) {
+            continue;
+        }
+        if (over_budget(sink.priority)) {
+            // The array keeps the latest values
+            ++budget_.deferred;
+            ++deferred;
+            continue;
+        }
+        sink.changed = false;
+        PyObject *py_args[] = {
+            sink.py_channel.get(),
+            sink.py_array.get(),
+            sink.py_context.get()
+        };
+        frameclock::scoped_delivery delivery(sink.stamp);
+        call_listener(sink.py_callback.get(), py_args, 3, &sink.stats);
+    }
+    changed_array_sinks_ = deferred;
+}
+
+// Postpones the call of a channel listener until the budget allows,
+// keeping only the latest value
+static void defer_channel_listener(size_t slot_index, listener &listener_val,
+                                   const scs_value_t *value) {
+    channel_slot &slot = channel_slots_[slot_index];
+    if (listener_val.deferred) {
+        // Replaces the previous deferred value
+        ++budget_.shed;
+    } else {
+        listener_val.deferred = true;
+        ++budget_.deferred;
+        if (slot.deferred_count++ == 0) {
+            deferred_slots_.push_back(slot_index);
+        }
+    }
+    slot.deferred_stamp = frameclock::current();
+    if (value == nullptr) {
+        slot.deferred_value.type = SCS_VALUE_TYPE_INVALID;
+        return;
+    }
+    slot.deferred_value = *value;
+    if (value->type == SCS_VALUE_TYPE_string) {
+        slot.deferred_string = value->value_string.value;
+        slot.deferred_value.value_string.value = slot.deferred_string.c_str();
+    }
+}
+
+// Defers all immediate listeners of the channel that are to be called,
+// without touching Python
+static void defer_channel_listeners(size_t slot_index,
+                                    const scs_value_t *value) {
+    for (listener &listener_val : channel_slots_[slot_index].listeners) {
+        if (listener_val.removed || listener_val.frame_sink >= 0 ||
+            listener_val.threaded ||
+            (listener_val.filter != nullptr && !listener_val.pending)) {
+            continue;
+        }
+        defer_channel_listener(slot_index, listener_val, value);
+    }
+}
+
+// Calls the deferred channel listeners, highest priority first, as long
+// as the budget allows. The GIL must be held.
+static void call_deferred_listeners() {
+    for (int priority = PRIORITY_normal; priority < PRIORITY_COUNT; ++priority) {
+        for (size_t j = 0; j < deferred_slots_.size(); ++j) {
+            size_t slot_index = deferred_slots_[j];
+            // Listeners may register for more channels, which reallocates
+            // the vectors, so access by index
+            for (size_t i = 0; i < channel_slots_[slot_index].listeners.size(); ++i) {
+                channel_slot &slot = channel_slots_[slot_index];
+                listener &listener_val = slot.listeners[i];
+                if (!listener_val.deferred || listener_val.priority != priority) {
+                    continue;
+                }
+                if (budget_.exceeded()) {
+                    return;
+                }
+                listener_val.deferred = false;
+                --slot.deferred_count;
+                // Copied, as the slot may move during the call
+                frameclock::stamp deferred_stamp = slot.deferred_stamp;
+                frameclock::scoped_delivery delivery(deferred_stamp);
+                pyhelp::PyObjRef py_value(channel_py_value(slot, &slot.deferred_value));
+                PyObject *py_args[] = {
+                    slot.py_channel.get(),
+                    slot.py_index.get(),
+                    py_value.get(),
+                    listener_val.py_context.get()
+                };
+                call_listener(listener_val.py_callback.get(), py_args, 4,
+                              listener_val.stats.get());
+            }
+        }
+    }
+}
+
+static void deliver_deferred_listeners() {
+    call_deferred_listeners();
+    size_t count = 0;
+    for (size_t slot_index : deferred_slots_) {
+        if (channel_slots_[slot_index].deferred_count != 0) {
+            deferred_slots_[count++] = slot_index;
+        }
+    }
+    deferred_slots_.resize(count);
+}
+
+// Calls the immediate or the threaded listeners of the channel.
+// The GIL must be held.
+static void call_channel_listeners(size_t slot_index, const scs_value_t *value,
+                                   bool threaded) {
+    channel_slot &slot = channel_slots_[slot_index];
+    // Keep a reference, as the other thread may replace py_last_value
+    // while a listener runs
+    pyhelp::PyObjRef py_value(channel_py_value(slot, value));
+    PyObject *py_args[] = {
+        slot.py_channel.get(),
+        slot.py_index.get(),
+        py_value.get(),
+        nullptr
+    };
+    // Listeners may register for more channels, which reallocates
+    // the vectors, so access by index
+    for (size_t i = 0; i < channel_slots_[slot_index].listeners.size(); ++i) {
+        listener &listener_val = channel_slots_[slot_index].listeners[i];
+        if (listener_val.removed || listener_val.frame_sink >= 0 ||
+            listener_val.threaded != threaded) {
+            continue;
+        }
+        if (listener_val.filter != nullptr && !listener_val.pending) {
+            continue;
+        }
+        if (!threaded) {
+            if (over_budget(listener_val.priority)) {
+                defer_channel_listener(slot_index, listener_val, value);
+                continue;
+            }
+            if (listener_val.deferred) {
+                // The deferred value is replaced by this one
+                listener_val.deferred = false;
+                --channel_slots_[slot_index].deferred_count;
+                ++budget_.shed;
+            }
+        }
+        py_args[3] = listener_val.py_context.get();
+        call_listener(listener_val.py_callback.get(), py_args, 4,
+                      listener_val.stats.get());
+    }
+}
+
+// Checks the value against the filters of the immediate listeners of the
+// channel. Returns true if any immediate listener is to be called.
+static bool filter_immediate_listeners(channel_slot &slot,
+                                       const scs_value_t *value) {
+    bool any_pending = slot.immediate_count != slot.filtered_count;
+    for (listener &listener_val : slot.listeners) {
+        if (listener_val.filter == nullptr || listener_val.frame_sink >= 0 ||
+            listener_val.removed) {
+            continue;
+        }
+        listener_val.pending = listener_val.filter->pass(value, render_time_us_);
+        any_pending = any_pending || listener_val.pending;
+    }
+    return any_pending;
+}
+
+SCSAPI_VOID telemetry_channel_cb(const scs_string_t name,
+                                 const scs_u32_t index,
+                                 const scs_value_t *const value,
+                                 const scs_context_t context) {
+    size_t slot_index = reinterpret_cast<uintptr_t>(context);
+    if (slot_index >= channel_slots_.size()) {
+        log_loader("ERROR! Channel slot_index=%zu > size()=%zu. Ignoring callback.",
+                   slot_index, channel_slots_.size());
+        return;
+    }
+    channel_slot &slot = channel_slots_[slot_index];
+
+    if (recording::active()) {
+        recording::write_value(slot_index, slot.name.c_str(), slot.index,
+                               slot.type, value);
+    }
+
+    if (slot.store_offset >= 0) {
+        write_store_value(slot.store_offset, value);
+    }
+
+    if (slot.export_column >= 0) {
+        exporter::set_value(slot.export_column, value);
+    }
+
+    if (!slot.array_targets.empty()) {
+        write_array_values(slot, value);
+    }
+
+    if (slot.threaded_count != 0) {
+        worker::push_channel(slot_index, value);
+    }
+
+    for (auto &host_key : slot.hosts) {
+        subinterp::push_channel(host_key.first, host_key.second, value);
+    }
+
+    if (slot.batched_count != 0) {
+        // Batched listeners. Just copy the value, without touching Python.
+        for (listener &listener_val : slot.listeners) {
+            if (listener_val.frame_sink >= 0 && !listener_val.removed &&
+                (listener_val.filter == nullptr ||
+                 listener_val.filter->pass(value, render_time_us_))) {
+                buffer_frame_value(frame_sinks_[listener_val.frame_sink],
+                                   slot_index, value);
+            }
+        }
+    }
+
+    if (slot.immediate_count == 0) {
+        return;
+    }
+
+    if (slot.filtered_count != 0 && !filter_immediate_listeners(slot, value)) {
+        // Filtered out, without touching Python
+        return;
+    }
+
+    if (slot.critical_count == 0 && budget_.enabled() && budget_.exceeded()) {
+        // Over the budget, without touching Python
+        defer_channel_listeners(slot_index, value);
+        return;
+    }
+    
+    PyEval_RestoreThread(py_thread_state_);
+
+    { // Make sure no pyhelp::PyObjRef ref counting happens after PyEval_SaveThread()
+        budget_.enter();
+        in_channel_callback_ = true;
+        call_channel_listeners(slot_index, value, false);
+        in_channel_callback_ = false;
+        budget_.leave();
+    }
+    py_thread_state_ = PyEval_SaveThread();
+}
+
+// The GIL must be held
+static pyhelp::PyObjRef create_py_event_info(const scs_event_t event,
+                                             const void *const event_info) {
+    pyhelp::PyObjRef py_value(Py_None);
+
+    // Config and gameplay events are rare, so they are dicts
+    switch (event) {
+        // TODO: Implement all event types
+        case SCS_TELEMETRY_EVENT_frame_start:
+            // Same fields as pyets2lib.recording
+            py_value = pyvalue::create_frame_start(
+                static_cast<const scs_telemetry_frame_start_t*>(event_info));
+            break;
+        case SCS_TELEMETRY_EVENT_frame_end:
+            break;
+        case SCS_TELEMETRY_EVENT_paused:
+            // No value
+            break;
+        case SCS_TELEMETRY_EVENT_started:
+            // No value
+            break;
+        case SCS_TELEMETRY_EVENT_gameplay:
+            // Intentional fall-through. The struct layouts are the same.
+        case SCS_TELEMETRY_EVENT_configuration:
+            auto config = static_cast<const scs_telemetry_configuration_t *const>(event_info);
+            py_value = pyhelp::PyObjRef::steal(PyDict_New());
+            auto py_id(pyhelp::PyObjRef::steal(PyUnicode_FromString(config->id)));
+            PyDict_SetItemString(py_value.get(), "id", py_id.get());
+            auto py_attr_list(pyhelp::PyObjRef::steal(PyList_New(0)));
+            PyDict_SetItemString(py_value.get(), "attributes",
+                                 py_attr_list.get());
+            const scs_named_value_t *current_attr = config->attributes;
+            for (; current_attr->name != nullptr; ++current_attr) {
+                pyhelp::PyObjRef py_attr_value(pyvalue::create(&current_attr->value));
+                if (py_attr_value.get() == nullptr) {
+                    py_attr_value.set(Py_None);
+                }
+
+                pyhelp::PyObjRef py_index(Py_None);
+                if (current_attr->index != SCS_U32_NIL) {
+                    py_index = pyhelp::PyObjRef::steal(
+                        PyLong_FromUnsignedLong(current_attr->index));
+                }
+
+                // Attribute names repeat between events
+                auto py_name(pyhelp::PyObjRef::steal(
+                                 PyUnicode_InternFromString(current_attr->name)));
+                auto py_attr_tuple(pyhelp::PyObjRef::steal(PyTuple_Pack(
+                    3,
+                    py_name.get(),
+                    py_index.get(),
+                    py_attr_value.get())));
+
+                PyList_Append(py_attr_list.get(), py_attr_tuple.get());
+            }
+            break;
+            //default:
+            // Keep None-value
+    }
+    return py_value;
+}
+
+// Calls the immediate or the threaded listeners of the event, with the
+// event info converted once. The GIL must be held.
+static void call_event_listeners(size_t slot_index,
+                                 const void *const event_info,
+                                 bool threaded) {
+    event_slot &slot = event_slots_[slot_index];
+    // Other events are always delivered, as they are not repeated
+    bool frame_event = slot.event == SCS_TELEMETRY_EVENT_frame_start ||
+        slot.event == SCS_TELEMETRY_EVENT_frame_end;
+    pyhelp::PyObjRef py_value(create_py_event_info(slot.event, event_info));
+    if (py_value.get() == nullptr) {
+        pyhelp::log_and_clear_py_err();
+        py_value.set(Py_None);
+    }
+    PyObject *py_args[] = {slot.py_event.get(), py_value.get(), nullptr};
+    // Listeners may register for more events, so access by index
+    for (size_t i = 0; i < event_slots_[slot_index].listeners.size(); ++i) {
+        listener &listener_val = event_slots_[slot_index].listeners[i];
+        if (listener_val.removed || listener_val.threaded != threaded) {
+            continue;
+        }
+        if (!threaded && frame_event && over_budget(listener_val.priority)) {
+            // Called again next frame
+            ++budget_.shed;
+            continue;
+        }
+        py_args[2] = listener_val.py_context.get();
+        call_listener(listener_val.py_callback.get(), py_args, 3,
+                      listener_val.stats.get());
+    }
+}
+
+SCSAPI_VOID telemetry_event_cb(const scs_event_t event,
+                               const void *const event_info,
+                               const scs_context_t context) {
+    size_t slot_index = reinterpret_cast<uintptr_t>(context);
+    if (slot_index >= event_slots_.size()) {
+        log_loader("ERROR! Event slot_index=%zu > size()=%zu. Ignoring callback.",
+                   slot_index, event_slots_.size());
+        return;
+    }
+    if (recording::active()) {
+        recording::write_event(event, event_info);
+    }
+    if (shm::active() && event == SCS_TELEMETRY_EVENT_configuration) {
+        shm::set_configuration(
+            static_cast<const scs_telemetry_configuration_t*>(event_info));
+    }
+    event_slot &slot = event_slots_[slot_index];
+    if (slot.threaded_count != 0) {
+        worker::push_event(slot_index, event, event_info);
+        worker::notify();
+    }
+    for (size_t host : slot.hosts) {
+        subinterp::push_event(host, event);
+    }
+    if (slot.threaded_count == slot.listener_count) {
+        return;
+    }
+    
+    PyEval_RestoreThread(py_thread_state_);
+
+    { // Make sure no pyhelp::PyObjRef ref counting happens after PyEval_SaveThread()
+        budget_.enter();
+        call_event_listeners(slot_index, event_info, false);
+        budget_.leave();
+    }
+    py_thread_state_ = PyEval_SaveThread();
+}
+
+// Defined with the slot functions
+static void apply_host_requests();
+
+// Registered by the loader for SCS_TELEMETRY_EVENT_frame_start and
+// SCS_TELEMETRY_EVENT_frame_end, as they drive the delivery of batched
+// values. Only enters Python when there is something to deliver.
+SCSAPI_VOID telemetry_frame_cb(const scs_event_t event,
+                               const void *const event_info,
+                               const scs_context_t context) {
+    size_t slot_index = reinterpret_cast<uintptr_t>(context);
+    if (event == SCS_TELEMETRY_EVENT_frame_start) {
+        // Before anything is stamped with the frame
+        frameclock::start_frame(
+            static_cast<const scs_telemetry_frame_start_t*>(event_info));
+    }
+    if (recording::active()) {
+        recording::write_event(event, event_info);
+    }
+    event_slot &slot = event_slots_[slot_index];
+    if (slot.threaded_count != 0) {
+        worker::push_event(slot_index, event, event_info);
+    }
+    for (size_t host : slot.hosts) {
+        subinterp::push_event(host, event);
+    }
+    if (event == SCS_TELEMETRY_EVENT_frame_start) {
+        render_time_us_ = static_cast<const scs_telemetry_frame_start_t*>(
+            event_info)->render_time;
+        budget_.start_frame();
+        if (subinterp::have_requests()) {
+            PyEval_RestoreThread(py_thread_state_);
+            apply_host_requests();
+            py_thread_state_ = PyEval_SaveThread();
+        }
+    } else {
+        // Hand the values of the frame to the worker and the isolated
+        // plug-ins
+        worker::notify();
+        subinterp::notify();
+    }
+    if (shm::active()) {
+        if (event == SCS_TELEMETRY_EVENT_frame_start) {
+            shm::set_frame_start(
+                static_cast<const scs_telemetry_frame_start_t*>(event_info));
+        } else {
+            shm::publish(store_.data());
+        }
+    }
+    if (exporter::active()) {
+        if (event == SCS_TELEMETRY_EVENT_frame_start) {
+            exporter::start_frame(
+                static_cast<const scs_telemetry_frame_start_t*>(event_info));
+        } else {
+            exporter::end_frame();
+        }
+    }
+    bool have_listeners = slot.threaded_count != slot.listener_count;
+    bool have_values = false;
+    bool have_arrays = false;
+    bool have_deferred = false;
+    if (event == SCS_TELEMETRY_EVENT_frame_end) {
+        have_arrays = changed_array_sinks_ != 0;
+        have_deferred = !deferred_slots_.empty();
+        for (const frame_sink &sink : frame_sinks_) {
+            if (sink.value_count != 0) {
+                have_values = true;
+                break;
+            }
+        }
+    }
+    if (!have_listeners && !have_values && !have_arrays && !have_deferred) {
+        return;
+    }
+
+    PyEval_RestoreThread(py_thread_state_);
+
+    { // Make sure no pyhelp::PyObjRef ref counting happens after PyEval_SaveThread()
+        budget_.enter();
+        if (have_deferred) {
+            deliver_deferred_listeners();
+        }
+        if (have_values) {
+            deliver_frame_sinks();
+        }
+        if (have_arrays) {
+            deliver_array_sinks();
+        }
+        if (have_listeners) {
+            call_event_listeners(slot_index, event_info, false);
+        }
+        budget_.leave();
+    }
+    py_thread_state_ = PyEval_SaveThread();
+}
+
+// Delivers a record queued by the SCS callbacks, on the worker thread.
+// The GIL is held.
+static void dispatch_threaded(const worker::record &rec,
+                              const void *event_info) {
+    frameclock::scoped_delivery delivery(rec.stamp);
+    if (rec.kind == worker::RECORD_channel) {
+        call_channel_listeners(rec.slot_index, &rec.value, true);
+    } else {
+        call_event_listeners(rec.slot_index, event_info, true);
+    }
+}
+
+// Returns the index of the slot of the event, or -1 if there is none
+static ssize_t find_event_slot(scs_event_t event) {
+    for (size_t i = 0; i < event_slots_.size(); ++i) {
+        if (event_slots_[i].event == event) {
+            return i;
+        }
+    }
+    return -1;
+}
+
+// Returns the index of the slot of the event, registering the event with
+// SCS on first use. Returns -1 and sets result on failure.
+static ssize_t get_event_slot(scs_event_t event, SCSAPI_RESULT &result) {
+    ssize_t slot_index = find_event_slot(event);
+    if (slot_index >= 0) {
+        return slot_index;
+    }
+    bool reuse = !free_event_slots_.empty();
+    slot_index = reuse ? free_event_slots_.back() : event_slots_.size();
+    result = scs_params_.register_for_event(event, telemetry_event_cb,
+                                            reinterpret_cast<void*>(slot_index));
+    if (result != SCS_RESULT_ok) {
+        return -1;
+    }
+    if (reuse) {
+        free_event_slots_.pop_back();
+    } else {
+        event_slots_.emplace_back();
+    }
+    event_slot &slot = event_slots_[slot_index];
+    slot.event = event;
+    slot.py_event.reset();
+    return slot_index;
+}
+
+// Releases the SCS registration of the event slot if it has no listeners,
+// making the slot available for reuse
+static void release_event_slot(size_t slot_index) {
+    event_slot &slot = event_slots_[slot_index];
+    if (slot.listener_count != 0 || slot.pinned || !slot.hosts.empty() ||
+        recording::active()) {
+        return;
+    }
+    SCSAPI_RESULT result = scs_params_.unregister_from_event(slot.event);
+    if (result != SCS_RESULT_ok) {
+        // Still registered with the slot index as context, so keep the slot
+        log_loader("ERROR! Failed to unregister from event %u: %d",
+                   slot.event, result);
+        return;
+    }
+    slot.event = SCS_TELEMETRY_EVENT_invalid;
+    if (!slot.had_threaded) {
+        free_event_slots_.push_back(slot_index);
+    }
+}
+
+// Returns the index of the slot of the channel, registering the channel
+// with SCS on first use. Returns -1 and sets result on failure.
+static ssize_t get_channel_slot(const char *name, scs_u32_t index,
+                                scs_value_type_t type, scs_u32_t flags,
+                                PyObject *py_channel, SCSAPI_RESULT &result) {
+    auto key = std::make_pair(std::string(name), index);
+    auto slot_it = channel_slot_indexes_.find(key);
+    if (slot_it != channel_slot_indexes_.end()) {
+        channel_slot &slot = channel_slots_[slot_it->second];
+        if (slot.type != type) {
+            result = SCS_RESULT_invalid_parameter;
+            return -1;
+        }
+        if (slot.py_channel.get() == Py_None) {
+            // Registered by an isolated plug-in only
+            slot.py_channel.set(py_channel);
+        }
+        return slot_it->second;
+    }
+
+    bool reuse = !free_channel_slots_.empty();
+    size_t slot_index = reuse ? free_channel_slots_.back() : channel_slots_.size();
+    result = scs_params_.register_for_channel(name, index, type, flags,
+                                              telemetry_channel_cb,
+                                              reinterpret_cast<void*>(slot_index));
+    if (result != SCS_RESULT_ok) {
+        return -1;
+    }
+    // Cannot store pointer to element in the vector, as the vector
+    // reallocates when it grows. Using index instead.
+    if (reuse) {
+        free_channel_slots_.pop_back();
+    } else {
+        channel_slots_.emplace_back();
+    }
+    channel_slot &slot = channel_slots_[slot_index];
+    slot.name = name;
+    slot.index = index;
+    slot.type = type;
+    slot.py_channel.set(py_channel);
+    slot.py_index = pyhelp::PyObjRef::steal(PyLong_FromUnsignedLong(index));
+    slot.py_last_value.reset();
+    channel_slot_indexes_[key] = slot_index;
+    return slot_index;
+}
+
+// Removes the buffered values of a channel slot from the frame sinks
+static void purge_frame_values(size_t slot_index) {
+    for (frame_sink &sink : frame_sinks_) {
+        size_t count = 0;
+        for (size_t i = 0; i < sink.value_count; ++i) {
+            if (sink.values[i].slot_index == slot_index) {
+                continue;
+            }
+            if (i != count) {
+                std::swap(sink.values[count], sink.values[i]);
+            }
+            if (sink.deferred) {
+                sink.positions[sink.values[count].slot_index] = count;
+            }
+            ++count;
+        }
+        sink.value_count = count;
+        if (sink.deferred && slot_index < sink.positions.size()) {
+            sink.positions[slot_index] = -1;
+        }
+    }
+}
+
+// Releases the SCS registration of the channel slot if it is no longer
+// used, making the slot available for reuse
+static void release_channel_slot(size_t slot_index) {
+    channel_slot &slot = channel_slots_[slot_index];
+    if (slot.immediate_count + slot.threaded_count + slot.batched_count != 0 ||
+        slot.store_offset >= 0 || slot.export_column >= 0 ||
+        !slot.array_targets.empty() || !slot.hosts.empty() ||
+        recording::active()) {
+        return;
+    }
+    SCSAPI_RESULT result = scs_params_.unregister_from_channel(slot.name.c_str(),
+                                                               slot.index,
+                                                               slot.type);
+    if (result != SCS_RESULT_ok) {
+        // Still registered with the slot index as context, so keep the slot
+        log_loader("ERROR! Failed to unregister from channel %s[%u]: %d",
+                   slot.name.c_str(), slot.index, result);
+        return;
+    }
+    channel_slot_indexes_.erase(std::make_pair(slot.name, slot.index));
+    purge_frame_values(slot_index);
+    // The Python objects are kept until reuse, as a listener of the slot
+    // may be running
+    slot.name.clear();
+    if (!slot.had_threaded) {
+        free_channel_slots_.push_back(slot_index);
+    }
+}
+
+// Returns the entry for a new listener, reusing a removed one
+static listener &add_listener(std::vector<listener> &listeners) {
+    for (listener &listener_val : listeners) {
+        if (listener_val.removed) {
+            listener_val.removed = false;
+            *listener_val.stats = call_stats();
+            return listener_val;
+        }
+    }
+    listeners.emplace_back();
+    return listeners.back();
+}
+
+static void remove_channel_listener(channel_slot &slot, listener &listener_val) {
+    listener_val.removed = true;
+    if (listener_val.threaded) {
+        --slot.threaded_count;
+    } else if (listener_val.frame_sink >= 0) {
+        --slot.batched_count;
+    } else {
+        --slot.immediate_count;
+        if (listener_val.filter != nullptr) {
+            --slot.filtered_count;
+        }
+        if (listener_val.priority == PRIORITY_critical) {
+            --slot.critical_count;
+        }
+    }
+    if (listener_val.deferred) {
+        listener_val.deferred = false;
+        --slot.deferred_count;
+    }
+    listener_val.filter.reset();
+    listener_val.pending = false;
+}
+
+static std::vector<subinterp::request> host_requests_;
+
+// Registers the channels and events requested by isolated plug-ins. The
+// GIL must be held, as new slots get Python objects.
+static void apply_host_requests() {
+    host_requests_.clear();
+    subinterp::take_requests(host_requests_);
+    for (const subinterp::request &req : host_requests_) {
+        SCSAPI_RESULT result = SCS_RESULT_ok;
+        if (req.is_event) {
+            ssize_t slot_index = get_event_slot(req.event, result);
+            if (slot_index >= 0) {
+                event_slots_[slot_index].hosts.push_back(req.host);
+                continue;
+            }
+            log_loader("Could not register isolated plug-in for event %u: %d",
+                       req.event, result);
+        } else {
+            ssize_t slot_index = get_channel_slot(req.name.c_str(), req.index,
+                                                  req.type,
+                                                  SCS_TELEMETRY_CHANNEL_FLAG_none,
+                                                  Py_None, result);
+            if (slot_index >= 0) {
+                channel_slots_[slot_index].hosts.emplace_back(req.host, req.key);
+                continue;
+            }
+            log_loader("Could not register isolated plug-in for channel %s: %d",
+                       req.name.c_str(), result);
+        }
+    }
+    host_requests_.clear();
+}
+
+namespace pymod {
+
+static PyObject *log(PyObject *self, PyObject *arg) {
+    // A message, or a list of messages from pyets2lib.logqueue
+    std::vector<std::string> messages;
+    if (PyList_Check(arg)) {
+        messages.reserve(PyList_GET_SIZE(arg));
+        for (Py_ssize_t i = 0; i < PyList_GET_SIZE(arg); ++i) {
+            const char *message = PyUnicode_AsUTF8AndSize(PyList_GET_ITEM(arg, i),
+                                                          nullptr);
+            if (message == nullptr) {
+                PyErr_SetString(PyExc_TypeError, "Log message must be string");
+                return nullptr;
+            }
+            messages.emplace_back(message);
+        }
+    } else {
+        const char *message = PyUnicode_AsUTF8AndSize(arg, nullptr);
+        if (message == nullptr) {
+            PyErr_SetString(PyExc_TypeError, "Log message must be string");
+            return nullptr;
+        }
+        messages.emplace_back(message);
+    }
+    // The game console may be slow, so let other threads run
+    Py_BEGIN_ALLOW_THREADS
+    for (const std::string &message : messages) {
+        log_py(message.c_str());
+    }
+    Py_END_ALLOW_THREADS
+    Py_RETURN_NONE;
+}
+
+// Returns false, with a Python error set, if priority is not valid
+static bool check_priority(int priority) {
+    if (priority < PRIORITY_critical || priority >= PRIORITY_COUNT) {
+        PyErr_SetString(PyExc_ValueError, "Invalid priority");
+        return false;
+    }
+    return true;
+}
+
+// Returns false, with a Python error set, if not called on the game thread,
+// or if unregistering within a channel callback
+static bool check_game_thread(bool unregistering = false) {
+    if (std::this_thread::get_id() != game_thread_id_) {
+        PyErr_SetString(PyExc_RuntimeError,
+                        "Registrations must be done on the game thread");
+        return false;
+    }
+    if (unregistering && in_channel_callback_) {
+        PyErr_SetString(PyExc_RuntimeError,
+                        "Cannot unregister within a channel callback, "
+                        "unregister from an event callback, e.g. frame_end");
+        return false;
+    }
+    return true;
+}
+
+static PyObject *register_for_channel(PyObject *self, PyObject *args) {
+    const char *name;
+    scs_u32_t index;
+    scs_value_type_t type;
+    scs_u32_t flags;
+    PyObject *py_channel;
+    PyObject *py_callback;
+    PyObject *py_context;
+    int frame_sink = -1;
+    int threaded = 0;
+    PyObject *py_filter = Py_None;
+    int priority = PRIORITY_normal;
+    if (!PyArg_ParseTuple(args, "sIIIOOO|ipOi", &name, &index, &type,
+                          &flags, &py_channel, &py_callback,
+                          &py_context, &frame_sink, &threaded, &py_filter,
+                          &priority)) {
+        return nullptr;
+    }
+    if (!check_priority(priority)) {
+        return nullptr;
+    }
+    std::unique_ptr<channel_filter> filter;
+    if (py_filter != Py_None) {
+        filter.reset(new channel_filter());
+        int on_change = 0;
+        unsigned long long min_interval_us = 0;
+        if (!PyArg_ParseTuple(py_filter, "pddK;filter must be a (on_change, "
+                              "absolute, relative, min_interval_us) tuple",
+                              &on_change, &filter->absolute, &filter->relative,
+                              &min_interval_us)) {
+            return nullptr;
+        }
+        filter->on_change = on_change;
+        filter->min_interval_us = min_interval_us;
+        if (threaded) {
+            PyErr_SetString(PyExc_ValueError,
+                            "Threaded listeners cannot be filtered");
+            return nullptr;
+        }
+    }
+    if (!check_game_thread()) {
+        return nullptr;
+    }
+    if (frame_sink >= static_cast<int>(frame_sinks_.size())) {
+        PyErr_SetString(PyExc_ValueError, "Invalid frame sink");
+        return nullptr;
+    }
+    if (frame_sink >= 0 && threaded) {
+        PyErr_SetString(PyExc_ValueError,
+                        "Batched listeners cannot be threaded");
+        return nullptr;
+    }
+    SCSAPI_RESULT register_ret = SCS_RESULT_ok;
+    ssize_t slot_index = get_channel_slot(name, index, type, flags,
+                                          py_channel, register_ret);
+    if (slot_index < 0) {
+        return PyLong_FromLong(register_ret);
+    }
+    if (threaded) {
+        worker::start(dispatch_threaded);
+    }
+    channel_slot &slot = channel_slots_[slot_index];
+    listener &listener_val = add_listener(slot.listeners);
+    listener_val.py_callback.set(py_callback);
+    listener_val.py_context.set(py_context);
+    listener_val.frame_sink = frame_sink;
+    listener_val.threaded = threaded;
+    bool filtered = filter != nullptr;
+    listener_val.filter = std::move(filter);
+    listener_val.priority = priority;
+    if (threaded) {
+        ++slot.threaded_count;
+        slot.had_threaded = true;
+    } else if (frame_sink >= 0) {
+        ++slot.batched_count;
+    } else {
+        ++slot.immediate_count;
+        if (filtered) {
+            ++slot.filtered_count;
+        }
+        if (priority == PRIORITY_critical) {
+            ++slot.critical_count;
+        }
+    }
+    return PyLong_FromLong(SCS_RESULT_ok);
+}
+
+static PyObject *register_for_store(PyObject *self, PyObject *args) {
+    const char *name;
+    scs_u32_t index;
+    scs_value_type_t type;
+    scs_u32_t flags;
+    PyObject *py_channel;
+    Py_ssize_t store_offset;
+    if (!PyArg_ParseTuple(args, "sIIIOn", &name, &index, &type,
+                          &flags, &py_channel, &store_offset)) {
+        return nullptr;
+    }
+    if (!check_game_thread()) {
+        return nullptr;
+    }
+    if (store_offset < 0 || pyvalue::raw_size(type) == 0 ||
+        static_cast<size_t>(store_offset) + 1 + pyvalue::raw_size(type) >
+        store_.size()) {
+        PyErr_SetString(PyExc_ValueError, "Invalid store offset");
+        return nullptr;
+    }
+    SCSAPI_RESULT register_ret = SCS_RESULT_ok;
+    ssize_t slot_index = get_channel_slot(name, index, type, flags,
+                                          py_channel, register_ret);
+    if (slot_index >= 0) {
+        channel_slots_[slot_index].store_offset = store_offset;
+    }
+    return PyLong_FromLong(register_ret);
+}
 
-// telemetry Python module
+static PyObject *register_for_event(PyObject *self, PyObject *args) {
+    scs_event_t event = 0;
+    PyObject *py_event;
+    PyObject *py_callback;
+    PyObject *py_context;
+    int threaded = 0;
+    int priority = PRIORITY_normal;
+    if (!PyArg_ParseTuple(args, "IOOO|pi", &event, &py_event, &py_callback,
+                          &py_context, &threaded, &priority)) {
+        return nullptr;
+    }
+    if (!check_priority(priority)) {
+        return nullptr;
+    }
+    if (!check_game_thread()) {
+        return nullptr;
+    }
+    SCSAPI_RESULT register_ret = SCS_RESULT_ok;
+    ssize_t slot_index = get_event_slot(event, register_ret);
+    if (slot_index < 0) {
+        return PyLong_FromLong(register_ret);
+    }
+    event_slot &slot = event_slots_[slot_index];
+    if (slot.py_event.get() == nullptr) {
+        slot.py_event.set(py_event);
+    }
+    listener &listener_val = add_listener(slot.listeners);
+    listener_val.py_callback.set(py_callback);
+    listener_val.py_context.set(py_context);
+    listener_val.threaded = threaded;
+    listener_val.priority = priority;
+    ++slot.listener_count;
+    if (threaded) {
+        worker::start(dispatch_threaded);
+        ++slot.threaded_count;
+        slot.had_threaded = true;
+    }
+    return PyLong_FromLong(SCS_RESULT_ok);
+}
 
-template <class T>
-static pyhelp::PyObjRef create_py_vector(const T &scs_vector) {
-    pyhelp::PyObjRef py_dict(PyDict_New());
-    PyDict_SetItemString(py_dict.get(), "x",
-                         PyFloat_FromDouble(scs_vector.x));
-    PyDict_SetItemString(py_dict.get(), "y",
-                         PyFloat_FromDouble(scs_vector.y));
-    PyDict_SetItemString(py_dict.get(), "z",
-                         PyFloat_FromDouble(scs_vector.z));
-    return py_dict;
-}
-
-static pyhelp::PyObjRef create_py_euler(const scs_value_euler_t &euler) {
-    pyhelp::PyObjRef py_dict(PyDict_New());
-    PyDict_SetItemString(py_dict.get(), "heading",
-                         PyFloat_FromDouble(euler.heading));
-    PyDict_SetItemString(py_dict.get(), "pitch",
-                         PyFloat_FromDouble(euler.pitch));
-    PyDict_SetItemString(py_dict.get(), "roll",
-                         PyFloat_FromDouble(euler.roll));
-    return py_dict;
-}
-
-// Returns empty pyhelp::PyObjRef on error
-static pyhelp::PyObjRef create_py_value(const scs_value_t *value) {
-    pyhelp::PyObjRef py_value;
-    if (value == nullptr) {
-        return py_value;
+// Returns 1 if listener_val was registered with py_callback and
+// py_context, 0 if not and -1 on error
+static int listener_matches(listener &listener_val, PyObject *py_callback,
+                            PyObject *py_context) {
+    if (listener_val.removed) {
+        return 0;
     }
-    switch (value->type) {
-        case SCS_VALUE_TYPE_bool:
-            py_value.set(PyBool_FromLong(value->value_bool.value));
-            break;
-        case SCS_VALUE_TYPE_s32:
-            py_value.set(PyLong_FromLong(value->value_s32.value));
-            break;
-        case SCS_VALUE_TYPE_u32:
-            py_value.set(PyLong_FromUnsignedLong(value->value_u32.value));
-            break;
-        case SCS_VALUE_TYPE_s64:
-            py_value.set(PyLong_FromLong(value->value_s64.value));
-            break;
-        case SCS_VALUE_TYPE_u64:
-            py_value.set(PyLong_FromUnsignedLong(value->value_u64.value));
-            break;
-        case SCS_VALUE_TYPE_float:
-            py_value.set(PyFloat_FromDouble(value->value_float.value));
-            break;
-        case SCS_VALUE_TYPE_double:
-            py_value.set(PyFloat_FromDouble(value->value_double.value));
-            break;
-        case SCS_VALUE_TYPE_fvector:
-            py_value = create_py_vector(value->value_fvector);
-            break;
-        case SCS_VALUE_TYPE_dvector:
-            py_value = create_py_vector(value->value_dvector);
-            break;
-        case SCS_VALUE_TYPE_euler:
-            py_value = create_py_euler(value->value_euler);
-            break;
-        case SCS_VALUE_TYPE_fplacement:
-            py_value.set(PyDict_New());
-            PyDict_SetItemString(py_value.get(), "position",
-                                 create_py_vector(
-                                     value->value_fplacement.position).get());
-            PyDict_SetItemString(py_value.get(), "orientation",
-                                 create_py_euler(
-                                     value->value_fplacement.orientation).get());
-            break;
-        case SCS_VALUE_TYPE_dplacement:
-            py_value.set(PyDict_New());
-            PyDict_SetItemString(py_value.get(), "position",
-                                 create_py_vector(
-                                     value->value_dplacement.position).get());
-            PyDict_SetItemString(py_value.get(), "orientation",
-                                 create_py_euler(
-                                     value->value_dplacement.orientation).get());
-            break;
-        case SCS_VALUE_TYPE_string:
-            py_value.set(PyUnicode_FromString(value->value_string.value));
-            break;
-        default:
-            log_loader("Cannot convert SCS type: %u", value->type);
+    int ret = PyObject_RichCompareBool(listener_val.py_callback.get(),
+                                       py_callback, Py_EQ);
+    if (ret != 1) {
+        return ret;
     }
-    return py_value;
+    return PyObject_RichCompareBool(listener_val.py_context.get(),
+                                    py_context, Py_EQ);
 }
 
-SCSAPI_VOID telemetry_channel_cb(const scs_string_t name,
-                                 const scs_u32_t index,
-                                 const scs_value_t *const value,
-                                 const scs_context_t context) {
-    int context_index = reinterpret_cast<intptr_t>(context);
-    if (context_index >= static_cast<ssize_t>(registered_channels_.size())) {
-        log_loader("ERROR! Channel context_index=%d > size()=%zu. Ignoring callback.",
-                   context_index, registered_channels_.size());
-        return;
+static PyObject *unregister_from_channel(PyObject *self, PyObject *args) {
+    const char *name;
+    scs_u32_t index;
+    PyObject *py_callback;
+    PyObject *py_context;
+    int frame_sink = -1;
+    if (!PyArg_ParseTuple(args, "sIOO|i", &name, &index, &py_callback,
+                          &py_context, &frame_sink)) {
+        return nullptr;
     }
-    cb_context &context_val = registered_channels_[context_index];
-    
-    PyEval_RestoreThread(py_thread_state_);
+    if (!check_game_thread(true)) {
+        return nullptr;
+    }
+    auto slot_it = channel_slot_indexes_.find(std::make_pair(std::string(name), index));
+    if (slot_it == channel_slot_indexes_.end()) {
+        return PyLong_FromLong(SCS_RESULT_not_found);
+    }
+    size_t slot_index = slot_it->second;
+    channel_slot &slot = channel_slots_[slot_index];
+    for (listener &listener_val : slot.listeners) {
+        if (listener_val.frame_sink != frame_sink) {
+            continue;
+        }
+        int ret = listener_matches(listener_val, py_callback, py_context);
+        if (ret < 0) {
+            return nullptr;
+        }
+        if (ret == 1) {
+            remove_channel_listener(slot, listener_val);
+            release_channel_slot(slot_index);
+            return PyLong_FromLong(SCS_RESULT_ok);
+        }
+    }
+    return PyLong_FromLong(SCS_RESULT_not_found);
+}
 
-    { // Make sure no pyhelp::PyObjRef ref counting happens after PyEval_SaveThread()
-        // value might be NULL if user has set SCS_TELEMETRY_CHANNEL_FLAG_no_value
-        pyhelp::PyObjRef py_value(create_py_value(value));
-        if (py_value.get() == nullptr) {
-            py_value.set(Py_None);
+static PyObject *unregister_from_event(PyObject *self, PyObject *args) {
+    scs_event_t event = 0;
+    PyObject *py_callback;
+    PyObject *py_context;
+    if (!PyArg_ParseTuple(args, "IOO", &event, &py_callback, &py_context)) {
+        return nullptr;
+    }
+    if (!check_game_thread(true)) {
+        return nullptr;
+    }
+    ssize_t slot_index = find_event_slot(event);
+    if (slot_index < 0) {
+        return PyLong_FromLong(SCS_RESULT_not_found);
+    }
+    event_slot &slot = event_slots_[slot_index];
+    for (listener &listener_val : slot.listeners) {
+        int ret = listener_matches(listener_val, py_callback, py_context);
+        if (ret < 0) {
+            return nullptr;
+        }
+        if (ret == 1) {
+            listener_val.removed = true;
+            --slot.listener_count;
+            if (listener_val.threaded) {
+                --slot.threaded_count;
+            }
+            release_event_slot(slot_index);
+            return PyLong_FromLong(SCS_RESULT_ok);
         }
-        pyhelp::try_call_function(context_val.py_callback.get(),
-                                  "sIOO", name, index,
-                                  py_value.get(), context_val.py_context.get());
     }
-    py_thread_state_ = PyEval_SaveThread();
+    return PyLong_FromLong(SCS_RESULT_not_found);
 }
 
-SCSAPI_VOID telemetry_event_cb(const scs_event_t event,
-                               const void *const event_info,
-                               const scs_context_t context) {
-    int context_index = reinterpret_cast<intptr_t>(context);
-    if (context_index >= static_cast<ssize_t>(registered_events_.size())) {
-        log_loader("ERROR! Event context_index=%d > size()=%zu. Ignoring callback.",
-                   context_index, registered_events_.size());
-        return;
+static PyObject *register_for_frame(PyObject *self, PyObject *args) {
+    PyObject *py_callback;
+    PyObject *py_context;
+    int priority = PRIORITY_normal;
+    if (!PyArg_ParseTuple(args, "OO|i", &py_callback, &py_context, &priority)) {
+        return nullptr;
     }
-    cb_context &context_val = registered_events_[context_index];
-    
-    PyEval_RestoreThread(py_thread_state_);
+    if (!check_game_thread() || !check_priority(priority)) {
+        return nullptr;
+    }
+    frame_sink sink;
+    sink.py_callback.set(py_callback);
+    sink.py_context.set(py_context);
+    sink.priority = priority;
+    frame_sinks_.push_back(std::move(sink));
+    // The index is used as frame sink id in register_for_channel
+    return PyLong_FromSsize_t(frame_sinks_.size() - 1);
+}
 
-    { // Make sure no pyhelp::PyObjRef ref counting happens after PyEval_SaveThread()
-        pyhelp::PyObjRef py_value(Py_None);
-
-        // TODO: Use custom types (PyType) instead of dicts? Config and gameplay
-        // events should not happen very often?
-        switch (event) {
-            // TODO: Implement all event types
-            // case SCS_TELEMETRY_EVENT_frame_start:
-            //     break;
-            // case SCS_TELEMETRY_EVENT_frame_end:
-            //     break;
-            case SCS_TELEMETRY_EVENT_paused:
-                // No value
-                break;
-            case SCS_TELEMETRY_EVENT_started:
-                // No value
-                break;
-            case SCS_TELEMETRY_EVENT_gameplay:
-                // Intentional fall-through. The struct layouts are the same.
-            case SCS_TELEMETRY_EVENT_configuration:
-                auto config = static_cast<const scs_telemetry_configuration_t *const>(event_info);
-                py_value.set(PyDict_New());
-                PyDict_SetItemString(py_value.get(), "id",
-                                     PyUnicode_FromString(config->id));
-                pyhelp::PyObjRef py_attr_list(PyList_New(0));
-                PyDict_SetItemString(py_value.get(), "attributes",
-                                     py_attr_list.get());
-                const scs_named_value_t *current_attr = config->attributes;
-                for (; current_attr->name != nullptr; ++current_attr) {
-                    pyhelp::PyObjRef py_attr_value(create_py_value(&current_attr->value));
-                    if (py_attr_value.get() == nullptr) {
-                        py_attr_value.set(Py_None);
-                    }
-
-                    PyObject *py_index = Py_None;
-                    if (current_attr->index != SCS_U32_NIL) {
-                        py_index = PyLong_FromUnsignedLong(current_attr->index);
-                    }
- 
-                    PyObject *py_attr_tuple = PyTuple_Pack(
-                        3,
-                        PyUnicode_FromString(current_attr->name),
-                        py_index,
-                        py_attr_value.get());
-
-                    PyList_Append(py_attr_list.get(), py_attr_tuple);
-                }
-                break;
-                //default:
-                // Keep None-value
-        }
-        pyhelp::try_call_function(context_val.py_callback.get(),
-                                  "IOO", event, py_value.get(),
-                                  context_val.py_context.get());
+static PyObject *register_for_array_sink(PyObject *self, PyObject *args) {
+    PyObject *py_callback;
+    PyObject *py_channel;
+    PyObject *py_array;
+    PyObject *py_context;
+    int priority = PRIORITY_normal;
+    if (!PyArg_ParseTuple(args, "OOOO|i", &py_callback, &py_channel, &py_array,
+                          &py_context, &priority)) {
+        return nullptr;
     }
-    py_thread_state_ = PyEval_SaveThread();
+    if (!check_game_thread() || !check_priority(priority)) {
+        return nullptr;
+    }
+    std::unique_ptr<array_sink> sink(new array_sink());
+    if (PyObject_GetBuffer(py_array, &sink->buffer,
+                           PyBUF_WRITABLE | PyBUF_C_CONTIGUOUS) < 0) {
+        return nullptr;
+    }
+    sink->py_callback.set(py_callback);
+    sink->py_channel.set(py_channel);
+    sink->py_array.set(py_array);
+    sink->py_context.set(py_context);
+    sink->priority = priority;
+    array_sinks_.push_back(std::move(sink));
+    // The index is used as array sink id in register_for_array
+    return PyLong_FromSsize_t(array_sinks_.size() - 1);
 }
 
-namespace pymod {
+static PyObject *register_for_array(PyObject *self, PyObject *args) {
+    const char *name;
+    scs_u32_t index;
+    scs_value_type_t type;
+    scs_u32_t flags;
+    PyObject *py_channel;
+    Py_ssize_t sink_index;
+    Py_ssize_t offset;
+    if (!PyArg_ParseTuple(args, "sIIIOnn", &name, &index, &type, &flags,
+                          &py_channel, &sink_index, &offset)) {
+        return nullptr;
+    }
+    if (!check_game_thread()) {
+        return nullptr;
+    }
+    if (sink_index < 0 ||
+        static_cast<size_t>(sink_index) >= array_sinks_.size()) {
+        PyErr_SetString(PyExc_ValueError, "Invalid array sink");
+        return nullptr;
+    }
+    const Py_buffer &buffer = array_sinks_[sink_index]->buffer;
+    if (offset < 0 || pyvalue::raw_size(type) == 0 ||
+        offset + static_cast<Py_ssize_t>(pyvalue::raw_size(type)) > buffer.len) {
+        PyErr_SetString(PyExc_ValueError, "Invalid array offset");
+        return nullptr;
+    }
+    SCSAPI_RESULT register_ret = SCS_RESULT_ok;
+    ssize_t slot_index = get_channel_slot(name, index, type, flags,
+                                          py_channel, register_ret);
+    if (slot_index >= 0) {
+        array_target target;
+        target.data = static_cast<uint8_t*>(buffer.buf) + offset;
+        target.sink_index = sink_index;
+        channel_slots_[slot_index].array_targets.push_back(target);
+    }
+    return PyLong_FromLong(register_ret);
+}
 
-static PyObject *log(PyObject *self, PyObject *arg) {
-    const char *message = PyUnicode_AsUTF8AndSize(arg, nullptr);
-    if (message == nullptr) {
-        PyErr_SetString(PyExc_TypeError, "Log message must be string");
+static PyObject *create_store(PyObject *self, PyObject *arg) {
+    Py_ssize_t size = PyLong_AsSsize_t(arg);
+    if (size < 0) {
+        if (!PyErr_Occurred()) {
+            PyErr_SetString(PyExc_ValueError, "Store size must be positive");
+        }
+        return nullptr;
+    }
+    if (!store_.empty()) {
+        PyErr_SetString(PyExc_RuntimeError, "Store already created");
+        return nullptr;
+    }
+    store_.assign(size, 0);
+    return PyMemoryView_FromMemory(reinterpret_cast<char*>(store_.data()),
+                                   size, PyBUF_READ);
+}
+
+static PyObject *start_recording(PyObject *self, PyObject *arg) {
+    pyhelp::PyObjRef py_path(pyhelp::PyObjRef::steal(PyOS_FSPath(arg)));
+    if (py_path.get() == nullptr) {
         return nullptr;
     }
-    log_py(message);
+    PyObject *py_path_bytes = nullptr;
+    if (!PyUnicode_FSConverter(py_path.get(), &py_path_bytes)) {
+        return nullptr;
+    }
+    pyhelp::PyObjRef py_path_ref(pyhelp::PyObjRef::steal(py_path_bytes));
+    if (!check_game_thread()) {
+        return nullptr;
+    }
+    if (!recording::start(PyBytes_AS_STRING(py_path_bytes),
+                          scs_params_.common.game_id,
+                          scs_params_.common.game_name,
+                          scs_params_.common.game_version)) {
+        PyErr_SetString(PyExc_OSError, "Could not open recording");
+        return nullptr;
+    }
+    // Events are recorded no matter if there are listeners
+    for (scs_event_t event : {SCS_TELEMETRY_EVENT_paused,
+                              SCS_TELEMETRY_EVENT_started,
+                              SCS_TELEMETRY_EVENT_configuration,
+                              SCS_TELEMETRY_EVENT_gameplay}) {
+        SCSAPI_RESULT register_ret = SCS_RESULT_ok;
+        if (get_event_slot(event, register_ret) < 0) {
+            log_loader("Could not register for event %u for recording: %d",
+                       event, register_ret);
+        }
+    }
     Py_RETURN_NONE;
 }
 
-static PyObject *register_for_channel(PyObject *self, PyObject *args) {
-    const char* name;
+static PyObject *register_for_recording(PyObject *self, PyObject *args) {
+    const char *name;
     scs_u32_t index;
     scs_value_type_t type;
     scs_u32_t flags;
-    PyObject *py_callback;
-    PyObject *py_context;
-    if (!PyArg_ParseTuple(args, "sIIIOO", &name, &index, &type,
-                          &flags, &py_callback,
-                          &py_context)) {
+    PyObject *py_channel;
+    if (!PyArg_ParseTuple(args, "sIIIO", &name, &index, &type, &flags,
+                          &py_channel)) {
         return nullptr;
     }
-    cb_context context;
-    context.py_callback.set(py_callback);
-    context.py_context.set(py_context);
-    auto context_it = registered_channels_.emplace(registered_channels_.end(),
-                                                std::move(context));
-    // Cannot store pointer to element in the vector, as the vector
-    // reallocates when it grows. Using index instead.
-    intptr_t context_index = context_it - registered_channels_.begin();
-    SCSAPI_RESULT register_ret =
-        scs_params_.register_for_channel(name, index, type, flags,
-                                         telemetry_channel_cb,
-                                         reinterpret_cast<void*>(context_index));
-    if (register_ret != SCS_RESULT_ok) {
-        registered_channels_.pop_back(); 
+    if (!check_game_thread()) {
+        return nullptr;
     }
+    // All registered channels are recorded, so only the registration
+    // with SCS is needed
+    SCSAPI_RESULT register_ret = SCS_RESULT_ok;
+    get_channel_slot(name, index, type, flags, py_channel, register_ret);
     return PyLong_FromLong(register_ret);
 }
 
-static PyObject *register_for_event(PyObject *self, PyObject *args) {
-    scs_event_t event = 0;
-    PyObject *py_callback;
-    PyObject *py_context;
-    if (!PyArg_ParseTuple(args, "IOO", &event, &py_callback,
-                          &py_context)) {
+static PyObject *start_export(PyObject *self, PyObject *args) {
+    PyObject *py_path_arg;
+    PyObject *py_columns;
+    Py_ssize_t chunk_rows;
+    Py_ssize_t max_pending;
+    if (!PyArg_ParseTuple(args, "OOnn", &py_path_arg, &py_columns, &chunk_rows,
+                          &max_pending)) {
         return nullptr;
     }
-    cb_context context;
-    context.py_callback.set(py_callback);
-    context.py_context.set(py_context);
-    auto context_it = registered_events_.emplace(registered_events_.end(),
-                                                 std::move(context));
-    // Cannot store pointer to element in the vector, as the vector
-    // reallocates when it grows. Using index instead.
-    intptr_t context_index = context_it - registered_events_.begin();
-    SCSAPI_RESULT register_ret =
-        scs_params_.register_for_event(event, telemetry_event_cb,
-                                       reinterpret_cast<void*>(context_index));
-    if (register_ret != SCS_RESULT_ok) {
-        registered_events_.pop_back(); 
+    if (chunk_rows <= 0 || max_pending <= 0) {
+        PyErr_SetString(PyExc_ValueError,
+                        "Chunk rows and pending chunks must be positive");
+        return nullptr;
     }
-    return PyLong_FromLong(register_ret);
+    pyhelp::PyObjRef py_path(pyhelp::PyObjRef::steal(PyOS_FSPath(py_path_arg)));
+    if (py_path.get() == nullptr) {
+        return nullptr;
+    }
+    PyObject *py_path_bytes = nullptr;
+    if (!PyUnicode_FSConverter(py_path.get(), &py_path_bytes)) {
+        return nullptr;
+    }
+    pyhelp::PyObjRef py_path_ref(pyhelp::PyObjRef::steal(py_path_bytes));
+    pyhelp::PyObjRef py_iter(pyhelp::PyObjRef::steal(PyObject_GetIter(py_columns)));
+    if (py_iter.get() == nullptr) {
+        return nullptr;
+    }
+    if (!check_game_thread()) {
+        return nullptr;
+    }
+    if (exporter::active()) {
+        PyErr_SetString(PyExc_RuntimeError, "Export already started");
+        return nullptr;
+    }
+    // Register the channels first, as only found ones get a column
+    std::vector<exporter::column> columns;
+    std::vector<size_t> slot_indexes;
+    // A slot has only one column, so repeated channels are exported once
+    std::set<size_t> exported_slots;
+    size_t failed = 0;
+    while (PyObject *py_item = PyIter_Next(py_iter.get())) {
+        pyhelp::PyObjRef py_item_ref(pyhelp::PyObjRef::steal(py_item));
+        const char *name;
+        exporter::column col;
+        PyObject *py_channel;
+        if (!PyArg_ParseTuple(py_item, "sIIIO", &name, &col.index, &col.type,
+                              &col.internal_id, &py_channel)) {
+            break;
+        }
+        if (pyvalue::raw_size(col.type) == 0) {
+            PyErr_Format(PyExc_ValueError,
+                         "Channel \"%s\" type %u cannot be exported", name,
+                         col.type);
+            break;
+        }
+        SCSAPI_RESULT result = SCS_RESULT_ok;
+        ssize_t slot_index = get_channel_slot(name, col.index, col.type,
+                                              SCS_TELEMETRY_CHANNEL_FLAG_none,
+                                              py_channel, result);
+        if (slot_index < 0) {
+            failed += result != SCS_RESULT_not_found;
+            continue;
+        }
+        if (!exported_slots.insert(slot_index).second) {
+            continue;
+        }
+        col.name = name;
+        columns.push_back(std::move(col));
+        slot_indexes.push_back(slot_index);
+    }
+    if (!PyErr_Occurred() &&
+        !exporter::start(PyBytes_AS_STRING(py_path_bytes), columns, chunk_rows,
+                         max_pending, scs_params_.common.game_id,
+                         scs_params_.common.game_name,
+                         scs_params_.common.game_version)) {
+        PyErr_SetString(PyExc_OSError, "Could not open export");
+    }
+    if (PyErr_Occurred()) {
+        for (size_t slot_index : slot_indexes) {
+            release_channel_slot(slot_index);
+        }
+        return nullptr;
+    }
+    for (size_t i = 0; i < slot_indexes.size(); ++i) {
+        channel_slots_[slot_indexes[i]].export_column = i;
+    }
+    return PyLong_FromSize_t(failed);
+}
+
+static PyObject *stop_export(PyObject *self, PyObject *args) {
+    if (!check_game_thread(true)) {
+        return nullptr;
+    }
+    exporter::stop();
+    for (size_t slot_index = 0; slot_index < channel_slots_.size(); ++slot_index) {
+        if (channel_slots_[slot_index].export_column >= 0) {
+            channel_slots_[slot_index].export_column = -1;
+            release_channel_slot(slot_index);
+        }
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *export_stats(PyObject *self, PyObject *args) {
+    exporter::counters counters = exporter::get_counters();
+    return Py_BuildValue("{s:K,s:K,s:K,s:K,s:n}",
+                         "rows", static_cast<unsigned long long>(counters.rows),
+                         "chunks", static_cast<unsigned long long>(counters.chunks),
+                         "dropped_rows", static_cast<unsigned long long>(counters.dropped_rows),
+                         "bytes", static_cast<unsigned long long>(counters.bytes),
+                         "pending", static_cast<Py_ssize_t>(counters.pending));
+}
+
+static PyObject *start_publisher(PyObject *self, PyObject *args) {
+    const char *name;
+    unsigned int channel_count;
+    Py_buffer directory;
+    if (!PyArg_ParseTuple(args, "sIy*", &name, &channel_count, &directory)) {
+        return nullptr;
+    }
+    bool started = false;
+    if (!check_game_thread()) {
+        // Exception set
+    } else if (store_.empty()) {
+        PyErr_SetString(PyExc_RuntimeError, "Store not created");
+    } else if (!shm::start(name, directory.buf, directory.len, channel_count,
+                           store_.size())) {
+        PyErr_SetString(PyExc_OSError, "Could not create shared memory");
+    } else {
+        started = true;
+    }
+    PyBuffer_Release(&directory);
+    if (!started) {
+        return nullptr;
+    }
+    SCSAPI_RESULT register_ret = SCS_RESULT_ok;
+    ssize_t slot_index = get_event_slot(SCS_TELEMETRY_EVENT_configuration,
+                                        register_ret);
+    if (slot_index < 0) {
+        log_loader("Could not register for configuration event for publishing: %d",
+                   register_ret);
+    } else {
+        event_slots_[slot_index].pinned = true;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *configure_worker(PyObject *self, PyObject *args) {
+    Py_ssize_t capacity;
+    int policy;
+    if (!PyArg_ParseTuple(args, "ni", &capacity, &policy)) {
+        return nullptr;
+    }
+    if (capacity <= 0 || policy < worker::OVERFLOW_drop_oldest ||
+        policy > worker::OVERFLOW_block) {
+        PyErr_SetString(PyExc_ValueError, "Invalid worker configuration");
+        return nullptr;
+    }
+    if (!worker::configure(capacity,
+                           static_cast<worker::overflow_policy>(policy))) {
+        PyErr_SetString(PyExc_RuntimeError, "Worker already started");
+        return nullptr;
+    }
+    Py_RETURN_NONE;
+}
+
+static PyObject *worker_stats(PyObject *self, PyObject *args) {
+    worker::counters counters = worker::get_counters();
+    return Py_BuildValue("{s:n,s:n,s:K,s:K,s:K,s:K,s:K}",
+                         "capacity", static_cast<Py_ssize_t>(counters.capacity),
+                         "pending", static_cast<Py_ssize_t>(counters.pending),
+                         "queued", static_cast<unsigned long long>(counters.queued),
+                         "delivered", static_cast<unsigned long long>(counters.delivered),
+                         "dropped", static_cast<unsigned long long>(counters.dropped),
+                         "coalesced", static_cast<unsigned long long>(counters.coalesced),
+                         "blocked", static_cast<unsigned long long>(counters.blocked));
+}
+
+static PyObject *configure_budget(PyObject *self, PyObject *arg) {
+    unsigned long long budget_ns = PyLong_AsUnsignedLongLong(arg);
+    if (PyErr_Occurred()) {
+        return nullptr;
+    }
+    budget_.budget_ns = budget_ns;
+    budget_.used_ns = 0;
+    Py_RETURN_NONE;
+}
+
+static PyObject *budget_stats(PyObject *self, PyObject *args) {
+    size_t pending = 0;
+    for (size_t slot_index : deferred_slots_) {
+        pending += channel_slots_[slot_index].deferred_count;
+    }
+    for (const frame_sink &sink : frame_sinks_) {
+        pending += sink.deferred;
+    }
+    pending += changed_array_sinks_;
+    return Py_BuildValue("{s:K,s:K,s:K,s:K,s:K,s:K,s:n}",
+                         "budget_ns", static_cast<unsigned long long>(budget_.budget_ns),
+                         "frames", static_cast<unsigned long long>(budget_.frames),
+                         "frames_over", static_cast<unsigned long long>(budget_.frames_over),
+                         "max_used_ns", static_cast<unsigned long long>(budget_.max_used_ns),
+                         "deferred", static_cast<unsigned long long>(budget_.deferred),
+                         "shed", static_cast<unsigned long long>(budget_.shed),
+                         "pending", static_cast<Py_ssize_t>(pending));
+}
+
+static PyObject *start_isolated(PyObject *self, PyObject *args) {
+    if (!check_game_thread()) {
+        return nullptr;
+    }
+    const char *plugin;
+    if (!PyArg_ParseTuple(args, "s", &plugin)) {
+        return nullptr;
+    }
+    std::string error;
+    ssize_t host;
+    // The host thread needs the GIL to create the subinterpreter
+    Py_BEGIN_ALLOW_THREADS
+    host = subinterp::start(plugin, SCS_TELEMETRY_VERSION_1_01,
+                            scs_params_.common.game_name,
+                            scs_params_.common.game_id,
+                            scs_params_.common.game_version, error);
+    Py_END_ALLOW_THREADS
+    if (host < 0) {
+        PyErr_SetString(PyExc_RuntimeError, error.c_str());
+        return nullptr;
+    }
+    apply_host_requests();
+    Py_RETURN_NONE;
+}
+
+static PyObject *isolated_stats(PyObject *self, PyObject *args) {
+    subinterp::counters counters = subinterp::get_counters();
+    return Py_BuildValue("{s:n,s:K,s:K}",
+                         "plugins", static_cast<Py_ssize_t>(counters.hosts),
+                         "queued", static_cast<unsigned long long>(counters.queued),
+                         "dropped", static_cast<unsigned long long>(counters.dropped));
+}
+
+static PyObject *configure_profiling(PyObject *self, PyObject *args) {
+    int enabled;
+    unsigned long long slow_threshold_ns;
+    if (!PyArg_ParseTuple(args, "pK", &enabled, &slow_threshold_ns)) {
+        return nullptr;
+    }
+    profiling_ = enabled;
+    slow_threshold_ns_ = slow_threshold_ns;
+    Py_RETURN_NONE;
+}
+
+// Returns a (kind, source, index, callback, context, calls, total_ns,
+// max_ns, slow_calls, histogram) tuple. The GIL must be held.
+static PyObject *create_stats_tuple(const char *kind, PyObject *py_source,
+                                    PyObject *py_index, PyObject *py_callback,
+                                    PyObject *py_context,
+                                    const call_stats &stats) {
+    pyhelp::PyObjRef py_histogram(pyhelp::PyObjRef::steal(
+        PyTuple_New(call_stats::HISTOGRAM_SIZE)));
+    if (py_histogram.get() == nullptr) {
+        return nullptr;
+    }
+    for (int i = 0; i < call_stats::HISTOGRAM_SIZE; ++i) {
+        PyTuple_SET_ITEM(py_histogram.get(), i,
+                         PyLong_FromUnsignedLongLong(stats.histogram[i]));
+    }
+    return Py_BuildValue("sOOOOKKKKO", kind,
+                         py_source ? py_source : Py_None,
+                         py_index ? py_index : Py_None,
+                         py_callback ? py_callback : Py_None,
+                         py_context ? py_context : Py_None,
+                         static_cast<unsigned long long>(stats.calls),
+                         static_cast<unsigned long long>(stats.total_ns),
+                         static_cast<unsigned long long>(stats.max_ns),
+                         static_cast<unsigned long long>(stats.slow_calls),
+                         py_histogram.get());
+}
+
+static bool append_stats(PyObject *py_list, PyObject *py_stats) {
+    if (py_stats == nullptr) {
+        return false;
+    }
+    int ret = PyList_Append(py_list, py_stats);
+    Py_DECREF(py_stats);
+    return ret == 0;
+}
+
+static PyObject *listener_stats(PyObject *self, PyObject *args) {
+    auto py_list(pyhelp::PyObjRef::steal(PyList_New(0)));
+    if (py_list.get() == nullptr) {
+        return nullptr;
+    }
+    for (channel_slot &slot : channel_slots_) {
+        for (listener &listener_val : slot.listeners) {
+            if (listener_val.frame_sink >= 0 || listener_val.removed) {
+                // Batched listeners are counted on the frame sink
+                continue;
+            }
+            if (!append_stats(py_list.get(), create_stats_tuple(
+                    "channel", slot.py_channel.get(), slot.py_index.get(),
+                    listener_val.py_callback.get(),
+                    listener_val.py_context.get(), *listener_val.stats))) {
+                return nullptr;
+            }
+        }
+    }
+    for (event_slot &slot : event_slots_) {
+        for (listener &listener_val : slot.listeners) {
+            if (listener_val.removed) {
+                continue;
+            }
+            if (!append_stats(py_list.get(), create_stats_tuple(
+                    "event", slot.py_event.get(), nullptr,
+                    listener_val.py_callback.get(),
+                    listener_val.py_context.get(), *listener_val.stats))) {
+                return nullptr;
+            }
+        }
+    }
+    for (frame_sink &sink : frame_sinks_) {
+        if (!append_stats(py_list.get(), create_stats_tuple(
+                "frame", nullptr, nullptr, sink.py_callback.get(),
+                sink.py_context.get(), *sink.stats))) {
+            return nullptr;
+        }
+    }
+    for (auto &sink : array_sinks_) {
+        if (!append_stats(py_list.get(), create_stats_tuple(
+                "array", sink->py_channel.get(), nullptr,
+                sink->py_callback.get(), sink->py_context.get(),
+                sink->stats))) {
+            return nullptr;
+        }
+    }
+    return py_list.release();
+}
+
+static PyObject *filter_stats(PyObject *self, PyObject *args) {
+    auto py_list(pyhelp::PyObjRef::steal(PyList_New(0)));
+    if (py_list.get() == nullptr) {
+        return nullptr;
+    }
+    for (channel_slot &slot : channel_slots_) {
+        for (listener &listener_val : slot.listeners) {
+            if (listener_val.filter == nullptr) {
+                continue;
+            }
+            if (!append_stats(py_list.get(), Py_BuildValue(
+                    "OOOOKK", slot.py_channel.get(), slot.py_index.get(),
+                    listener_val.py_callback.get(),
+                    listener_val.py_context.get(),
+                    static_cast<unsigned long long>(listener_val.filter->delivered),
+                    static_cast<unsigned long long>(listener_val.filter->suppressed)))) {
+                return nullptr;
+            }
+        }
+    }
+    return py_list.release();
+}
+
+static PyObject *reset_listener_stats(PyObject *self, PyObject *args) {
+    for (channel_slot &slot : channel_slots_) {
+        for (listener &listener_val : slot.listeners) {
+            *listener_val.stats = call_stats();
+            if (listener_val.filter != nullptr) {
+                listener_val.filter->delivered = 0;
+                listener_val.filter->suppressed = 0;
+            }
+        }
+    }
+    for (event_slot &slot : event_slots_) {
+        for (listener &listener_val : slot.listeners) {
+            *listener_val.stats = call_stats();
+        }
+    }
+    for (frame_sink &sink : frame_sinks_) {
+        *sink.stats = call_stats();
+    }
+    for (auto &sink : array_sinks_) {
+        sink->stats = call_stats();
+    }
+    Py_RETURN_NONE;
 }
 
 static PyMethodDef methods[] = {
     {"log", log, METH_O,
-     "Log a message to ETS2 developer console."},
+     "Log a message, or a list of messages, to ETS2 developer console."},
     {"register_for_channel", register_for_channel, METH_VARARGS,
      "Registers callback to be called with value of specified telemetry channel."},
+    {"unregister_from_channel", unregister_from_channel, METH_VARARGS,
+     "Removes a listener registered with register_for_channel, releasing the channel when it is no longer used."},
+    {"unregister_from_event", unregister_from_event, METH_VARARGS,
+     "Removes a listener registered with register_for_event, releasing the event when it is no longer used."},
+    {"register_for_store", register_for_store, METH_VARARGS,
+     "Registers for keeping the latest value of specified telemetry channel in the store."},
     {"register_for_event", register_for_event, METH_VARARGS,
      "Registers callback to be called when specified event happens."},
+    {"register_for_frame", register_for_frame, METH_VARARGS,
+     "Creates a frame sink, which calls callback with all values of its batched channels at frame end."},
+    {"register_for_array_sink", register_for_array_sink, METH_VARARGS,
+     "Creates an array sink, which calls callback with an array of channel values at frame end, if any changed."},
+    {"register_for_array", register_for_array, METH_VARARGS,
+     "Registers for copying the value of specified telemetry channel into an array sink."},
+    {"create_store", create_store, METH_O,
+     "Allocates the latest value store and returns a read-only memoryview of it."},
+    {"start_recording", start_recording, METH_O,
+     "Starts recording all registered channels and all events to a file."},
+    {"register_for_recording", register_for_recording, METH_VARARGS,
+     "Registers specified telemetry channel for recording only."},
+    {"start_export", start_export, METH_VARARGS,
+     "Starts exporting specified telemetry channels to a columnar file, one row per frame."},
+    {"stop_export", stop_export, METH_NOARGS,
+     "Writes the remaining rows of the export and closes it."},
+    {"export_stats", export_stats, METH_NOARGS,
+     "Returns the counters of the export."},
+    {"start_publisher", start_publisher, METH_VARARGS,
+     "Starts publishing the store and the latest configurations to shared memory at every frame end."},
+    {"configure_worker", configure_worker, METH_VARARGS,
+     "Sets the ring buffer capacity and overflow policy of the worker thread."},
+    {"worker_stats", worker_stats, METH_NOARGS,
+     "Returns the counters of the worker thread."},
+    {"configure_budget", configure_budget, METH_O,
+     "Sets the Python time budget of a frame on the game thread, in nanoseconds, 0 to disable."},
+    {"budget_stats", budget_stats, METH_NOARGS,
+     "Returns the counters of the frame time budget."},
+    {"start_isolated", start_isolated, METH_VARARGS,
+     "Runs a plug-in package in its own subinterpreter, with its own GIL."},
+    {"isolated_stats", isolated_stats, METH_NOARGS,
+     "Returns the counters of the isolated plug-ins."},
+    {"configure_profiling", configure_profiling, METH_VARARGS,
+     "Enables or disables timing of listener calls and sets the slow call threshold."},
+    {"listener_stats", listener_stats, METH_NOARGS,
+     "Returns the call statistics of all listeners."},
+    {"filter_stats", filter_stats, METH_NOARGS,
+     "Returns the delivered and suppressed value counts of all filtered channel listeners."},
+    {"reset_listener_stats", reset_listener_stats, METH_NOARGS,
+     "Clears the call statistics of all listeners."},
     {NULL, NULL, 0, NULL}
 };
 
@@ -321,7 +2050,13 @@ static PyModuleDef module = {
 };
 
 static PyObject *create() {
-    return PyModule_Create(&module);
+    PyObject *py_module = PyModule_Create(&module);
+    if (py_module != nullptr && (!pyvalue::add_types(py_module) ||
+                                 !frameclock::add_clock(py_module))) {
+        Py_DECREF(py_module);
+        return nullptr;
+    }
+    return py_module;
 }
 
 }
@@ -335,6 +2070,7 @@ SCSAPI_RESULT scs_telemetry_init(const scs_u32_t version, const scs_telemetry_in
     }
     const scs_telemetry_init_params_v101_t *version_params = static_cast<const scs_telemetry_init_params_v101_t *>(params);
     scs_params_ = *version_params;
+    game_thread_id_ = std::this_thread::get_id();
 
     log_set_scs_log(scs_params_.common.log);
     log_loader("pyets2_telemetry %s", VERSION);
@@ -349,7 +2085,23 @@ SCSAPI_RESULT scs_telemetry_init(const scs_u32_t version, const scs_telemetry_in
     std::string plugin_dir = pwd + "/plugins/python";
     setenv("PYTHONPATH", plugin_dir.c_str(), 1);
     
+    event_slots_.clear();
+    for (scs_event_t event : {SCS_TELEMETRY_EVENT_frame_start,
+                              SCS_TELEMETRY_EVENT_frame_end}) {
+        size_t slot_index = event_slots_.size();
+        if (scs_params_.register_for_event(event, telemetry_frame_cb,
+                                           reinterpret_cast<void*>(slot_index))
+            != SCS_RESULT_ok) {
+            log_loader("Could not register for frame event %u", event);
+        }
+        event_slot slot;
+        slot.event = event;
+        slot.pinned = true;
+        event_slots_.push_back(std::move(slot));
+    }
+
     PyImport_AppendInittab("_telemetry", &pymod::create);
+    PyImport_AppendInittab("_telemetry_isolated", &subinterp::create_module);
     
     Py_InitializeEx(0);
 #if PY_MAJOR_VERSION == 3 && PY_MINOR_VERSION < 9
@@ -378,6 +2130,12 @@ SCSAPI_RESULT scs_telemetry_init(const scs_u32_t version, const scs_telemetry_in
         }
         log_loader("Python framework loaded");
 
+        py_listener_error_ = pyhelp::PyObjRef::steal(
+            PyObject_GetAttrString(py_module_.get(), "listener_error"));
+        if (py_listener_error_.get() == nullptr) {
+            pyhelp::log_and_clear_py_err();
+        }
+
         pyhelp::try_call_function(py_module_, "telemetry_init", "IssI",
                                   version,
                                   scs_params_.common.game_name,
@@ -391,6 +2149,11 @@ SCSAPI_RESULT scs_telemetry_init(const scs_u32_t version, const scs_telemetry_in
 }
 
 SCSAPI_VOID scs_telemetry_shutdown() {
+    // Before taking the GIL, which the worker and the isolated plug-in
+    // hosts might be waiting for
+    worker::stop();
+    subinterp::stop();
+
     PyEval_RestoreThread(py_thread_state_);
 
     log_loader("Call telemetry_shutdown");
@@ -398,14 +2161,38 @@ SCSAPI_VOID scs_telemetry_shutdown() {
 
     log_loader("Unloading");
 
-    registered_channels_.clear();
-    registered_events_.clear();
+    recording::stop();
+    shm::stop();
+    exporter::stop();
+
+    profiling_ = false;
+    slow_threshold_ns_ = 0;
+    budget_ = frame_budget();
+    render_time_us_ = 0;
+    channel_slots_.clear();
+    channel_slot_indexes_.clear();
+    deferred_slots_.clear();
+    free_channel_slots_.clear();
+    free_event_slots_.clear();
+    host_requests_.clear();
+    event_slots_.clear();
+    frame_sinks_.clear();
+    array_sinks_.clear();
+    changed_array_sinks_ = 0;
+    py_listener_error_.reset();
     py_module_.reset();
+    pyvalue::clear_types();
+    frameclock::clear_clock();
+    frameclock::reset();
 
     // All pyhelp::PyObjRef must be destroyed/reset before this point!
     // TODO: Class?
     Py_Finalize();
 
+    // Python may have referred to the store until finalized
+    store_.clear();
+    store_.shrink_to_fit();
+
     py_thread_state_ = nullptr;
 
     log_loader("Unloaded");
@@ -20,8 +20,12 @@
 #include "log.hpp"
 
 #include <cstdarg>
+#include <mutex>
 
 static scs_log_t scs_log_;
+// Messages are logged from the game thread, the worker thread and the
+// log flusher thread
+static std::mutex log_mutex_;
 
 void log_set_scs_log(scs_log_t scs_log) {
     scs_log_ = scs_log;
@@ -35,6 +39,7 @@ void log(const std::string &prefix, const char *format, va_list ap) {
     std::string buf(prefix);
     buf.resize(256);
     vsnprintf(buf.data() + prefix.size(), buf.size() - prefix.size(), format, ap);
+    std::lock_guard<std::mutex> lock(log_mutex_);
     scs_log_(SCS_LOG_TYPE_message, buf.c_str());
 }
 
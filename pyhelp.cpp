@@ -41,6 +41,50 @@ bool try_call_function(pyhelp::PyObjRef &py_module, const char *name) {
     return try_call_function(py_module, name, "()");
 }
 
+static PyObject *vectorcall(PyObject *py_func, PyObject *const *args,
+                            size_t nargs) {
+#if PY_MAJOR_VERSION == 3 && PY_MINOR_VERSION < 9
+    return _PyObject_Vectorcall(py_func, args, nargs, nullptr);
+#else
+    return PyObject_Vectorcall(py_func, args, nargs, nullptr);
+#endif
+}
+
+void handle_py_err(PyObject *py_error_handler, PyObject *py_func) {
+    PyObject *py_err_type, *py_err_value, *py_err_traceback;
+    PyErr_Fetch(&py_err_type, &py_err_value, &py_err_traceback);
+    PyErr_NormalizeException(&py_err_type, &py_err_value, &py_err_traceback);
+    if (py_err_traceback != nullptr) {
+        PyException_SetTraceback(py_err_value, py_err_traceback);
+    }
+    PyObject *args[] = {py_func, py_err_value};
+    PyObjRef ret(PyObjRef::steal(vectorcall(py_error_handler, args, 2)));
+    Py_XDECREF(py_err_type);
+    Py_XDECREF(py_err_value);
+    Py_XDECREF(py_err_traceback);
+    if (ret.get() == nullptr) {
+        log_and_clear_py_err();
+    }
+}
+
+bool try_vectorcall(PyObject *py_func, PyObject *const *args, size_t nargs,
+                    PyObject *py_error_handler) {
+    if (py_func == nullptr || !PyCallable_Check(py_func)) {
+        log_loader("Not a function");
+        return false;
+    }
+    PyObjRef ret(PyObjRef::steal(vectorcall(py_func, args, nargs)));
+    if (ret.get() == nullptr) {
+        if (py_error_handler != nullptr) {
+            handle_py_err(py_error_handler, py_func);
+        } else {
+            log_and_clear_py_err();
+        }
+        return false;
+    }
+    return true;
+}
+
 PyObjRef::PyObjRef() : py_obj_(nullptr) {
 }
     
@@ -52,14 +96,22 @@ PyObjRef::PyObjRef(const PyObjRef &other) : py_obj_(other.py_obj_) {
     inc_ref();
 }
 
-PyObjRef::PyObjRef(PyObjRef &&other) : py_obj_(other.py_obj_) {
+PyObjRef::PyObjRef(PyObjRef &&other) noexcept : py_obj_(other.py_obj_) {
     other.py_obj_ = nullptr;
 }
 
 PyObjRef &PyObjRef::operator=(const PyObjRef &other) {
     if (&other != this) {
+        set(other.py_obj_);
+    }
+    return *this;
+}
+
+PyObjRef &PyObjRef::operator=(PyObjRef &&other) noexcept {
+    if (&other != this) {
+        dec_ref();
         py_obj_ = other.py_obj_;
-        inc_ref();
+        other.py_obj_ = nullptr;
     }
     return *this;
 }
@@ -84,6 +136,18 @@ void PyObjRef::reset() {
     set(nullptr);
 }
 
+PyObjRef PyObjRef::steal(PyObject *py_obj) {
+    PyObjRef ref;
+    ref.py_obj_ = py_obj;
+    return ref;
+}
+
+PyObject *PyObjRef::release() {
+    PyObject *py_obj = py_obj_;
+    py_obj_ = nullptr;
+    return py_obj;
+}
+
 void PyObjRef::inc_ref() {
     if (py_obj_ != nullptr) {
         Py_INCREF(py_obj_);
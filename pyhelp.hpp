@@ -35,13 +35,22 @@ public:
     PyObjRef();    
     explicit PyObjRef(PyObject *py_obj);
     PyObjRef(const PyObjRef &other);
-    PyObjRef(PyObjRef &&other);
+    PyObjRef(PyObjRef &&other) noexcept;
     PyObjRef &operator=(const PyObjRef &other);
+    PyObjRef &operator=(PyObjRef &&other) noexcept;
     ~PyObjRef();
 
     PyObject *get();
     void set(PyObject *py_obj);
     void reset();
+
+    // Takes over a new reference, e.g. from PyLong_FromLong(), without
+    // increasing the reference count
+    static PyObjRef steal(PyObject *py_obj);
+
+    // Gives up the reference without decreasing the reference count,
+    // e.g. for returning a new reference to Python
+    PyObject *release();
 private:
     void inc_ref();
     void dec_ref();
@@ -84,6 +93,16 @@ bool try_call_function(pyhelp::PyObjRef &py_module,
 
 bool try_call_function(pyhelp::PyObjRef &py_module, const char *name);
 
+// Passes the current exception to py_error_handler(py_func, exception)
+// and clears it
+void handle_py_err(PyObject *py_error_handler, PyObject *py_func);
+
+// Calls py_func with the arguments in the array, without creating an
+// argument tuple. Exceptions are passed to py_error_handler, if given,
+// or logged.
+bool try_vectorcall(PyObject *py_func, PyObject *const *args, size_t nargs,
+                    PyObject *py_error_handler = nullptr);
+
 }
 
 #endif
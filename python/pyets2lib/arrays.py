@@ -0,0 +1,85 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+from pyets2lib.scsdefs import *
+
+# Layout of the NumPy arrays delivered by register_for_channel(array=True).
+# NumPy is an optional dependency. It is imported on first use, so
+# plug-ins that do not use arrays do not pay for it.
+
+# NumPy type and number of components of each value type. The components
+# of a value are contiguous, like in the scs_value_*_t types.
+# dplacement mixes doubles and floats, so it cannot be an array.
+_ELEMENTS = {
+    SCS_VALUE_TYPE_bool: ('bool_', 1),
+    SCS_VALUE_TYPE_s32: ('int32', 1),
+    SCS_VALUE_TYPE_u32: ('uint32', 1),
+    SCS_VALUE_TYPE_u64: ('uint64', 1),
+    SCS_VALUE_TYPE_s64: ('int64', 1),
+    SCS_VALUE_TYPE_float: ('float32', 1),
+    SCS_VALUE_TYPE_double: ('float64', 1),
+    SCS_VALUE_TYPE_fvector: ('float32', 3),
+    SCS_VALUE_TYPE_dvector: ('float64', 3),
+    SCS_VALUE_TYPE_euler: ('float32', 3),
+    SCS_VALUE_TYPE_fplacement: ('float32', 6),
+}
+
+def create(channel):
+    '''
+    Returns (array, elements) for channel, an indexed ScsChannel or an
+    ScsIndexedChannel, with a zeroed C-contiguous array and a list of
+    (ScsChannel, index, offset) giving the byte offset of each channel
+    value in the array.
+
+    The array is shaped [index_count] for an indexed channel, [trailers]
+    or [trailers, index_count] for an ScsIndexedChannel, with an extra
+    dimension for the components of vectors and placements, e.g.
+    [index_count, 3] for fvector.
+    '''
+    element = _ELEMENTS.get(channel.type)
+    if element is None:
+        raise ValueError("Channel \"%s\" type %d cannot be an array" %
+                         (channel.name, channel.type))
+    if isinstance(channel, ScsIndexedChannel):
+        channels = channel.channels
+        shape = (len(channels),)
+    elif channel.indexed:
+        channels = (channel,)
+        shape = ()
+    else:
+        raise ValueError("Channel \"%s\" is not indexed" % channel.name)
+    if channel.indexed:
+        shape += (channel.index_count,)
+    type_name, components = element
+    if components > 1:
+        shape += (components,)
+
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError("Array channels require NumPy") from e
+    dtype = numpy.dtype(getattr(numpy, type_name))
+    array = numpy.zeros(shape, dtype)
+    value_size = dtype.itemsize * components
+    elements = []
+    for child in channels:
+        indexes = range(child.index_count) if child.indexed else (None,)
+        for index in indexes:
+            elements.append((child, index, len(elements) * value_size))
+    return array, elements
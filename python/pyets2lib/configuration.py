@@ -0,0 +1,204 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import logging
+import pyets2lib.scshelpers
+from pyets2lib.scsdefs import *
+
+import _telemetry
+
+# Configuration and gameplay events decoded once, for all plug-ins, into
+# ScsConfiguration objects keyed by ScsAttribute. The latest configuration
+# of each id is kept, so listeners can be called only when the attributes
+# they are interested in change.
+
+class ScsConfiguration(object):
+    '''
+    Attribute values of a configuration or gameplay event.
+
+    Values are looked up by ScsAttribute, e.g.
+    config[SCS_TELEMETRY_CONFIG_ATTRIBUTE_brand]. Indexed attributes are
+    lists, with None for indexes that were not sent.
+    '''
+    __slots__ = ('id', 'values')
+
+    def __init__(self, id, values):
+        self.id: str = id
+        self.values: dict = values
+
+    def __getitem__(self, attribute):
+        return self.values[attribute]
+
+    def __contains__(self, attribute):
+        return attribute in self.values
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, attribute, index=None, default=None):
+        '''
+        Returns the value of attribute, or of one index of an indexed
+        attribute, or default if it was not sent.
+        '''
+        value = self.values.get(attribute)
+        if value is not None and index is not None:
+            value = value[index] if index < len(value) else None
+        return default if value is None else value
+
+    def items(self):
+        return self.values.items()
+
+    def changed(self, previous):
+        '''
+        Returns the set of attributes that differ from the configuration
+        previous, including attributes that were added or removed.
+        '''
+        if previous is None:
+            return frozenset(self.values)
+        old_values = previous.values
+        changed = [attribute for attribute, value in self.values.items()
+                   if old_values.get(attribute) != value]
+        changed.extend(attribute for attribute in old_values
+                       if attribute not in self.values)
+        return frozenset(changed)
+
+def decode(event_info):
+    '''
+    Decodes the event info dict of a configuration or gameplay event.
+    '''
+    values = {}
+    for name, index, value in event_info['attributes']:
+        attribute = SCS_ATTRIBUTES.get(name)
+        if attribute is None:
+            # Attribute added in a later SDK version
+            attribute = ScsAttribute(name, index is not None)
+        if index is None:
+            values[attribute] = value
+            continue
+        array = values.get(attribute)
+        if array is None:
+            array = values[attribute] = []
+        if index >= len(array):
+            array.extend([None] * (index + 1 - len(array)))
+        array[index] = value
+    return ScsConfiguration(event_info['id'], values)
+
+class _Listener(object):
+    __slots__ = ('config_id', 'attributes', 'changed_only', 'callback', 'context')
+
+    def __init__(self, config_id, attributes, changed_only, callback, context):
+        self.config_id = config_id
+        self.attributes = attributes
+        self.changed_only = changed_only
+        self.callback = callback
+        self.context = context
+
+class _Tracker(object):
+    '''
+    Latest configurations and listeners of one event.
+    '''
+    def __init__(self, event):
+        self.event = event
+        self.configs = {}
+        self.listeners = []
+        self.registered = False
+
+    def add_listener(self, listener):
+        if not self.registered:
+            ret = _telemetry.register_for_event(self.event.id, self.event,
+                                                _event_cb, self)
+            if ret != SCS_RESULT_ok:
+                raise Exception("Failed to register to event \"%s\": %d" %
+                                (self.event.id, ret))
+            self.registered = True
+        self.listeners.append(listener)
+
+    def remove_listener(self, callback, context):
+        for listener in self.listeners:
+            if listener.callback == callback and listener.context == context:
+                # Replace the list, as update() may be iterating over it
+                self.listeners = [other for other in self.listeners
+                                  if other is not listener]
+                return True
+        return False
+
+    def update(self, event_info):
+        config = decode(event_info)
+        previous = self.configs.get(config.id)
+        self.configs[config.id] = config
+        changed = None
+        for listener in self.listeners:
+            if listener.config_id is not None and listener.config_id != config.id:
+                continue
+            if changed is None:
+                changed = config.changed(previous)
+            if listener.changed_only:
+                if listener.attributes is None:
+                    if not changed:
+                        continue
+                elif changed.isdisjoint(listener.attributes):
+                    continue
+            try:
+                listener.callback(config, changed, listener.context)
+            except Exception as e:
+                logger = logging.getLogger(getattr(listener.callback, '__module__', None))
+                pyets2lib.scshelpers.log_exception(logger, e, listener.callback)
+
+trackers_ = {
+    SCS_TELEMETRY_EVENT_configuration: _Tracker(SCS_TELEMETRY_EVENT_configuration),
+    SCS_TELEMETRY_EVENT_gameplay: _Tracker(SCS_TELEMETRY_EVENT_gameplay),
+}
+
+def _event_cb(event, event_info, tracker):
+    tracker.update(event_info)
+
+def register(event, callback, config_id=None, attributes=None, context=None,
+             changed_only=True):
+    '''
+    Calls callback(config, changed, context) for configuration or gameplay
+    events with config_id, or all ids if None. config is an
+    ScsConfiguration and changed the set of attributes that changed since
+    the previous event with the same id.
+
+    If changed_only is True, the callback is only called when any of
+    attributes, or any attribute if None, changed. Must be called on the
+    game thread, e.g. from telemetry_init().
+    '''
+    if attributes is not None:
+        attributes = frozenset(attributes)
+    trackers_[event].add_listener(_Listener(config_id, attributes, changed_only,
+                                            callback, context))
+
+def unregister(event, callback, context=None):
+    '''
+    Removes a listener added with register(). The latest configurations
+    are still kept, see get().
+    '''
+    if not trackers_[event].remove_listener(callback, context):
+        raise Exception("Not registered to event \"%s\"" % event.id)
+
+def get(event, config_id):
+    '''
+    Returns the latest ScsConfiguration of event with config_id, or None
+    if it has not been received.
+    '''
+    return trackers_[event].configs.get(config_id)
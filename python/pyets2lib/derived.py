@@ -0,0 +1,355 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import collections
+import logging
+import pyets2lib.scshelpers
+from pyets2lib.scsdefs import *
+
+import _telemetry
+
+# Channels computed from other channels, shared by all plug-ins. Register
+# for them with params.register_for_channel(), like SCS channels.
+#
+# The inputs of the subscribed derived channels are batched by the native
+# loader and delivered once per frame. Each derived channel is then
+# evaluated once, if any of its inputs changed, and its subscribers are
+# called if the result changed.
+
+DERIVED_CHANNELS = []
+
+class ScsDerivedChannel(ScsChannelBase):
+    '''
+    A channel computed by function from the latest values of inputs,
+    which are ScsChannels, (ScsChannel, index) tuples for indexed
+    channels, ScsIndexedChannels for the channel of all trailers, or
+    other derived channels declared before this one.
+
+    function is called as function(*values) and returns the value of the
+    channel. A function that keeps state, e.g. a RollingMean, is instead
+    given as factory, which is called each time the channel is subscribed
+    to, so that the state starts over. If partial is False, function is
+    only called once all inputs have a value, else missing values are
+    None.
+    '''
+    __slots__ = ('inputs', 'function', 'factory', 'partial')
+
+    def __init__(self, name, type, inputs, function=None, partial=False,
+                 factory=None):
+        super().__init__(name, name, type)
+        if (function is None) == (factory is None):
+            raise ValueError("Either function or factory must be given")
+        self.inputs: tuple = tuple(input if isinstance(input, tuple) else (input, None)
+                                   for input in inputs)
+        self.function = function
+        self.factory = factory
+        self.partial: bool = partial
+        DERIVED_CHANNELS.append(self)
+
+class RollingMean(object):
+    '''
+    Mean of the last size values, updated in O(1).
+    '''
+    __slots__ = ('_values', '_sum')
+
+    def __init__(self, size):
+        self._values = collections.deque(maxlen=size)
+        self._sum = 0.0
+
+    def __call__(self, value):
+        if len(self._values) == self._values.maxlen:
+            self._sum -= self._values[0]
+        self._values.append(value)
+        self._sum += value
+        return self._sum / len(self._values)
+
+class RollingMin(object):
+    '''
+    Minimum of the last size values, updated in amortized O(1) using a
+    monotonic queue.
+    '''
+    __slots__ = ('_size', '_count', '_queue')
+
+    def __init__(self, size):
+        self._size = size
+        self._count = 0
+        # (sequence number, value), with increasing values
+        self._queue = collections.deque()
+
+    def _keep(self, queued, value):
+        return queued < value
+
+    def __call__(self, value):
+        queue = self._queue
+        while queue and not self._keep(queue[-1][1], value):
+            queue.pop()
+        queue.append((self._count, value))
+        if queue[0][0] <= self._count - self._size:
+            queue.popleft()
+        self._count += 1
+        return queue[0][1]
+
+class RollingMax(RollingMin):
+    '''
+    Maximum of the last size values, updated in amortized O(1).
+    '''
+    __slots__ = ()
+
+    def _keep(self, queued, value):
+        return queued > value
+
+class Delta(object):
+    '''
+    Difference between the value and the first value.
+    '''
+    __slots__ = ('_first',)
+
+    def __init__(self):
+        self._first = None
+
+    def __call__(self, value):
+        if self._first is None:
+            self._first = value
+        return value - self._first
+
+class RollingRatio(object):
+    '''
+    Change of numerator divided by change of denominator over the last
+    size values, e.g. fuel used per distance, updated in O(1). None until
+    the denominator has changed.
+    '''
+    __slots__ = ('_values', 'scale')
+
+    def __init__(self, size, scale=1.0):
+        self._values = collections.deque(maxlen=size)
+        self.scale = scale
+
+    def __call__(self, numerator, denominator):
+        self._values.append((numerator, denominator))
+        first_numerator, first_denominator = self._values[0]
+        if denominator == first_denominator:
+            return None
+        return (numerator - first_numerator) / (denominator - first_denominator) * self.scale
+
+STANDARD_GRAVITY = 9.80665
+
+def _g_force(acceleration):
+    return _telemetry.scs_value_fvector_t((acceleration.x / STANDARD_GRAVITY,
+                                           acceleration.y / STANDARD_GRAVITY,
+                                           acceleration.z / STANDARD_GRAVITY))
+
+def _max_present(*values):
+    present = [value for value in values if value is not None]
+    return max(present) if present else None
+
+DERIVED_CHANNEL_speed_kmh = ScsDerivedChannel(
+    'derived.speed.kmh', SCS_VALUE_TYPE_float,
+    (SCS_TELEMETRY_TRUCK_CHANNEL_speed,), lambda speed: speed * 3.6)
+# Speed averaged over the last 60 changes
+DERIVED_CHANNEL_speed_kmh_mean = ScsDerivedChannel(
+    'derived.speed.kmh.mean', SCS_VALUE_TYPE_float,
+    (DERIVED_CHANNEL_speed_kmh,), factory=lambda: RollingMean(60))
+# Distance driven since the channel was first evaluated, in km
+DERIVED_CHANNEL_distance_km = ScsDerivedChannel(
+    'derived.distance.km', SCS_VALUE_TYPE_float,
+    (SCS_TELEMETRY_TRUCK_CHANNEL_odometer,), factory=Delta)
+# Fuel used over the last 600 changes, in l/100 km. Fuel increases
+# when refuelling, which gives negative values.
+DERIVED_CHANNEL_fuel_consumption = ScsDerivedChannel(
+    'derived.fuel.consumption', SCS_VALUE_TYPE_float,
+    (SCS_TELEMETRY_TRUCK_CHANNEL_fuel, SCS_TELEMETRY_TRUCK_CHANNEL_odometer),
+    factory=lambda: RollingRatio(600, -100.0))
+# Acceleration in the truck space, in g
+DERIVED_CHANNEL_g_force = ScsDerivedChannel(
+    'derived.g_force', SCS_VALUE_TYPE_fvector,
+    (SCS_TELEMETRY_TRUCK_CHANNEL_local_linear_acceleration,), _g_force)
+# Highest body, chassis or wheel wear of all trailers
+DERIVED_CHANNEL_trailer_wear_max = ScsDerivedChannel(
+    'derived.trailer.wear.max', SCS_VALUE_TYPE_float,
+    (SCS_TELEMETRY_TRAILER_CHANNEL_wear_body,
+     SCS_TELEMETRY_TRAILER_CHANNEL_wear_chassis,
+     SCS_TELEMETRY_TRAILER_CHANNEL_wear_wheels),
+    _max_present, partial=True)
+
+logger_ = logging.getLogger(__name__)
+
+class _State(object):
+    '''
+    Evaluation state of a subscribed derived channel
+    '''
+    __slots__ = ('channel', 'function', 'inputs', 'value', 'listeners')
+
+    def __init__(self, channel):
+        self.channel = channel
+        self.function = (channel.function if channel.factory is None
+                         else channel.factory())
+        # Keys in values_ of the inputs, with the trailer channels
+        # created only now
+        self.inputs = []
+        for input_channel, index in channel.inputs:
+            if isinstance(input_channel, ScsIndexedChannel):
+                self.inputs.extend((trailer_channel, index)
+                                   for trailer_channel in input_channel.channels)
+            else:
+                self.inputs.append((input_channel, index))
+        self.value = None
+        # (callback, context)
+        self.listeners = []
+
+# Latest input values by (channel, index)
+values_ = {}
+# _State by derived channel, in declaration order
+states_ = {}
+# _States by input key
+dependents_ = {}
+frame_sink_ = None
+# Derived channels to evaluate at this frame end
+dirty_ = set()
+
+def _activate(channel):
+    global frame_sink_
+    state = states_.get(channel)
+    if state is not None:
+        return state
+    if frame_sink_ is None:
+        frame_sink_ = _telemetry.register_for_frame(_frame_cb, None)
+    state = _State(channel)
+    added = []
+    try:
+        for key in state.inputs:
+            input_channel, index = key
+            if isinstance(input_channel, ScsDerivedChannel):
+                _activate(input_channel)
+            elif key not in dependents_:
+                ret = _telemetry.register_for_channel(input_channel.name,
+                                                      SCS_U32_NIL if index is None else index,
+                                                      input_channel.type,
+                                                      SCS_TELEMETRY_CHANNEL_FLAG_none,
+                                                      input_channel,
+                                                      None,
+                                                      None,
+                                                      frame_sink_)
+                if ret not in (SCS_RESULT_ok, SCS_RESULT_not_found):
+                    raise Exception("Failed to register to channel \"%s\" for \"%s\": %d" %
+                                    (input_channel.name, channel.name, ret))
+            dependents_.setdefault(key, []).append(state)
+            added.append(key)
+    except Exception:
+        # Release the inputs registered so far
+        _release_inputs(state, added)
+        raise
+    # Keep declaration order, so inputs are evaluated before their users
+    states_[channel] = state
+    ordered = sorted(states_.values(),
+                     key=lambda state: DERIVED_CHANNELS.index(state.channel))
+    states_.clear()
+    states_.update((state.channel, state) for state in ordered)
+    return state
+
+def register(channel, callback, context=None):
+    '''
+    Calls callback(channel, None, value, context) at frame end when the
+    value of the derived channel changes. Must be called on the game
+    thread, e.g. from telemetry_init().
+    '''
+    _activate(channel).listeners.append((callback, context))
+
+def unregister(channel, callback, context=None):
+    '''
+    Removes a listener added with register(). A derived channel without
+    listeners, that no subscribed derived channel uses, is no longer
+    evaluated and its inputs are released.
+    '''
+    state = states_.get(channel)
+    listener = (callback, context)
+    if state is None or listener not in state.listeners:
+        raise Exception("Not registered to derived channel \"%s\"" % channel.name)
+    # Replace the list, as _frame_cb() may be iterating over it
+    listeners = list(state.listeners)
+    listeners.remove(listener)
+    state.listeners = listeners
+    _deactivate(state)
+
+def _deactivate(state):
+    if state.listeners or dependents_.get((state.channel, None)):
+        return
+    del states_[state.channel]
+    values_.pop((state.channel, None), None)
+    _release_inputs(state, state.inputs)
+
+def _release_inputs(state, keys):
+    for key in keys:
+        users = dependents_[key]
+        users.remove(state)
+        if users:
+            continue
+        del dependents_[key]
+        values_.pop(key, None)
+        input_channel, index = key
+        if isinstance(input_channel, ScsDerivedChannel):
+            _deactivate(states_[input_channel])
+        else:
+            _telemetry.unregister_from_channel(input_channel.name,
+                                               SCS_U32_NIL if index is None else index,
+                                               None,
+                                               None,
+                                               frame_sink_)
+
+def get(channel):
+    '''
+    Returns the latest value of a subscribed derived channel, or None.
+    '''
+    state = states_.get(channel)
+    return None if state is None else state.value
+
+def _frame_cb(values, context):
+    for channel, index, value in values:
+        if index == SCS_U32_NIL & 0xffffffff:
+            index = None
+        key = (channel, index)
+        values_[key] = value
+        for state in dependents_.get(key, ()):
+            dirty_.add(state.channel)
+    if not dirty_:
+        return
+    # Listeners may unregister, which changes states_
+    for channel, state in tuple(states_.items()):
+        if channel not in dirty_:
+            continue
+        inputs = [values_.get(key) for key in state.inputs]
+        if not channel.partial and None in inputs:
+            continue
+        try:
+            value = state.function(*inputs)
+        except Exception as e:
+            pyets2lib.scshelpers.log_exception(logger_, e, state.function)
+            continue
+        if value == state.value:
+            continue
+        state.value = value
+        values_[(channel, None)] = value
+        for dependent in dependents_.get((channel, None), ()):
+            dirty_.add(dependent.channel)
+        for callback, listener_context in state.listeners:
+            try:
+                callback(channel, None, value, listener_context)
+            except Exception as e:
+                logger = logging.getLogger(getattr(callback, '__module__', None))
+                pyets2lib.scshelpers.log_exception(logger, e, callback)
+    dirty_.clear()
@@ -0,0 +1,253 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import collections
+import mmap
+import struct
+import zlib
+from pyets2lib.scsdefs import *
+
+# Reader of the columnar exports made by the native loader, see
+# start_export() in pyets2lib.loader. The format is described in
+# exporter.hpp. Does not need the game, so it can be used for offline
+# analysis. Only the chunk headers are read when opening, and only the
+# selected columns of the chunks in the selected time range are
+# decompressed. Requires NumPy, which is imported on first use.
+
+EXPORT_MAGIC = b'PYETS2CO'
+EXPORT_VERSION = 2
+CHUNK_MAGIC = b'CHNK'
+FRAME_COLUMNS = ('render_time', 'simulation_time', 'paused_simulation_time')
+
+ExportColumn = collections.namedtuple('ExportColumn', (
+    'internal_id',  # ScsChannel.internal_id
+    'name',
+    'index',        # None if not indexed
+    'type',
+))
+
+ExportData = collections.namedtuple('ExportData', (
+    'frames',       # Frame numbers, counted from the start of the export
+    'render_time',
+    'simulation_time',
+    'paused_simulation_time',
+    'values',       # Array per requested channel
+))
+
+# Flag of an uncompressed column size, since version 2
+RAW_COLUMN = 0x80000000
+
+_Chunk = collections.namedtuple('_Chunk', (
+    'rows', 'first_frame', 'first_render_time', 'last_render_time',
+    'offsets', 'sizes'))
+
+_u16 = struct.Struct('=H')
+_u32 = struct.Struct('=I')
+_header = struct.Struct('=8sII')
+_column = struct.Struct('=IIII')
+_chunk = struct.Struct('=4sIQQQ')
+
+# NumPy type and shape of a value of each value type. dplacement mixes
+# doubles and floats, so it is a structured type.
+_DTYPES = {
+    SCS_VALUE_TYPE_bool: ('=?', ()),
+    SCS_VALUE_TYPE_s32: ('=i4', ()),
+    SCS_VALUE_TYPE_u32: ('=u4', ()),
+    SCS_VALUE_TYPE_u64: ('=u8', ()),
+    SCS_VALUE_TYPE_s64: ('=i8', ()),
+    SCS_VALUE_TYPE_float: ('=f4', ()),
+    SCS_VALUE_TYPE_double: ('=f8', ()),
+    SCS_VALUE_TYPE_fvector: ('=f4', (3,)),
+    SCS_VALUE_TYPE_dvector: ('=f8', (3,)),
+    SCS_VALUE_TYPE_euler: ('=f4', (3,)),
+    SCS_VALUE_TYPE_fplacement: ('=f4', (6,)),
+    SCS_VALUE_TYPE_dplacement: ([('position', '=f8', (3,)),
+                                 ('orientation', '=f4', (3,))], ()),
+}
+
+class ExportError(Exception):
+    pass
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError as e:
+        raise ImportError("Reading exports requires NumPy") from e
+    return numpy
+
+class Export(object):
+    '''
+    A memory-mapped export. columns lists the exported channels, in file
+    order. Use read() or chunks() to load the values of some of them.
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self.game_version = _header.unpack_from(self._map)
+            if magic != EXPORT_MAGIC or not 1 <= version <= EXPORT_VERSION:
+                raise ExportError("Not a version 1 to %d export: %s" %
+                                  (EXPORT_VERSION, path))
+            offset = _header.size
+            self.game_id, offset = self._string(offset)
+            self.game_name, offset = self._string(offset)
+            count, = _u32.unpack_from(self._map, offset)
+            offset += _u32.size
+            self.columns = []
+            self._sizes = []
+            for _ in range(count):
+                internal_id, index, value_type, size = _column.unpack_from(self._map, offset)
+                name, offset = self._string(offset + _column.size)
+                if index == SCS_U32_NIL & 0xffffffff:
+                    index = None
+                self.columns.append(ExportColumn(internal_id, name, index, value_type))
+                self._sizes.append(size)
+            self._chunks = self._read_chunks(offset)
+        except (struct.error, ExportError):
+            self._map.close()
+            raise
+        self._positions = {(column.internal_id, column.index): position
+                           for position, column in enumerate(self.columns)}
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        '''
+        Number of rows, i.e. exported frames
+        '''
+        return sum(chunk.rows for chunk in self._chunks)
+
+    def _string(self, offset):
+        length, = _u16.unpack_from(self._map, offset)
+        offset += _u16.size
+        value = self._map[offset:offset + length].decode('utf-8', 'replace')
+        # Skip the NUL
+        return value, offset + length + 1
+
+    def _read_chunks(self, offset):
+        column_count = len(FRAME_COLUMNS) + len(self.columns)
+        sizes_struct = struct.Struct('=%dI' % column_count)
+        chunks = []
+        end = len(self._map)
+        while offset + _chunk.size + sizes_struct.size <= end:
+            magic, rows, first_frame, first_render_time, last_render_time = \
+                _chunk.unpack_from(self._map, offset)
+            if magic != CHUNK_MAGIC:
+                raise ExportError("No chunk at offset %d" % offset)
+            offset += _chunk.size
+            sizes = sizes_struct.unpack_from(self._map, offset)
+            offset += sizes_struct.size
+            offsets = []
+            for size in sizes:
+                offsets.append(offset)
+                offset += size & ~RAW_COLUMN
+            if offset > end:
+                # Truncated, as the export was not stopped properly
+                break
+            chunks.append(_Chunk(rows, first_frame, first_render_time,
+                                 last_render_time, offsets, sizes))
+        return chunks
+
+    def find(self, channel, index=None):
+        '''
+        Returns the position in columns of channel, an ScsChannel or an
+        internal id, and index. Raises KeyError if it was not exported.
+        '''
+        internal_id = getattr(channel, 'internal_id', channel)
+        return self._positions[(internal_id, index)]
+
+    def _find_all(self, channels):
+        positions = []
+        for channel in channels:
+            index = None
+            if isinstance(channel, tuple):
+                channel, index = channel
+            positions.append(self.find(channel, index))
+        return positions
+
+    def _column(self, chunk, position, dtype, shape):
+        size = chunk.sizes[position]
+        data = self._map[chunk.offsets[position]:
+                         chunk.offsets[position] + (size & ~RAW_COLUMN)]
+        if not size & RAW_COLUMN:
+            data = zlib.decompress(data)
+        return _numpy().frombuffer(data, dtype).reshape((chunk.rows,) + shape)
+
+    def chunks(self, channels, start=None, end=None):
+        '''
+        Yields an ExportData per chunk, with the rows with a render_time
+        in [start, end), in microseconds, and the values of channels, a
+        list of ScsChannels, internal ids or (channel, index) tuples. Only
+        one chunk at a time is in memory, so this suits long sessions.
+
+        Values are NumPy arrays, with an extra dimension for vectors and
+        placements, and a structured type for dplacement. Values are zero
+        in the rows before the first value of the channel.
+        '''
+        numpy = _numpy()
+        positions = self._find_all(channels)
+        time_positions = range(len(FRAME_COLUMNS))
+        for chunk in self._chunks:
+            if ((start is not None and chunk.last_render_time < start) or
+                    (end is not None and chunk.first_render_time >= end)):
+                continue
+            times = [self._column(chunk, position, '=u8', ())
+                     for position in time_positions]
+            rows = slice(None)
+            if start is not None or end is not None:
+                render_time = times[0]
+                mask = numpy.ones(chunk.rows, bool)
+                if start is not None:
+                    mask &= render_time >= start
+                if end is not None:
+                    mask &= render_time < end
+                rows = mask
+            values = []
+            for position in positions:
+                dtype, shape = _DTYPES[self.columns[position].type]
+                values.append(self._column(chunk, len(FRAME_COLUMNS) + position,
+                                           dtype, shape)[rows])
+            frames = numpy.arange(chunk.first_frame, chunk.first_frame + chunk.rows,
+                                  dtype=numpy.uint64)[rows]
+            yield ExportData(frames, *(time[rows] for time in times), values)
+
+    def read(self, channels, start=None, end=None):
+        '''
+        Returns one ExportData with the rows of all chunks, see chunks()
+        '''
+        numpy = _numpy()
+        parts = list(self.chunks(channels, start, end))
+        if not parts:
+            empty = numpy.zeros(0, numpy.uint64)
+            values = []
+            for position in self._find_all(channels):
+                dtype, shape = _DTYPES[self.columns[position].type]
+                values.append(numpy.zeros((0,) + shape, dtype))
+            return ExportData(empty, empty, empty, empty, values)
+        return ExportData(*(numpy.concatenate([part[i] for part in parts])
+                            for i in range(len(FRAME_COLUMNS) + 1)),
+                          [numpy.concatenate([part.values[i] for part in parts])
+                           for i in range(len(parts[0].values))])
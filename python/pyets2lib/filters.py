@@ -0,0 +1,86 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import collections
+from pyets2lib.scsdefs import *
+
+import _telemetry
+
+# Filters of channel values, evaluated by the native loader before the
+# GIL is taken, so a suppressed value costs no Python call.
+
+class ChannelFilter(collections.namedtuple('ChannelFilter', (
+        'on_change', 'deadband', 'relative_deadband', 'max_hz', 'min_interval'))):
+    '''
+    Filter spec for register_for_channel().
+
+    on_change: Only deliver values that differ from the last delivered value.
+    deadband: Only deliver values where a component differs by more than
+        deadband from the last delivered value. Implies on_change.
+    relative_deadband: As deadband, but relative to the magnitude of the
+        last delivered component, e.g. 0.01 for 1 %. Both deadbands must be
+        exceeded when both are given.
+    max_hz, min_interval: Deliver at most max_hz values per second, or one
+        value per min_interval seconds, of game render time.
+
+    Deadbands apply to numeric and vector types. Other types are compared
+    for equality. A missing value is always delivered.
+    '''
+    __slots__ = ()
+
+    def __new__(cls, on_change=False, deadband=0.0, relative_deadband=0.0,
+                max_hz=None, min_interval=None):
+        if deadband < 0 or relative_deadband < 0:
+            raise ValueError("Deadbands must not be negative")
+        if max_hz is not None and max_hz <= 0:
+            raise ValueError("max_hz must be positive")
+        return super().__new__(cls, on_change, deadband, relative_deadband,
+                               max_hz, min_interval)
+
+    def _native(self):
+        interval = 0.0
+        if self.max_hz is not None:
+            interval = 1.0 / self.max_hz
+        if self.min_interval is not None:
+            interval = max(interval, self.min_interval)
+        return (bool(self.on_change), float(self.deadband),
+                float(self.relative_deadband), int(interval * 1e6))
+
+FilterStats = collections.namedtuple('FilterStats', (
+    'channel',
+    'index',       # None if not indexed
+    'callback',    # None for batched listeners
+    'context',
+    'delivered',
+    'suppressed',
+))
+
+def stats():
+    '''
+    Returns a list of FilterStats, one per filtered channel listener.
+    Cleared by pyets2lib.stats.reset().
+    '''
+    result = []
+    for (channel, index, callback, context,
+         delivered, suppressed) in _telemetry.filter_stats():
+        if index == SCS_U32_NIL & 0xffffffff:
+            index = None
+        result.append(FilterStats(channel, index, callback, context,
+                                  delivered, suppressed))
+    return result
@@ -0,0 +1,133 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import importlib
+import logging
+import pyets2lib.scshelpers
+from pyets2lib.scsdefs import *
+
+import _telemetry_isolated
+
+# Runs a plug-in in a subinterpreter with its own GIL, on a host thread
+# of the native loader. See ISOLATE_ENV in pyets2lib.loader.
+#
+# The native loader copies the values of the registered channels and
+# events to the host and wakes it at frame end. The callbacks are then
+# called with all values of the frame, in parallel with the game and the
+# other plug-ins. Values are plain Python values, with vectors and
+# placements as tuples, and event_info is always None.
+
+class TelemetryLogHandler(logging.Handler):
+    def emit(self, record):
+        _telemetry_isolated.log(self.format(record))
+
+logging.basicConfig(level=logging.INFO, handlers=(TelemetryLogHandler(),))
+
+module_ = None
+# [channel, index, [(callback, context)]] by channel key
+channels_ = {}
+# Channel keys by (channel name, index)
+channel_keys_ = {}
+# [event, [(callback, context)]] by event id
+events_ = {}
+
+class scs_telemetry_init_params_isolated_t(object):
+    '''
+    The init params of an isolated plug-in. Only plain channel and event
+    listeners are available, and there is no store.
+    '''
+    def __init__(self, common):
+        self.common = common
+        self.store = None
+
+    def register_for_event(self, event, callback, context=None):
+        '''
+        Register for listening on frame_start, frame_end, paused or
+        started. The callback should be declared as:
+        def event_cb(event, event_info, context)
+        '''
+        if event.id not in events_:
+            _telemetry_isolated.register_for_event(event.id)
+            events_[event.id] = [event, []]
+        events_[event.id][1].append((callback, context))
+
+    def register_for_channel(self, channel, callback, index=None, context=None):
+        '''
+        Register for listening on a channel. The callback should be
+        declared as:
+        def channel_cb(channel, index, value, context)
+        '''
+        scs_index = SCS_U32_NIL if index is None else index
+        key = channel_keys_.get((channel.name, scs_index))
+        if key is None:
+            key = _telemetry_isolated.register_for_channel(channel.name,
+                                                           scs_index,
+                                                           channel.type)
+            channel_keys_[(channel.name, scs_index)] = key
+            channels_[key] = [channel, index, []]
+        channels_[key][2].append((callback, context))
+
+class scs_sdk_init_params_v100_t(object):
+    def __init__(self, game_name, game_id, game_version, logger):
+        self.game_name = game_name
+        self.game_id = game_id
+        self.game_version = game_version
+        self.logger = logger
+
+def _call(callback, *args):
+    try:
+        callback(*args)
+    except Exception as e:
+        logger = logging.getLogger(getattr(callback, '__module__', None))
+        pyets2lib.scshelpers.log_exception(logger, e, callback)
+
+def init(plugin, version, game_name, game_id, game_version):
+    '''
+    Called by the native loader on the host thread. Imports the plug-in
+    package and calls its telemetry_init(). Exceptions are left to the
+    loader, which then loads the plug-in in the main interpreter.
+    '''
+    global module_
+    module = importlib.import_module(plugin)
+    common = scs_sdk_init_params_v100_t(game_name, game_id, game_version,
+                                        logging.getLogger(plugin))
+    module.telemetry_init(version, scs_telemetry_init_params_isolated_t(common))
+    module_ = module
+
+def run():
+    '''
+    Called by the native loader after init(). Delivers the values of each
+    frame until the loader stops, then calls telemetry_shutdown().
+    '''
+    while True:
+        records = _telemetry_isolated.wait()
+        if records is None:
+            break
+        for is_event, key, value in records:
+            if is_event:
+                event, listeners = events_[key]
+                for callback, context in listeners:
+                    _call(callback, event, None, context)
+            else:
+                channel, index, listeners = channels_[key]
+                for callback, context in listeners:
+                    _call(callback, channel, index, value, context)
+    shutdown = getattr(module_, 'telemetry_shutdown', None)
+    if shutdown is not None:
+        _call(shutdown)
@@ -17,77 +17,399 @@
 # along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
 #
 
+import concurrent.futures
 import importlib
 import logging
+import os
 import pkgutil
+import struct
+import time
 from pyets2lib.scsdefs import *
+import pyets2lib.arrays
+import pyets2lib.configuration
+import pyets2lib.derived
+import pyets2lib.logqueue
 import pyets2lib.scshelpers
+import pyets2lib.stats
+import pyets2lib.subscription
+from pyets2lib.store import TelemetryStore
 
 import _telemetry
 
-class TelemetryLogHandler(logging.Handler):
-    def emit(self, record):
-        _telemetry.log(self.format(record))
+class TelemetryLogHandler(pyets2lib.logqueue.QueuedLogHandler):
+    '''
+    Writes to the game console. Between telemetry_init() and
+    telemetry_shutdown(), from the flusher thread of pyets2lib.logqueue.
+    '''
+    def __init__(self):
+        super().__init__(_telemetry.log)
+
+log_handler_ = TelemetryLogHandler()
+logging.basicConfig(level=logging.INFO, handlers=(log_handler_,))
+
+# Overflow policies of the worker thread ring buffer
+WORKER_OVERFLOW_POLICIES = {
+    'drop_oldest': 0,
+    'coalesce': 1,
+    'block': 2,
+}
 
-logging.basicConfig(level=logging.INFO, handlers=(TelemetryLogHandler(),))
+# Listener priorities, see configure_budget()
+PRIORITY_CRITICAL = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Path of the recording to make, see start_recording()
+RECORD_ENV = 'PYETS2_TELEMETRY_RECORD'
+# Interval in seconds of the listener statistics summary, see
+# pyets2lib.stats
+STATS_ENV = 'PYETS2_TELEMETRY_STATS'
+# Path of the columnar export to write, see start_export()
+EXPORT_ENV = 'PYETS2_TELEMETRY_EXPORT'
+# Shared memory name to publish to, see start_publisher()
+SHM_ENV = 'PYETS2_TELEMETRY_SHM'
+# Python time budget per frame in milliseconds, see configure_budget()
+BUDGET_ENV = 'PYETS2_TELEMETRY_BUDGET'
+# Comma-separated plug-in package names to run in their own
+# subinterpreter, or * for all, see start_isolated()
+ISOLATE_ENV = 'PYETS2_TELEMETRY_ISOLATE'
+# Maximum number of plug-ins imported in parallel
+PLUGIN_IMPORT_THREADS = 8
 
 logger_ = logging.getLogger(__name__)
 modules_ = []
-
-class CallbackInfo(object):
-    def __init__(self):
-        self.listeners = []
+# Names of the plug-ins running in their own subinterpreter
+isolated_ = []
+store_ = None
 
 class scs_telemetry_init_params_v100_t(object):
-    def __init__(self, common):
+    def __init__(self, common, store):
         self.common = common
+        # Latest values of the channels registered with register_for_store()
+        self.store = store
+        # Frame of the value or event being delivered: frame_clock.sequence
+        # and frame_clock.simulation_time, in microseconds
+        self.frame_clock = _telemetry.frame_clock
+        self._frame_sink = None
     
-    def register_for_event(self, event, callback, context=None):
+    def register_for_event(self, event, callback, context=None,
+                           threaded=False, priority=PRIORITY_NORMAL):
         '''
         Register for listening on an event.
 
         The callback should be declared as:
         def event_cb(event, event_info, context)
+
+        If threaded is True, the callback is called on the worker thread,
+        see configure_worker().
+
+        The event_info of frame_start is a struct sequence with the flags,
+        render_time, simulation_time and paused_simulation_time. It is
+        reused for the next frame if no listener keeps a reference, so
+        copy the fields that are needed later. params.frame_clock has the
+        frame number and simulation time without it.
+
+        Over the frame time budget, frame_start and frame_end listeners
+        that are not PRIORITY_CRITICAL are skipped, see configure_budget().
+        Other events are always delivered.
         '''
-        loader_context = event
-        ret = _telemetry.register_for_event(event.id, event_cb, loader_context)
+        ret = _telemetry.register_for_event(event.id, event, callback, context,
+                                            threaded, priority)
         if ret != SCS_RESULT_ok:
             raise Exception("Failed to register to event \"%s\": %d" %
-                            (event.name, ret))
+                            (event.id, ret))
+
+    def unregister_from_event(self, event, callback, context=None):
+        '''
+        Stop listening on an event registered with register_for_event()
+        with the same callback and context. The game stops reporting the
+        event when it has no listeners left. Cannot be called within a
+        channel callback, as the game does not allow it.
+        '''
+        ret = _telemetry.unregister_from_event(event.id, callback, context)
+        if ret != SCS_RESULT_ok:
+            raise Exception("Failed to unregister from event \"%s\": %d" %
+                            (event.id, ret))
+
+    def register_for_frame(self, callback, context=None,
+                           priority=PRIORITY_NORMAL):
+        '''
+        Register for receiving the values of batched channels once per frame.
 
-        if not hasattr(event, '_loader_info'):
-            event._loader_info = CallbackInfo()
-        event._loader_info.listeners.append((callback, context))
+        The callback should be declared as:
+        def frame_cb(values, context)
 
-    # def unregister_from_event(event, callback)
+        values is a list of (channel, index, value) tuples, holding the
+        values reported during the frame for the channels registered with
+        batched=True, in the order they were reported by the game.
 
-    def register_for_channel(self, channel, callback, index=None, context=None):
+        Over the frame time budget, the values are kept until a later
+        frame, only the latest value per channel, unless priority is
+        PRIORITY_CRITICAL. See configure_budget().
+        '''
+        if self._frame_sink is not None:
+            raise Exception("Already registered for frame")
+        loader_context = (callback, context)
+        self._frame_sink = _telemetry.register_for_frame(frame_cb,
+                                                         loader_context,
+                                                         priority)
+
+    def register_for_channel(self, channel, callback, index=None, context=None,
+                             batched=False, threaded=False, array=False,
+                             filter=None, priority=PRIORITY_NORMAL):
         '''
         Register for listening on a channel.
 
         The callback should be declared as:
         def channel_cb(channel, index, value, context)
+
+        If batched is True, the values are instead buffered by the native
+        loader and delivered to the register_for_frame() callback at frame
+        end. callback is not used in that case and may be None.
+
+        If threaded is True, the callback is called on the worker thread,
+        see configure_worker().
+
+        If array is True, all indexes of channel, an indexed ScsChannel or
+        an ScsIndexedChannel for all trailers, are copied by the native
+        loader into one NumPy array, see pyets2lib.arrays. The callback is
+        called at frame end, when any value changed, as:
+        def array_cb(channel, array, context)
+        The same read-only array is passed every time, updated in place.
+        Requires NumPy. index must be None.
+
+        filter is an optional pyets2lib.filters.ChannelFilter, e.g. to only
+        deliver changed values. It is checked by the native loader, so
+        suppressed values do not cost a Python call. Cannot be combined
+        with threaded or array.
+
+        Over the frame time budget, the callback is deferred to a later
+        frame and called with the latest value only, unless priority is
+        PRIORITY_CRITICAL. See configure_budget(). Batched listeners follow
+        the priority of register_for_frame().
+
+        channel can also be a pyets2lib.derived.ScsDerivedChannel. The
+        callback is then called at frame end, when the value changed.
         '''
+        if isinstance(channel, pyets2lib.derived.ScsDerivedChannel):
+            if (index is not None or batched or threaded or array or
+                    filter is not None or priority != PRIORITY_NORMAL):
+                raise ValueError("Derived channel \"%s\" cannot have an index, "
+                                 "a filter or a priority, or be batched, "
+                                 "threaded or an array" % channel.name)
+            pyets2lib.derived.register(channel, callback, context)
+            return
+        if array:
+            if index is not None or batched or threaded or filter is not None:
+                raise ValueError("Array channel \"%s\" cannot have an index "
+                                 "or a filter, or be batched or threaded" %
+                                 channel.name)
+            self._register_for_array(channel, callback, context, priority)
+            return
+        if filter is not None and threaded:
+            raise ValueError("Threaded channel \"%s\" cannot have a filter" %
+                             channel.name)
         if index is None:
             scs_index = SCS_U32_NIL
         else:
             scs_index = index
-        loader_context = channel
+        if batched:
+            if self._frame_sink is None:
+                raise Exception("Batched channel \"%s\" requires "
+                                "register_for_frame() to be called first" %
+                                channel.name)
+            frame_sink = self._frame_sink
+        else:
+            frame_sink = -1
         ret = _telemetry.register_for_channel(channel.name,
                                               scs_index,
                                               channel.type,
                                               SCS_TELEMETRY_CHANNEL_FLAG_none,
-                                              channel_cb,
-                                              loader_context)
+                                              channel,
+                                              None if batched else callback,
+                                              context,
+                                              frame_sink,
+                                              threaded,
+                                              None if filter is None else filter._native(),
+                                              priority)
         if ret != SCS_RESULT_ok:
             raise Exception("Failed to register to channel \"%s\": %d" %
                             (channel.name, ret))
 
-        if not hasattr(channel, '_loader_info'):
-            channel._loader_info = CallbackInfo()
-        channel._loader_info.listeners.append((callback, context))
+    def _register_for_array(self, channel, callback, context, priority):
+        values, elements = pyets2lib.arrays.create(channel)
+        sink = _telemetry.register_for_array_sink(callback, channel, values,
+                                                  context, priority)
+        # Only the native loader writes to the array
+        values.flags.writeable = False
+        for element_channel, index, offset in elements:
+            ret = _telemetry.register_for_array(element_channel.name,
+                                                SCS_U32_NIL if index is None else index,
+                                                element_channel.type,
+                                                SCS_TELEMETRY_CHANNEL_FLAG_none,
+                                                element_channel,
+                                                sink,
+                                                offset)
+            if ret not in (SCS_RESULT_ok, SCS_RESULT_not_found):
+                raise Exception("Failed to register to channel \"%s\" for array: %d" %
+                                (element_channel.name, ret))
+
+    def register_for_store(self, channel, index=None):
+        '''
+        Register for keeping the latest value of a channel in the store.
+
+        No Python code runs when the value is updated. Read the value
+        with store.get(channel, index). If index is None for an indexed
+        channel, all indexes are registered.
+        '''
+        if index is None and channel.indexed:
+            indexes = range(channel.index_count)
+        else:
+            indexes = (index,)
+        for store_index in indexes:
+            if store_index is None:
+                scs_index = SCS_U32_NIL
+            else:
+                scs_index = store_index
+            ret = _telemetry.register_for_store(channel.name,
+                                                scs_index,
+                                                channel.type,
+                                                SCS_TELEMETRY_CHANNEL_FLAG_none,
+                                                channel,
+                                                self.store.offset(channel,
+                                                                  store_index))
+            if ret != SCS_RESULT_ok:
+                raise Exception("Failed to register to channel \"%s\" for store: %d" %
+                                (channel.name, ret))
+
+    def unregister_from_channel(self, channel, callback, index=None,
+                                context=None, batched=False):
+        '''
+        Stop listening on a channel registered with register_for_channel()
+        with the same callback, index, context and batched. The game stops
+        reporting the channel when it has no listeners left, unless it is
+        in the store or recorded. Array channels cannot be unregistered.
+
+        Cannot be called within a channel callback, as the game does not
+        allow it. Unregister from an event callback instead, e.g. at
+        frame_end.
+        '''
+        if isinstance(channel, pyets2lib.derived.ScsDerivedChannel):
+            pyets2lib.derived.unregister(channel, callback, context)
+            return
+        if batched:
+            frame_sink = self._frame_sink
+            callback = None
+        else:
+            frame_sink = -1
+        ret = _telemetry.unregister_from_channel(channel.name,
+                                                 SCS_U32_NIL if index is None else index,
+                                                 callback,
+                                                 context,
+                                                 frame_sink)
+        if ret != SCS_RESULT_ok:
+            raise Exception("Failed to unregister from channel \"%s\": %d" %
+                            (channel.name, ret))
+
+    def subscription(self):
+        '''
+        Returns a new pyets2lib.subscription.Subscription, a group of
+        registrations that is attached and detached as a unit.
+        '''
+        return pyets2lib.subscription.Subscription(self)
+
+    def register_for_configuration(self, callback, config_id=None,
+                                   attributes=None, context=None,
+                                   changed_only=True):
+        '''
+        Register for listening on decoded configuration events.
+
+        The callback should be declared as:
+        def configuration_cb(config, changed, context)
+
+        config is a pyets2lib.configuration.ScsConfiguration, with the
+        attribute values keyed by ScsAttribute, and changed the set of
+        attributes that changed since the previous configuration with the
+        same id. Only configurations with config_id, e.g.
+        SCS_TELEMETRY_CONFIG_truck, are delivered, or all if None.
+
+        If changed_only is True, the callback is only called when any of
+        attributes, or any attribute if None, changed.
+        '''
+        pyets2lib.configuration.register(SCS_TELEMETRY_EVENT_configuration,
+                                         callback, config_id, attributes,
+                                         context, changed_only)
+
+    def register_for_gameplay(self, callback, gameplay_id=None,
+                              attributes=None, context=None,
+                              changed_only=False):
+        '''
+        Register for listening on decoded gameplay events, like
+        register_for_configuration(). gameplay_id is e.g.
+        SCS_TELEMETRY_GAMEPLAY_EVENT_job_delivered.
+        '''
+        pyets2lib.configuration.register(SCS_TELEMETRY_EVENT_gameplay,
+                                         callback, gameplay_id, attributes,
+                                         context, changed_only)
+
+    def unregister_from_configuration(self, callback, context=None):
+        '''
+        Stop listening on configuration events registered with
+        register_for_configuration() with the same callback and context.
+        '''
+        pyets2lib.configuration.unregister(SCS_TELEMETRY_EVENT_configuration,
+                                           callback, context)
+
+    def unregister_from_gameplay(self, callback, context=None):
+        '''
+        Stop listening on gameplay events registered with
+        register_for_gameplay() with the same callback and context.
+        '''
+        pyets2lib.configuration.unregister(SCS_TELEMETRY_EVENT_gameplay,
+                                           callback, context)
+
+    def configure_worker(self, capacity=4096, overflow='drop_oldest'):
+        '''
+        Configure the worker thread, which calls the threaded listeners.
+
+        The game thread only queues the values and events of threaded
+        listeners in a ring buffer of capacity records (rounded up to a
+        power of two), so slow listeners do not stall the game. The worker
+        is woken at frame end, or when the buffer is half full.
+
+        overflow decides what happens when the buffer is full:
+        'drop_oldest' - discard the oldest record
+        'coalesce' - keep only the latest value per channel until there is
+                     room, events are dropped like 'drop_oldest'
+        'block' - make the game wait for the worker
+
+        The worker holds the GIL for at most 64 records at a time, so
+        listeners on the game thread wait for at most that many threaded
+        listener calls. With 'block', the game thread may wait as long,
+        once per full buffer, until the worker has made room.
+
+        The worker is shared by all plug-ins and starts at the first
+        threaded registration, after which it cannot be reconfigured.
+        '''
+        if overflow not in WORKER_OVERFLOW_POLICIES:
+            raise ValueError("Unknown overflow policy \"%s\"" % overflow)
+        _telemetry.configure_worker(capacity, WORKER_OVERFLOW_POLICIES[overflow])
+
+    def configure_budget(self, budget_ms):
+        '''
+        Limit the time spent in Python on the game thread per frame.
 
-    # def unregister_from_channel(channel, index=None, callback)
+        Once listeners have used budget_ms in a frame, only PRIORITY_CRITICAL
+        listeners are called. The others are deferred, without entering
+        Python, and called at the end of a later frame with the latest
+        value, PRIORITY_NORMAL before PRIORITY_LOW, as long as the budget
+        allows. Values replaced while deferred are shed. Threaded listeners
+        run on the worker thread and do not count.
+
+        The budget is shared by all plug-ins. None or 0 disables it.
+        See budget_stats().
+        '''
+        _telemetry.configure_budget(int((budget_ms or 0) * 1000000))
 
 class scs_sdk_init_params_v100_t(object):
     def __init__(self, game_name, game_id, game_version, logger):
@@ -96,37 +418,254 @@ class scs_sdk_init_params_v100_t(object):
         self.game_version = game_version
         self.logger = logger
     
-def channel_cb(name, index, value, loader_context):
-    channel = loader_context
-    for callback, context in channel._loader_info.listeners:
-        try_call_method(None, callback, channel, index, value, context)
+def worker_stats():
+    '''
+    Returns a dict with the counters of the worker thread: capacity,
+    pending, queued, delivered, dropped, coalesced and blocked.
+    '''
+    return _telemetry.worker_stats()
+
+def budget_stats():
+    '''
+    Returns a dict with the counters of the frame time budget: budget_ns,
+    frames, frames_over (frames that used more than the budget),
+    max_used_ns, deferred, shed and pending (deferred calls waiting).
+    '''
+    return _telemetry.budget_stats()
 
-def event_cb(event_id, event_info, loader_context):
-    event = loader_context
-    for callback, context in event._loader_info.listeners:
-        try_call_method(None, callback, event, event_info, context)
+def isolated_stats():
+    '''
+    Returns a dict with the counters of the isolated plug-ins: plugins,
+    queued (values and events copied to them) and dropped (discarded as
+    a plug-in did not keep up).
+    '''
+    return _telemetry.isolated_stats()
+
+def start_isolated(name):
+    '''
+    Runs the plug-in package name in its own subinterpreter, with its own
+    GIL, so that its callbacks run on their own thread, in parallel with
+    the game and the other plug-ins. See pyets2lib.isolated for what is
+    available to such plug-ins. Requires Python 3.12 or later.
+
+    Returns False, after logging why, if the plug-in cannot be isolated,
+    e.g. as it imports extension modules without support for
+    subinterpreters. It should then be loaded as usual.
+    '''
+    start = time.perf_counter_ns()
+    try:
+        _telemetry.start_isolated(name)
+    except RuntimeError as e:
+        logger_.warning("Cannot isolate Python plug-in \"%s\": %s" % (name, e))
+        return False
+    logger_.info("Loaded Python plug-in \"%s\" in its own subinterpreter (%.1f ms)" %
+                 (name, (time.perf_counter_ns() - start) / 1e6))
+    isolated_.append(name)
+    return True
+
+def start_recording(path):
+    '''
+    Records all channels and events to path, in the format read by
+    pyets2lib.recording and the replay tool. Values are written by the
+    native loader, without running any Python code.
+    '''
+    _telemetry.start_recording(path)
+    failed = 0
+    for channel in SCS_CHANNELS:
+        if channel.indexed:
+            indexes = range(channel.index_count)
+        else:
+            indexes = (SCS_U32_NIL,)
+        for index in indexes:
+            ret = _telemetry.register_for_recording(channel.name,
+                                                    index,
+                                                    channel.type,
+                                                    SCS_TELEMETRY_CHANNEL_FLAG_none,
+                                                    channel)
+            if ret not in (SCS_RESULT_ok, SCS_RESULT_not_found):
+                failed += 1
+    if failed:
+        logger_.warning("Could not register %d channels for recording" % failed)
+
+def start_export(path, channels=None, chunk_frames=1024, max_pending=4):
+    '''
+    Exports the values of channels to path, one row per frame, in the
+    columnar format read by pyets2lib.export. The native loader copies
+    the values at frame end and a writer thread compresses and writes
+    chunks of chunk_frames rows, without running any Python code. At most
+    max_pending full chunks wait for the writer, beyond which rows are
+    dropped, see export_stats().
+
+    channels are ScsChannels, with all indexes for indexed channels,
+    (ScsChannel, index) tuples or ScsIndexedChannels for all trailers.
+    By default, all channels except the string channels are exported.
+    A channel given more than once is exported once. Must be called on
+    the game thread.
+    '''
+    if channels is None:
+        channels = [channel for channel in SCS_CHANNELS
+                    if channel.type != SCS_VALUE_TYPE_string]
+    columns = []
+    for channel in channels:
+        if isinstance(channel, tuple):
+            channel, index = channel
+            keys = [(channel, index)]
+        elif isinstance(channel, ScsIndexedChannel):
+            keys = [(trailer_channel, None) for trailer_channel in channel.channels]
+        else:
+            keys = [(channel, None)]
+        for channel, index in keys:
+            if index is not None or not channel.indexed:
+                indexes = (SCS_U32_NIL if index is None else index,)
+            else:
+                indexes = range(channel.index_count)
+            columns.extend((channel.name, index, channel.type, channel.internal_id,
+                            channel) for index in indexes)
+    failed = _telemetry.start_export(path, columns, chunk_frames, max_pending)
+    if failed:
+        logger_.warning("Could not register %d channels for export" % failed)
+
+def stop_export():
+    '''
+    Writes the remaining rows of the export started with start_export()
+    and closes it. Cannot be called within a channel callback.
+    '''
+    _telemetry.stop_export()
+
+def export_stats():
+    '''
+    Returns a dict with the counters of the export: rows, chunks and
+    bytes written, dropped_rows (as the writer did not keep up) and
+    pending chunks.
+    '''
+    return _telemetry.export_stats()
+
+def start_publisher(name='/pyets2_telemetry'):
+    '''
+    Publishes the latest values of all channels and the latest
+    configurations to the POSIX shared memory segment name, once per
+    frame. Read it from other processes with pyets2lib.shm_reader. Values
+    are copied by the native loader, without running any Python code.
+    '''
+    channels = []
+    directory = bytearray()
+    for channel in SCS_CHANNELS:
+        if SCS_VALUE_FORMATS.get(channel.type) is None:
+            continue
+        channels.append(channel)
+        name_bytes = channel.name.encode('utf-8')
+        directory += struct.pack('=IIIH', store_.offset(channel),
+                                 channel.index_count, channel.type,
+                                 len(name_bytes))
+        directory += name_bytes + b'\0'
+    _telemetry.start_publisher(name, len(channels), bytes(directory))
+    failed = 0
+    for channel in channels:
+        if channel.indexed:
+            indexes = range(channel.index_count)
+        else:
+            indexes = (None,)
+        for index in indexes:
+            ret = _telemetry.register_for_store(channel.name,
+                                                SCS_U32_NIL if index is None else index,
+                                                channel.type,
+                                                SCS_TELEMETRY_CHANNEL_FLAG_none,
+                                                channel,
+                                                store_.offset(channel, index))
+            if ret not in (SCS_RESULT_ok, SCS_RESULT_not_found):
+                failed += 1
+    if failed:
+        logger_.warning("Could not register %d channels for publishing" % failed)
+
+def listener_error(callback, e):
+    '''
+    Called by the native loader when a listener raises an exception.
+    '''
+    logger = logging.getLogger(getattr(callback, '__module__', None))
+    pyets2lib.scshelpers.log_exception(logger, e, callback)
+
+def frame_cb(values, loader_context):
+    callback, context = loader_context
+    try_call_method(None, callback, values, context)
 
 def telemetry_init(version, game_name, game_id, game_version):
-    for info in pkgutil.iter_modules(['plugins/python']):
-        if info.ispkg:
-            if info.name == __package__:
-                # Skip ourselves
-                continue
-            logger_.info("Loading Python plug-in \"%s\"" % info.name)
-            module = try_call_method(logging.getLogger(info.name),
-                                     importlib.import_module, info.name)[1]
-            if not module:
-                continue
-            modules_.append(module)
-            
-            common = scs_sdk_init_params_v100_t(game_name, game_id, game_version,
-                                                logging.getLogger(info.name))
-            init_params = scs_telemetry_init_params_v100_t(common)
-            try_call_method(None, module.telemetry_init, version, init_params)
+    global store_
+    log_handler_.start()
+    store_ = TelemetryStore(_telemetry.create_store)
+    record_path = os.environ.get(RECORD_ENV)
+    if record_path:
+        try_call_method(logger_, start_recording, record_path)
+    export_path = os.environ.get(EXPORT_ENV)
+    if export_path:
+        try_call_method(logger_, start_export, export_path)
+    shm_name = os.environ.get(SHM_ENV)
+    if shm_name:
+        try_call_method(logger_, start_publisher, shm_name)
+    stats_interval = os.environ.get(STATS_ENV)
+    if stats_interval:
+        try_call_method(logger_, pyets2lib.stats.enable,
+                        summary_interval=float(stats_interval))
+    budget_ms = os.environ.get(BUDGET_ENV)
+    if budget_ms:
+        try_call_method(logger_, _telemetry.configure_budget,
+                        int(float(budget_ms) * 1000000))
+    infos = [info for info in pkgutil.iter_modules(['plugins/python'])
+             if info.ispkg and info.name != __package__]
+    for info in infos:
+        logger_.info("Loading Python plug-in \"%s\"" % info.name)
+    start = time.perf_counter_ns()
+    isolate = set(name.strip() for name in os.environ.get(ISOLATE_ENV, '').split(','))
+    infos = [info for info in infos
+             if not ((info.name in isolate or '*' in isolate) and
+                     start_isolated(info.name))]
+    imports = import_plugins([info.name for info in infos])
+    for info, (module, import_ns, error) in zip(infos, imports):
+        if error is not None:
+            pyets2lib.scshelpers.log_exception(logging.getLogger(info.name), error)
+            continue
+        modules_.append(module)
+        init_start = time.perf_counter_ns()
+        common = scs_sdk_init_params_v100_t(game_name, game_id, game_version,
+                                            logging.getLogger(info.name))
+        init_params = scs_telemetry_init_params_v100_t(common, store_)
+        try_call_method(None, module.telemetry_init, version, init_params)
+        init_ns = time.perf_counter_ns() - init_start
+        logger_.info("Loaded Python plug-in \"%s\" (import %.1f ms, init %.1f ms)" %
+                     (info.name, import_ns / 1e6, init_ns / 1e6))
+        pyets2lib.stats.record_init(info.name, import_ns, init_ns)
+    logger_.info("Loaded %d Python plug-ins in %.1f ms" %
+                 (len(modules_) + len(isolated_),
+                  (time.perf_counter_ns() - start) / 1e6))
+
+def import_plugin(name):
+    '''
+    Imports the plug-in package name. Returns (module, import_ns, error),
+    with the exception in error if the import failed. Does not log, so
+    that it can run on other threads than the game thread.
+    '''
+    start = time.perf_counter_ns()
+    try:
+        module = importlib.import_module(name)
+    except Exception as e:
+        return (None, time.perf_counter_ns() - start, e)
+    return (module, time.perf_counter_ns() - start, None)
+
+def import_plugins(names):
+    '''
+    Imports the plug-ins in a thread pool, so that they can wait for disk
+    and load native modules in parallel. Returns import_plugin() results
+    in the order of names. The timings include waiting for the GIL.
+    '''
+    workers = min(len(names), PLUGIN_IMPORT_THREADS)
+    if workers <= 1:
+        return [import_plugin(name) for name in names]
+    with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+        return list(executor.map(import_plugin, names))
 
 def telemetry_shutdown():
     for module in modules_:
         try_call_method(None, module.telemetry_shutdown)
+    log_handler_.stop()
 
 def try_call_method(logger, method, *args, **kwargs):
     ret = None
@@ -135,6 +674,6 @@ def try_call_method(logger, method, *args, **kwargs):
     except Exception as e:
         if not logger:
             logger = logging.getLogger(method.__module__)
-        pyets2lib.scshelpers.log_exception(logger, e)
+        pyets2lib.scshelpers.log_exception(logger, e, method)
         return (False, ret)
     return (True, ret)
@@ -0,0 +1,158 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import collections
+import logging
+import threading
+import time
+import pyets2lib.scshelpers
+
+# Logging off the game thread. QueuedLogHandler only queues the records,
+# which a flusher thread formats and writes to the game console in
+# batches. Each plug-in, by top-level logger name, may log RATE messages
+# per second, with bursts of up to BURST messages. Messages over the rate,
+# or that do not fit in the queue, are dropped and counted, and the counts
+# logged every SUMMARY_INTERVAL seconds. Records with a false rate_limited
+# attribute, set with extra, are never dropped for the rate.
+
+# Seconds between flushes
+FLUSH_INTERVAL = 0.1
+SUMMARY_INTERVAL = 10.0
+RATE = 20.0
+BURST = 100
+# Messages that can wait for the flusher. New messages are dropped beyond.
+MAX_QUEUED = 4096
+
+class QueuedLogHandler(logging.Handler):
+    '''
+    Queues records for the flusher thread, which writes the formatted
+    messages with write(lines). Writes directly while the flusher is not
+    running, e.g. while loading and unloading.
+    '''
+    def __init__(self, write):
+        super().__init__()
+        self.write = write
+        self._queue = collections.deque()
+        # [tokens, last update] by plug-in
+        self._buckets = {}
+        # Dropped message counts by plug-in, over the rate and as the
+        # queue was full. Protected by self.lock, like the buckets.
+        self._dropped = collections.Counter()
+        self._overflowed = collections.Counter()
+        self._next_summary = 0.0
+        self._thread = None
+        self._stop = threading.Event()
+
+    def emit(self, record):
+        if self._thread is None:
+            self.write([self.format(record)])
+            return
+        plugin = record.name.split('.')[0]
+        now = time.monotonic()
+        bucket = self._buckets.get(plugin)
+        if bucket is None:
+            bucket = self._buckets[plugin] = [BURST, now]
+        bucket[0] = min(BURST, bucket[0] + (now - bucket[1]) * RATE)
+        bucket[1] = now
+        rate_limited = getattr(record, 'rate_limited', True)
+        if bucket[0] < 1 and rate_limited:
+            self._dropped[plugin] += 1
+            return
+        if len(self._queue) >= MAX_QUEUED:
+            self._overflowed[plugin] += 1
+            return
+        if rate_limited:
+            bucket[0] -= 1
+        try:
+            # Render the message now, as the arguments may change before
+            # the flusher formats the record
+            record.msg = record.getMessage()
+            record.args = None
+        except Exception:
+            self.handleError(record)
+            return
+        self._queue.append(record)
+
+    def start(self):
+        '''
+        Starts the flusher thread.
+        '''
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=__name__)
+        self._thread.start()
+
+    def stop(self):
+        '''
+        Stops the flusher thread, after writing the queued messages. Must
+        be called before unloading, as the thread is not a daemon.
+        '''
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        pyets2lib.scshelpers.log_suppressed(all=True)
+        self.flush()
+        self._thread = None
+
+    def flush(self):
+        '''
+        Writes the queued messages and the drop counts.
+        '''
+        self._write(True)
+
+    def _write(self, summarize):
+        pyets2lib.scshelpers.log_suppressed()
+        lines = []
+        while self._queue:
+            record = self._queue.popleft()
+            try:
+                lines.append(self.format(record))
+            except Exception:
+                self.handleError(record)
+        if ((self._dropped or self._overflowed) and
+                (summarize or time.monotonic() >= self._next_summary)):
+            self._next_summary = time.monotonic() + SUMMARY_INTERVAL
+            # emit() counts under the lock
+            with self.lock:
+                dropped = self._dropped
+                overflowed = self._overflowed
+                self._dropped = collections.Counter()
+                self._overflowed = collections.Counter()
+            for counts, reason in ((dropped, "over the rate limit"),
+                                   (overflowed, "as the log queue was full")):
+                for plugin, count in sorted(counts.items()):
+                    lines.append(self._summary_line(
+                        plugin, "Dropped %d log messages %s" % (count, reason)))
+        if lines:
+            self.write(lines)
+
+    def _summary_line(self, plugin, msg):
+        record = logging.makeLogRecord({
+            'name': plugin,
+            'levelno': logging.WARNING,
+            'levelname': logging.getLevelName(logging.WARNING),
+            'msg': msg,
+        })
+        return self.format(record)
+
+    def _run(self):
+        while not self._stop.wait(FLUSH_INTERVAL):
+            self._write(False)
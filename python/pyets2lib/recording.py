@@ -0,0 +1,178 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import collections
+import mmap
+import struct
+from pyets2lib.scsdefs import *
+
+# Reader of the recordings made by the native loader. The format is
+# described in recording.hpp. Does not need the game, so it can be used
+# for offline analysis.
+
+RECORDING_MAGIC = b'PYETS2RC'
+RECORDING_VERSION = 1
+
+RECORD_channel = 1
+RECORD_value = 2
+RECORD_no_value = 3
+RECORD_event = 4
+
+RecordedValue = collections.namedtuple('RecordedValue',
+                                       ('name', 'index', 'value'))
+RecordedEvent = collections.namedtuple('RecordedEvent',
+                                       ('event', 'time_ns', 'info'))
+# Fields of _telemetry.scs_telemetry_frame_start_t
+FrameStart = collections.namedtuple('FrameStart', (
+    'flags', 'render_time', 'simulation_time', 'paused_simulation_time'))
+
+_u8 = struct.Struct('=B')
+_u16 = struct.Struct('=H')
+_u32 = struct.Struct('=I')
+_u64 = struct.Struct('=Q')
+_header = struct.Struct('=8sII')
+_channel = struct.Struct('=III')
+_event = struct.Struct('=IQ')
+_frame_start = struct.Struct('=IQQQ')
+_attribute = struct.Struct('=II')
+_value_structs = {value_type: struct.Struct('=' + value_format)
+                  for value_type, value_format in SCS_VALUE_FORMATS.items()}
+
+class RecordingError(Exception):
+    pass
+
+class Recording(object):
+    '''
+    A memory-mapped recording. Iterate over records() to get the values
+    and events in the order they were reported by the game.
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self.game_version = _header.unpack_from(self._map)
+            if magic != RECORDING_MAGIC or version != RECORDING_VERSION:
+                raise RecordingError("Not a version %d recording: %s" %
+                                     (RECORDING_VERSION, path))
+            offset = _header.size
+            self.game_id, offset = self._string(offset)
+            self.game_name, offset = self._string(offset)
+        except (struct.error, RecordingError):
+            self._map.close()
+            raise
+        self._data_offset = offset
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _string(self, offset):
+        length, = _u16.unpack_from(self._map, offset)
+        offset += _u16.size
+        value = self._map[offset:offset + length].decode('utf-8', 'replace')
+        # Skip the NUL
+        return value, offset + length + 1
+
+    def _value(self, value_type, offset):
+        if value_type == SCS_VALUE_TYPE_string:
+            return self._string(offset)
+        value_struct = _value_structs.get(value_type)
+        if value_struct is None:
+            raise RecordingError("Unknown value type %d" % value_type)
+        value = value_struct.unpack_from(self._map, offset)
+        offset += value_struct.size
+        if len(value) == 1:
+            value = value[0]
+        elif value_type in (SCS_VALUE_TYPE_fplacement,
+                            SCS_VALUE_TYPE_dplacement):
+            value = (value[:3], value[3:])
+        return value, offset
+
+    def records(self):
+        '''
+        Yields a RecordedValue(name, index, value) for each channel value,
+        and a RecordedEvent(event, time_ns, info) for each event. index is
+        None for non-indexed channels and value is None for channels
+        without value. Vectors are (x, y, z) tuples and placements are
+        (position, orientation) tuples.
+
+        info is a FrameStart with the flags and times for frame_start, like
+        the event_info of listeners, a dict with
+        'id' and 'attributes', a list of (name, index, value), for
+        configuration and gameplay, and None for other events.
+
+        A recording that was not closed properly can end in the middle of a
+        record. The incomplete record is ignored.
+        '''
+        channels = {}
+        offset = self._data_offset
+        end = len(self._map)
+        try:
+            while offset < end:
+                kind, = _u8.unpack_from(self._map, offset)
+                offset += _u8.size
+                if kind == RECORD_channel:
+                    channel_id, index, value_type = _channel.unpack_from(self._map, offset)
+                    name, offset = self._string(offset + _channel.size)
+                    if index == SCS_U32_NIL & 0xffffffff:
+                        index = None
+                    channels[channel_id] = (name, index, value_type)
+                elif kind in (RECORD_value, RECORD_no_value):
+                    channel_id, = _u32.unpack_from(self._map, offset)
+                    offset += _u32.size
+                    name, index, value_type = channels[channel_id]
+                    value = None
+                    if kind == RECORD_value:
+                        value, offset = self._value(value_type, offset)
+                    yield RecordedValue(name, index, value)
+                elif kind == RECORD_event:
+                    event, time_ns = _event.unpack_from(self._map, offset)
+                    offset += _event.size
+                    info = None
+                    if event == SCS_TELEMETRY_EVENT_frame_start.id:
+                        info = FrameStart._make(
+                            _frame_start.unpack_from(self._map, offset))
+                        offset += _frame_start.size
+                    elif event in (SCS_TELEMETRY_EVENT_configuration.id,
+                                   SCS_TELEMETRY_EVENT_gameplay.id):
+                        info_id, offset = self._string(offset)
+                        count, = _u32.unpack_from(self._map, offset)
+                        offset += _u32.size
+                        attributes = []
+                        for _ in range(count):
+                            attr_name, offset = self._string(offset)
+                            index, value_type = _attribute.unpack_from(self._map, offset)
+                            value, offset = self._value(value_type,
+                                                        offset + _attribute.size)
+                            if index == SCS_U32_NIL & 0xffffffff:
+                                index = None
+                            attributes.append((attr_name, index, value))
+                        info = {'id': info_id, 'attributes': attributes}
+                    yield RecordedEvent(event, time_ns, info)
+                else:
+                    raise RecordingError("Unknown record kind %d at offset %d" %
+                                         (kind, offset - _u8.size))
+        except struct.error:
+            # Truncated
+            return
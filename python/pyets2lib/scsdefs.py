@@ -17,19 +17,75 @@
 # along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
 #
 
-SCS_CHANNELS = []
+import collections.abc
+
+class _ScsChannelTable(collections.abc.Sequence):
+    '''
+    All channels, indexed by ScsChannel.internal_id. The per-trailer
+    channels of an ScsIndexedChannel only reserve their ids here and are
+    created on first access.
+    '''
+    __slots__ = ('_entries',)
+
+    def __init__(self):
+        self._entries = []
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, internal_id):
+        if isinstance(internal_id, slice):
+            return [self[i] for i in range(len(self._entries))[internal_id]]
+        if internal_id < 0:
+            # The id is needed to find the channel of an indexed entry
+            internal_id += len(self._entries)
+            if internal_id < 0:
+                raise IndexError("channel id out of range")
+        entry = self._entries[internal_id]
+        if isinstance(entry, ScsIndexedChannel):
+            return entry.channels[internal_id - entry._first_id]
+        return entry
+
+    def __iter__(self):
+        for i in range(len(self._entries)):
+            yield self[i]
+
+    def append(self, channel):
+        self._entries.append(channel)
+
+    def _reserve(self, parent, count):
+        first_id = len(self._entries)
+        self._entries.extend([parent] * count)
+        return first_id
+
+    def _materialize(self, channel):
+        self._entries[channel.internal_id] = channel
+
+    def definitions(self):
+        '''
+        Yields (internal_id, type, index_count) of all channels, without
+        creating the channel objects.
+        '''
+        for internal_id, entry in enumerate(self._entries):
+            yield (internal_id, entry.type, entry.index_count)
+
+SCS_CHANNELS = _ScsChannelTable()
 
 class ScsObjectBase(object):
+    __slots__ = ('internal_id',)
+
     def __init__(self, internal_id):
         self.internal_id: int | str = internal_id
 
     def __eq__(self, other) -> bool:
         return self.internal_id == other.internal_id
 
-    def __hash__(self) -> int | str:
-        return self.internal_id
+    def __hash__(self) -> int:
+        return hash(self.internal_id)
 
 class ScsChannelBase(ScsObjectBase):
+    __slots__ = ('name', 'type', 'indexed', 'index_count')
+
     def __init__(self, internal_id, name, type, indexed=False, index_count=1):
         super().__init__(internal_id)
         self.name: str = name
@@ -38,21 +94,46 @@ class ScsChannelBase(ScsObjectBase):
         self.index_count: int = index_count
 
 class ScsChannel(ScsChannelBase):
-    def __init__(self, name, type, indexed=False, index_count=1, parent=None):
-        super().__init__(len(SCS_CHANNELS), name, type, indexed, index_count)
+    __slots__ = ('parent',)
+
+    def __init__(self, name, type, indexed=False, index_count=1, parent=None,
+                 internal_id=None):
+        if internal_id is None:
+            internal_id = len(SCS_CHANNELS)
+            SCS_CHANNELS.append(self)
+        super().__init__(internal_id, name, type, indexed, index_count)
         self.parent: ScsIndexedChannel | None = parent
-        SCS_CHANNELS.append(self)
 
 class ScsIndexedChannel(ScsChannelBase):
+    __slots__ = ('_root', '_first_id', '_count', '_channels')
+
     def __init__(self, root, name, type, count, indexed=False, index_count=1):
         super().__init__(name, name, type, indexed, index_count)
-        self.channels: list[ScsChannel] = []
-        for i in list(range(count)):
-            self.channels.append(ScsChannel(root + '.' + str(i) + '.' + name, type, indexed, index_count, self))
+        self._root = root
+        self._count = count
+        self._first_id = SCS_CHANNELS._reserve(self, count)
+        self._channels = None
+
+    @property
+    def channels(self) -> list[ScsChannel]:
+        '''
+        One ScsChannel per trailer, created on first access.
+        '''
+        if self._channels is None:
+            self._channels = []
+            for i in range(self._count):
+                channel = ScsChannel(self._root + '.' + str(i) + '.' + self.name,
+                                     self.type, self.indexed, self.index_count,
+                                     self, self._first_id + i)
+                SCS_CHANNELS._materialize(channel)
+                self._channels.append(channel)
+        return self._channels
 
 SCS_ATTRIBUTES = {}
 
 class ScsAttribute(ScsObjectBase):
+    __slots__ = ('name', 'indexed', 'index_count')
+
     def __init__(self, name, indexed=False, index_count=1):
         super().__init__(name)
         self.name: str = name
@@ -61,6 +142,8 @@ class ScsAttribute(ScsObjectBase):
         SCS_ATTRIBUTES[name] = self
 
 class ScsEvent(ScsObjectBase):
+    __slots__ = ('id',)
+
     def __init__(self, id):
         super().__init__(id)
         self.id: str = id
@@ -95,6 +178,23 @@ SCS_VALUE_TYPE_dplacement = 11
 SCS_VALUE_TYPE_string = 12
 SCS_VALUE_TYPE_s64 = 13
 
+# struct formats matching the memory layout of the scs_value_*_t types,
+# without padding
+SCS_VALUE_FORMATS = {
+    SCS_VALUE_TYPE_bool: '?',
+    SCS_VALUE_TYPE_s32: 'i',
+    SCS_VALUE_TYPE_u32: 'I',
+    SCS_VALUE_TYPE_u64: 'Q',
+    SCS_VALUE_TYPE_s64: 'q',
+    SCS_VALUE_TYPE_float: 'f',
+    SCS_VALUE_TYPE_double: 'd',
+    SCS_VALUE_TYPE_fvector: '3f',
+    SCS_VALUE_TYPE_dvector: '3d',
+    SCS_VALUE_TYPE_euler: '3f',
+    SCS_VALUE_TYPE_fplacement: '6f',
+    SCS_VALUE_TYPE_dplacement: '3d3f',
+}
+
 SCS_TELEMETRY_wheels_count = 14
 SCS_TELEMETRY_trailers_count = 10
 
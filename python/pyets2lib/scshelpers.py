@@ -17,10 +17,61 @@
 # along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
 #
 
+import threading
+import time
 import traceback
 
-# Log exception and keep it short
-def log_exception(logger, e):
-    exceptiondata = traceback.format_exc().splitlines()
+# Repeated exceptions are only logged once per interval, in seconds. The
+# rest are counted and summarized by log_suppressed().
+EXCEPTION_INTERVAL = 10.0
+
+# [end of interval, suppressed count, logger, description] by
+# (logger name, callback, exception type)
+exceptions_ = {}
+exceptions_lock_ = threading.Lock()
+
+def _callback_name(callback):
+    if callback is None:
+        return None
+    module = getattr(callback, '__module__', None)
+    name = getattr(callback, '__qualname__', None) or repr(callback)
+    return name if module is None else "%s.%s" % (module, name)
+
+# Log exception and keep it short. An exception of the same type from the
+# same callback is only logged once per EXCEPTION_INTERVAL, without even
+# formatting the traceback.
+def log_exception(logger, e, callback=None):
+    now = time.monotonic()
+    callback_name = _callback_name(callback)
+    key = (logger.name, callback_name, type(e))
+    with exceptions_lock_:
+        entry = exceptions_.get(key)
+        if entry is not None and now < entry[0]:
+            entry[1] += 1
+            return
+        exceptions_[key] = [now + EXCEPTION_INTERVAL, 0, logger,
+                            "%s in %s" % (type(e).__name__, callback_name or logger.name)]
+    if entry is not None and entry[1]:
+        _log_suppressed(entry)
+    exceptiondata = "".join(traceback.format_exception(
+        type(e), e, e.__traceback__)).splitlines()
     logger.error("%s: %s" % (type(e).__name__, e))
     logger.error("\n".join(exceptiondata[-3:-1]))
+
+def _log_suppressed(entry):
+    entry[2].error("%s suppressed %d times" % (entry[3], entry[1]),
+                   extra={'rate_limited': False})
+
+def log_suppressed(all=False):
+    '''
+    Logs how many times each exception was suppressed by log_exception(),
+    for intervals that have ended, or for all if all is True. Called
+    periodically by pyets2lib.logqueue.
+    '''
+    now = time.monotonic()
+    with exceptions_lock_:
+        ended = [key for key, entry in exceptions_.items() if all or now >= entry[0]]
+        entries = [exceptions_.pop(key) for key in ended]
+    for entry in entries:
+        if entry[1]:
+            _log_suppressed(entry)
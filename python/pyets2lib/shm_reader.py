@@ -0,0 +1,225 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import collections
+import mmap
+import struct
+import time
+from pyets2lib.scsdefs import *
+
+# Reader of the shared memory segment published by the native loader,
+# see pyets2lib.loader.start_publisher(). The layout is described in
+# shm.hpp. Does not need the game or the native loader, so it can be used
+# from any process on the same machine.
+#
+# The loader updates the segment under a seqlock. Readers copy the
+# segment and retry if it was being updated, so they never block the
+# game. This relies on the stores being seen in order, as on x86.
+
+SHM_MAGIC = b'PYETS2SM'
+SHM_VERSION = 1
+DEFAULT_NAME = '/pyets2_telemetry'
+
+ShmChannel = collections.namedtuple('ShmChannel',
+                                    ('name', 'type', 'index_count', 'offset'))
+
+_header = struct.Struct('=8sIIQQQQQIIIIII')
+_sequence = struct.Struct('=Q')
+_directory_entry = struct.Struct('=III')
+_u16 = struct.Struct('=H')
+_u32 = struct.Struct('=I')
+_configuration_header = struct.Struct('=II')
+_attribute = struct.Struct('=II')
+_value_structs = {value_type: struct.Struct('=' + value_format)
+                  for value_type, value_format in SCS_VALUE_FORMATS.items()}
+_slot_structs = {value_type: struct.Struct('=?' + value_format)
+                 for value_type, value_format in SCS_VALUE_FORMATS.items()}
+
+# Offset of the sequence in the header
+_SEQUENCE_OFFSET = 16
+
+class ShmError(Exception):
+    pass
+
+def _string(buf, offset):
+    length, = _u16.unpack_from(buf, offset)
+    offset += _u16.size
+    value = bytes(buf[offset:offset + length]).decode('utf-8', 'replace')
+    # Skip the NUL
+    return value, offset + length + 1
+
+def _decode(value_type, value):
+    if len(value) == 1:
+        return value[0]
+    if value_type in (SCS_VALUE_TYPE_fplacement, SCS_VALUE_TYPE_dplacement):
+        return (value[:3], value[3:])
+    return value
+
+class Snapshot(object):
+    '''
+    A consistent copy of the segment, taken at one frame end.
+
+    Vectors are (x, y, z) tuples and placements are (position,
+    orientation) tuples, like in pyets2lib.recording.
+    '''
+    def __init__(self, reader, frames, render_time, simulation_time,
+                 paused_simulation_time, values, configuration):
+        self._reader = reader
+        self.frames = frames
+        self.render_time = render_time
+        self.simulation_time = simulation_time
+        self.paused_simulation_time = paused_simulation_time
+        self._values = values
+        self._configuration = configuration
+
+    def get(self, channel, index=None):
+        '''
+        Returns the value of channel, an ScsChannel or a channel name, or
+        None if no value has been received.
+        '''
+        shm_channel = self._reader.channels[getattr(channel, 'name', channel)]
+        if index is None:
+            index = 0
+        elif not 0 <= index < shm_channel.index_count:
+            raise IndexError("Index %d out of range for channel \"%s\"" %
+                             (index, shm_channel.name))
+        slot_struct = _slot_structs[shm_channel.type]
+        valid, *value = slot_struct.unpack_from(
+            self._values, shm_channel.offset + index * slot_struct.size)
+        if not valid:
+            return None
+        return _decode(shm_channel.type, value)
+
+    def values(self):
+        '''
+        Returns a dict of channel name to value, with a list of values for
+        indexed channels. Channels without values are left out.
+        '''
+        result = {}
+        for name, shm_channel in self._reader.channels.items():
+            if shm_channel.index_count == 1:
+                value = self.get(name)
+            else:
+                value = [self.get(name, index)
+                         for index in range(shm_channel.index_count)]
+                if all(item is None for item in value):
+                    value = None
+            if value is not None:
+                result[name] = value
+        return result
+
+    def configurations(self):
+        '''
+        Returns a dict of configuration id to the attributes of the latest
+        configuration event, a list of (name, index, value) like the
+        event info of configuration events.
+        '''
+        buf = self._configuration
+        used, count = _configuration_header.unpack_from(buf)
+        offset = _configuration_header.size
+        result = {}
+        for _ in range(count):
+            config_id, offset = _string(buf, offset)
+            attribute_count, = _u32.unpack_from(buf, offset)
+            offset += _u32.size
+            attributes = []
+            for _ in range(attribute_count):
+                name, offset = _string(buf, offset)
+                index, value_type = _attribute.unpack_from(buf, offset)
+                offset += _attribute.size
+                if value_type == SCS_VALUE_TYPE_string:
+                    value, offset = _string(buf, offset)
+                else:
+                    value_struct = _value_structs.get(value_type)
+                    if value_struct is None:
+                        raise ShmError("Unknown value type %d" % value_type)
+                    value = _decode(value_type, value_struct.unpack_from(buf, offset))
+                    offset += value_struct.size
+                if index == SCS_U32_NIL & 0xffffffff:
+                    index = None
+                attributes.append((name, index, value))
+            result[config_id] = attributes
+        return result
+
+class ShmReader(object):
+    '''
+    Maps the shared memory segment name, published by the loader.
+    channels maps channel names to ShmChannel. Call snapshot() to get
+    the latest values.
+    '''
+    def __init__(self, name=DEFAULT_NAME):
+        path = '/dev/shm/' + name.lstrip('/')
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, version, header_size, _, _, _, _, _,
+             directory_offset, channel_count, self._values_offset,
+             self._values_size, self._configuration_offset,
+             self._configuration_capacity) = _header.unpack_from(self._map)
+            if magic != SHM_MAGIC or version != SHM_VERSION:
+                raise ShmError("Not a version %d telemetry segment: %s" %
+                               (SHM_VERSION, path))
+            self.channels = {}
+            offset = directory_offset
+            for _ in range(channel_count):
+                value_offset, index_count, value_type = \
+                    _directory_entry.unpack_from(self._map, offset)
+                name, offset = _string(self._map, offset + _directory_entry.size)
+                self.channels[name] = ShmChannel(name, value_type, index_count,
+                                                 value_offset)
+        except (struct.error, ShmError):
+            self._map.close()
+            raise
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def snapshot(self, timeout=1.0):
+        '''
+        Returns a consistent Snapshot of the segment. Raises ShmError if
+        the segment is being updated for longer than timeout seconds,
+        e.g. because the game crashed during an update.
+        '''
+        deadline = None
+        while True:
+            sequence, = _sequence.unpack_from(self._map, _SEQUENCE_OFFSET)
+            if not sequence & 1:
+                header = _header.unpack_from(self._map)
+                values = self._map[self._values_offset:
+                                   self._values_offset + self._values_size]
+                used, = _u32.unpack_from(self._map, self._configuration_offset)
+                configuration = self._map[self._configuration_offset:
+                                          self._configuration_offset +
+                                          min(max(used, _configuration_header.size),
+                                              self._configuration_capacity)]
+                if _sequence.unpack_from(self._map, _SEQUENCE_OFFSET)[0] == sequence:
+                    frames, render_time, simulation_time, paused_simulation_time = header[4:8]
+                    return Snapshot(self, frames, render_time, simulation_time,
+                                    paused_simulation_time, values, configuration)
+            if deadline is None:
+                deadline = time.monotonic() + timeout
+            elif time.monotonic() > deadline:
+                raise ShmError("Segment is not updated consistently")
+            time.sleep(0)
@@ -0,0 +1,197 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import collections
+import logging
+import time
+from pyets2lib.scsdefs import *
+
+import _telemetry
+
+# Call statistics of plug-in listeners, collected by the native loader
+# around each listener call. Collection only costs two clock reads per
+# call, so it can be left enabled.
+
+# Upper bounds of the histogram buckets, in microseconds. The last bucket
+# has no upper bound.
+HISTOGRAM_BOUNDS_US = tuple(2 ** i for i in range(15)) + (None,)
+
+ListenerStats = collections.namedtuple('ListenerStats', (
+    'plugin',      # Top-level module name of the callback
+    'kind',        # 'channel', 'event', 'frame' or 'array'
+    'name',        # Channel name or event id, None for frame callbacks
+    'index',       # Channel index, None if not indexed
+    'callback',
+    'calls',
+    'total_ns',
+    'max_ns',
+    'slow_calls',  # Calls longer than the slow threshold
+    'histogram',   # Call counts per HISTOGRAM_BOUNDS_US bucket
+))
+
+PluginStats = collections.namedtuple('PluginStats', (
+    'calls',
+    'total_ns',
+    'max_ns',
+    'slow_calls',
+    'import_ns',   # None if not loaded by the loader
+    'init_ns',
+))
+
+logger_ = logging.getLogger(__name__)
+
+init_times_ = {}
+summary_interval_ = None
+next_summary_ = None
+summary_registered_ = False
+
+def _plugin_name(callback):
+    module = getattr(callback, '__module__', None)
+    if module is None:
+        return None
+    return module.split('.')[0]
+
+def enable(slow_threshold_ms=None, summary_interval=None):
+    '''
+    Start timing listener calls.
+
+    Calls longer than slow_threshold_ms, e.g. the time budget of a frame,
+    are counted as slow. If summary_interval is given, a summary is logged
+    to the in-game console every summary_interval seconds, flagging
+    listeners with slow calls. Must be called on the game thread, e.g.
+    from telemetry_init().
+    '''
+    global summary_interval_, next_summary_, summary_registered_
+    slow_threshold_ns = 0
+    if slow_threshold_ms is not None:
+        slow_threshold_ns = int(slow_threshold_ms * 1000000)
+    _telemetry.configure_profiling(True, slow_threshold_ns)
+    summary_interval_ = summary_interval
+    if summary_interval is not None:
+        next_summary_ = time.monotonic() + summary_interval
+        if not summary_registered_:
+            _telemetry.register_for_event(SCS_TELEMETRY_EVENT_frame_end.id,
+                                          SCS_TELEMETRY_EVENT_frame_end,
+                                          _frame_end_cb, None)
+            summary_registered_ = True
+
+def disable():
+    '''
+    Stop timing listener calls. The collected statistics are kept.
+    '''
+    global summary_interval_
+    _telemetry.configure_profiling(False, 0)
+    summary_interval_ = None
+
+def reset():
+    '''
+    Clear the listener statistics and the filter counters.
+    '''
+    _telemetry.reset_listener_stats()
+
+def record_init(plugin, import_ns, init_ns):
+    '''
+    Called by the loader with the time it took to import and initialize
+    a plug-in.
+    '''
+    init_times_[plugin] = (import_ns, init_ns)
+
+def listeners():
+    '''
+    Returns a list of ListenerStats, one per registered listener.
+    '''
+    result = []
+    for (kind, source, index, callback, context, calls, total_ns, max_ns,
+         slow_calls, histogram) in _telemetry.listener_stats():
+        if kind == 'frame':
+            # The native loader calls loader.frame_cb with the plug-in
+            # callback in the context. Sinks of pyets2lib, like the derived
+            # channels, have their own callback.
+            if isinstance(context, tuple):
+                callback = context[0]
+            name = None
+        elif kind in ('channel', 'array'):
+            name = source.name
+            if index == SCS_U32_NIL & 0xffffffff:
+                index = None
+        else:
+            name = source.id
+        plugin = _plugin_name(callback)
+        if plugin == __package__:
+            # Our own listeners
+            continue
+        result.append(ListenerStats(plugin, kind, name, index, callback,
+                                    calls, total_ns, max_ns, slow_calls,
+                                    histogram))
+    return result
+
+def plugins():
+    '''
+    Returns a dict of plug-in name to PluginStats, summing the listeners
+    of each plug-in.
+    '''
+    sums = {}
+    for stats in listeners():
+        calls, total_ns, max_ns, slow_calls = sums.get(stats.plugin, (0, 0, 0, 0))
+        sums[stats.plugin] = (calls + stats.calls,
+                              total_ns + stats.total_ns,
+                              max(max_ns, stats.max_ns),
+                              slow_calls + stats.slow_calls)
+    result = {}
+    for plugin in set(sums) | set(init_times_):
+        import_ns, init_ns = init_times_.get(plugin, (None, None))
+        result[plugin] = PluginStats(*sums.get(plugin, (0, 0, 0, 0)),
+                                     import_ns, init_ns)
+    return result
+
+def summary():
+    '''
+    Returns a list of lines summarizing the statistics per plug-in, and
+    listing the listeners with slow calls.
+    '''
+    lines = []
+    for plugin, stats in sorted(plugins().items(), key=lambda item: str(item[0])):
+        line = ("%s: %d calls, %.1f ms total, %.1f us max" %
+                (plugin, stats.calls, stats.total_ns / 1e6, stats.max_ns / 1e3))
+        if stats.init_ns is not None:
+            line += (", import %.1f ms, init %.1f ms" %
+                     (stats.import_ns / 1e6, stats.init_ns / 1e6))
+        if stats.slow_calls:
+            line += ", %d SLOW calls" % stats.slow_calls
+        lines.append(line)
+    for stats in listeners():
+        if stats.slow_calls:
+            target = stats.name if stats.name is not None else 'frame'
+            if stats.index is not None:
+                target += '[%d]' % stats.index
+            lines.append("SLOW %s %s %s: %d of %d calls, %.1f us max" %
+                         (stats.plugin, stats.kind, target, stats.slow_calls,
+                          stats.calls, stats.max_ns / 1e3))
+    return lines
+
+def _frame_end_cb(event, event_info, context):
+    global next_summary_
+    if summary_interval_ is None:
+        return
+    now = time.monotonic()
+    if now < next_summary_:
+        return
+    next_summary_ = now + summary_interval_
+    for line in summary():
+        logger_.info(line)
@@ -0,0 +1,106 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import struct
+from pyets2lib.scsdefs import *
+
+import _telemetry
+
+_VECTOR_TYPES = {
+    SCS_VALUE_TYPE_fvector: _telemetry.scs_value_fvector_t,
+    SCS_VALUE_TYPE_dvector: _telemetry.scs_value_dvector_t,
+    SCS_VALUE_TYPE_euler: _telemetry.scs_value_euler_t,
+}
+
+_PLACEMENT_TYPES = {
+    SCS_VALUE_TYPE_fplacement: (_telemetry.scs_value_fplacement_t,
+                                _telemetry.scs_value_fvector_t),
+    SCS_VALUE_TYPE_dplacement: (_telemetry.scs_value_dplacement_t,
+                                _telemetry.scs_value_dvector_t),
+}
+
+class TelemetryStore(object):
+    '''
+    Latest values of channels, kept in a preallocated buffer that the
+    native loader writes to directly, without creating Python objects.
+
+    Each channel in SCS_CHANNELS gets index_count slots. A slot is one
+    valid byte followed by the raw value. Slots are found by
+    ScsChannel.internal_id, so lookups are O(1).
+
+    Values are only written for channels registered with
+    register_for_store(). Reads from other threads than the game thread
+    can see a partially updated value.
+    '''
+    def __init__(self, create_buffer, channels=SCS_CHANNELS):
+        '''
+        create_buffer(size) must return a buffer of size bytes, e.g.
+        _telemetry.create_store.
+        '''
+        self._offsets = [None] * len(channels)
+        self._structs = [None] * len(channels)
+        size = 0
+        if hasattr(channels, 'definitions'):
+            # Avoids creating the lazy trailer channels
+            definitions = channels.definitions()
+        else:
+            definitions = ((channel.internal_id, channel.type, channel.index_count)
+                           for channel in channels)
+        for internal_id, value_type, index_count in definitions:
+            value_format = SCS_VALUE_FORMATS.get(value_type)
+            if value_format is None:
+                continue
+            slot_struct = struct.Struct('=?' + value_format)
+            self._offsets[internal_id] = size
+            self._structs[internal_id] = slot_struct
+            size += slot_struct.size * index_count
+        self.buffer = memoryview(create_buffer(size))
+
+    def offset(self, channel, index=None):
+        '''
+        Returns the byte offset of the slot for channel and index.
+        '''
+        offset = self._offsets[channel.internal_id]
+        if offset is None:
+            raise ValueError("Channel \"%s\" type %d is not supported by the store" %
+                             (channel.name, channel.type))
+        if index is None:
+            index = 0
+        elif not 0 <= index < channel.index_count:
+            raise IndexError("Index %d out of range for channel \"%s\"" %
+                             (index, channel.name))
+        return offset + index * self._structs[channel.internal_id].size
+
+    def get(self, channel, index=None):
+        '''
+        Returns the latest value of channel, or None if no value has
+        been received. Values have the same types as in channel callbacks.
+        '''
+        slot_struct = self._structs[channel.internal_id]
+        valid, *value = slot_struct.unpack_from(self.buffer,
+                                                self.offset(channel, index))
+        if not valid:
+            return None
+        if len(value) == 1:
+            return value[0]
+        if channel.type in _VECTOR_TYPES:
+            return _VECTOR_TYPES[channel.type](value)
+        placement_type, vector_type = _PLACEMENT_TYPES[channel.type]
+        return placement_type((vector_type(value[:3]),
+                               _telemetry.scs_value_euler_t(value[3:])))
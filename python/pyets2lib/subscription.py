@@ -0,0 +1,144 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+import functools
+
+class Subscription(object):
+    '''
+    A group of registrations that is attached and detached as a unit, e.g.
+    the trailer channels while a trailer is connected, or the job channels
+    during a job. Create with params.subscription():
+
+        trailer = params.subscription()
+        trailer.add_channel(SCS_TELEMETRY_TRAILER_CHANNEL_wear_chassis, wear_cb)
+        ...
+        trailer.attach()  # e.g. when the trailer is connected
+        trailer.detach()  # and disconnected
+
+    It is also a context manager, attached within the with block. Detached
+    registrations cost nothing, as the native loader releases channels and
+    events that have no listeners left. Must be used on the game thread,
+    and not detached within a channel callback, as the game does not allow
+    unregistering there. Detach from an event callback instead, e.g. at
+    frame_end.
+    '''
+    def __init__(self, params):
+        self._params = params
+        # (register, unregister) functions
+        self._entries = []
+        self.attached = False
+
+    def add_channel(self, channel, callback, index=None, context=None,
+                    **options):
+        '''
+        Adds a register_for_channel() registration, with the same arguments,
+        except array. Returns self.
+        '''
+        if options.get('array'):
+            raise ValueError("Array channel \"%s\" cannot be unregistered" %
+                             channel.name)
+        params = self._params
+        return self._add(
+            functools.partial(params.register_for_channel, channel, callback,
+                              index=index, context=context, **options),
+            functools.partial(params.unregister_from_channel, channel, callback,
+                              index=index, context=context,
+                              batched=options.get('batched', False)))
+
+    def add_event(self, event, callback, context=None, **options):
+        '''
+        Adds a register_for_event() registration. Returns self.
+        '''
+        params = self._params
+        return self._add(
+            functools.partial(params.register_for_event, event, callback,
+                              context=context, **options),
+            functools.partial(params.unregister_from_event, event, callback,
+                              context=context))
+
+    def add_configuration(self, callback, context=None, **options):
+        '''
+        Adds a register_for_configuration() registration. Returns self.
+        '''
+        params = self._params
+        return self._add(
+            functools.partial(params.register_for_configuration, callback,
+                              context=context, **options),
+            functools.partial(params.unregister_from_configuration, callback,
+                              context=context))
+
+    def add_gameplay(self, callback, context=None, **options):
+        '''
+        Adds a register_for_gameplay() registration. Returns self.
+        '''
+        params = self._params
+        return self._add(
+            functools.partial(params.register_for_gameplay, callback,
+                              context=context, **options),
+            functools.partial(params.unregister_from_gameplay, callback,
+                              context=context))
+
+    def _add(self, register, unregister):
+        if self.attached:
+            register()
+        self._entries.append((register, unregister))
+        return self
+
+    def attach(self):
+        '''
+        Registers all listeners of the group, if not already attached. On
+        failure, the listeners registered so far are unregistered again.
+        '''
+        if self.attached:
+            return
+        done = []
+        try:
+            for register, unregister in self._entries:
+                register()
+                done.append(unregister)
+        except Exception:
+            for unregister in reversed(done):
+                unregister()
+            raise
+        self.attached = True
+
+    def detach(self):
+        '''
+        Unregisters all listeners of the group, if attached. On failure,
+        the listeners unregistered so far are registered again.
+        '''
+        if not self.attached:
+            return
+        done = []
+        try:
+            for register, unregister in reversed(self._entries):
+                unregister()
+                done.append(register)
+        except Exception:
+            for register in reversed(done):
+                register()
+            raise
+        self.attached = False
+
+    def __enter__(self):
+        self.attach()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.detach()
@@ -0,0 +1,277 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+#include "pyvalue.hpp"
+
+#include <cstring>
+
+#include "log.hpp"
+
+namespace pyvalue {
+
+// Compact, tuple-like value types, used instead of dicts to keep the
+// number of allocations per value down
+static PyStructSequence_Field vector_fields[] = {
+    {"x", nullptr}, {"y", nullptr}, {"z", nullptr}, {nullptr, nullptr}
+};
+static PyStructSequence_Field euler_fields[] = {
+    {"heading", nullptr}, {"pitch", nullptr}, {"roll", nullptr},
+    {nullptr, nullptr}
+};
+static PyStructSequence_Field placement_fields[] = {
+    {"position", nullptr}, {"orientation", nullptr}, {nullptr, nullptr}
+};
+
+static PyStructSequence_Field frame_start_fields[] = {
+    {"flags", nullptr}, {"render_time", nullptr}, {"simulation_time", nullptr},
+    {"paused_simulation_time", nullptr}, {nullptr, nullptr}
+};
+
+static PyStructSequence_Desc fvector_desc = {
+    "_telemetry.scs_value_fvector_t", "Float vector", vector_fields, 3
+};
+static PyStructSequence_Desc dvector_desc = {
+    "_telemetry.scs_value_dvector_t", "Double vector", vector_fields, 3
+};
+static PyStructSequence_Desc euler_desc = {
+    "_telemetry.scs_value_euler_t", "Orientation", euler_fields, 3
+};
+static PyStructSequence_Desc fplacement_desc = {
+    "_telemetry.scs_value_fplacement_t", "Float placement", placement_fields, 2
+};
+static PyStructSequence_Desc dplacement_desc = {
+    "_telemetry.scs_value_dplacement_t", "Double placement", placement_fields, 2
+};
+static PyStructSequence_Desc frame_start_desc = {
+    "_telemetry.scs_telemetry_frame_start_t", "Frame start event info",
+    frame_start_fields, 4
+};
+
+static PyTypeObject *fvector_type_ = nullptr;
+static PyTypeObject *dvector_type_ = nullptr;
+static PyTypeObject *euler_type_ = nullptr;
+static PyTypeObject *fplacement_type_ = nullptr;
+static PyTypeObject *dplacement_type_ = nullptr;
+static PyTypeObject *frame_start_type_ = nullptr;
+// The frame_start info of the last frame, reused when no listener kept it
+static PyObject *py_frame_start_ = nullptr;
+
+static bool add_type(PyObject *py_module, PyTypeObject *&type,
+                     PyStructSequence_Desc &desc) {
+    type = PyStructSequence_NewType(&desc);
+    if (type == nullptr) {
+        return false;
+    }
+    // Attribute name without module prefix
+    const char *name = std::strchr(desc.name, '.') + 1;
+    Py_INCREF(type);
+    if (PyModule_AddObject(py_module, name,
+                           reinterpret_cast<PyObject*>(type)) != 0) {
+        Py_DECREF(type);
+        return false;
+    }
+    return true;
+}
+
+bool add_types(PyObject *py_module) {
+    return add_type(py_module, fvector_type_, fvector_desc) &&
+        add_type(py_module, dvector_type_, dvector_desc) &&
+        add_type(py_module, euler_type_, euler_desc) &&
+        add_type(py_module, fplacement_type_, fplacement_desc) &&
+        add_type(py_module, dplacement_type_, dplacement_desc) &&
+        add_type(py_module, frame_start_type_, frame_start_desc);
+}
+
+void clear_types() {
+    Py_CLEAR(py_frame_start_);
+    for (PyTypeObject **type : {&fvector_type_, &dvector_type_, &euler_type_,
+                                &fplacement_type_, &dplacement_type_,
+                                &frame_start_type_}) {
+        Py_CLEAR(*type);
+    }
+}
+
+template <class T>
+static PyObject *create_vector(PyTypeObject *type, const T &scs_vector) {
+    PyObject *py_vector = PyStructSequence_New(type);
+    if (py_vector == nullptr) {
+        return nullptr;
+    }
+    // PyStructSequence_SET_ITEM steals the references
+    PyStructSequence_SET_ITEM(py_vector, 0, PyFloat_FromDouble(scs_vector.x));
+    PyStructSequence_SET_ITEM(py_vector, 1, PyFloat_FromDouble(scs_vector.y));
+    PyStructSequence_SET_ITEM(py_vector, 2, PyFloat_FromDouble(scs_vector.z));
+    return py_vector;
+}
+
+static PyObject *create_euler(const scs_value_euler_t &euler) {
+    PyObject *py_euler = PyStructSequence_New(euler_type_);
+    if (py_euler == nullptr) {
+        return nullptr;
+    }
+    PyStructSequence_SET_ITEM(py_euler, 0, PyFloat_FromDouble(euler.heading));
+    PyStructSequence_SET_ITEM(py_euler, 1, PyFloat_FromDouble(euler.pitch));
+    PyStructSequence_SET_ITEM(py_euler, 2, PyFloat_FromDouble(euler.roll));
+    return py_euler;
+}
+
+template <class T>
+static PyObject *create_placement(PyTypeObject *type,
+                                  PyTypeObject *vector_type,
+                                  const T &placement) {
+    PyObject *py_placement = PyStructSequence_New(type);
+    if (py_placement == nullptr) {
+        return nullptr;
+    }
+    PyStructSequence_SET_ITEM(py_placement, 0,
+                              create_vector(vector_type, placement.position));
+    PyStructSequence_SET_ITEM(py_placement, 1,
+                              create_euler(placement.orientation));
+    return py_placement;
+}
+
+pyhelp::PyObjRef create(const scs_value_t *value) {
+    if (value == nullptr) {
+        return pyhelp::PyObjRef();
+    }
+    PyObject *py_value = nullptr;
+    switch (value->type) {
+        case SCS_VALUE_TYPE_bool:
+            py_value = PyBool_FromLong(value->value_bool.value);
+            break;
+        case SCS_VALUE_TYPE_s32:
+            py_value = PyLong_FromLong(value->value_s32.value);
+            break;
+        case SCS_VALUE_TYPE_u32:
+            py_value = PyLong_FromUnsignedLong(value->value_u32.value);
+            break;
+        case SCS_VALUE_TYPE_s64:
+            py_value = PyLong_FromLongLong(value->value_s64.value);
+            break;
+        case SCS_VALUE_TYPE_u64:
+            py_value = PyLong_FromUnsignedLongLong(value->value_u64.value);
+            break;
+        case SCS_VALUE_TYPE_float:
+            py_value = PyFloat_FromDouble(value->value_float.value);
+            break;
+        case SCS_VALUE_TYPE_double:
+            py_value = PyFloat_FromDouble(value->value_double.value);
+            break;
+        case SCS_VALUE_TYPE_fvector:
+            py_value = create_vector(fvector_type_, value->value_fvector);
+            break;
+        case SCS_VALUE_TYPE_dvector:
+            py_value = create_vector(dvector_type_, value->value_dvector);
+            break;
+        case SCS_VALUE_TYPE_euler:
+            py_value = create_euler(value->value_euler);
+            break;
+        case SCS_VALUE_TYPE_fplacement:
+            py_value = create_placement(fplacement_type_, fvector_type_,
+                                        value->value_fplacement);
+            break;
+        case SCS_VALUE_TYPE_dplacement:
+            py_value = create_placement(dplacement_type_, dvector_type_,
+                                        value->value_dplacement);
+            break;
+        case SCS_VALUE_TYPE_string:
+            py_value = PyUnicode_FromString(value->value_string.value);
+            break;
+        default:
+            log_loader("Cannot convert SCS type: %u", value->type);
+    }
+    return pyhelp::PyObjRef::steal(py_value);
+}
+
+pyhelp::PyObjRef create_frame_start(const scs_telemetry_frame_start_t *info) {
+    PyObject *py_items[] = {
+        PyLong_FromUnsignedLong(info->flags),
+        PyLong_FromUnsignedLongLong(info->render_time),
+        PyLong_FromUnsignedLongLong(info->simulation_time),
+        PyLong_FromUnsignedLongLong(info->paused_simulation_time),
+    };
+    bool ok = true;
+    for (PyObject *py_item : py_items) {
+        ok = ok && py_item != nullptr;
+    }
+    // Only this module holds the info of the last frame, so it can be
+    // updated in place instead of allocating a new one
+    if (ok && (py_frame_start_ == nullptr || Py_REFCNT(py_frame_start_) != 1)) {
+        Py_CLEAR(py_frame_start_);
+        py_frame_start_ = PyStructSequence_New(frame_start_type_);
+        ok = py_frame_start_ != nullptr;
+    }
+    if (!ok) {
+        for (PyObject *py_item : py_items) {
+            Py_XDECREF(py_item);
+        }
+        return pyhelp::PyObjRef();
+    }
+    for (Py_ssize_t i = 0; i < 4; ++i) {
+        // PyStructSequence_SET_ITEM steals the reference, but does not
+        // release the previous item
+        PyObject *py_previous = PyStructSequence_GET_ITEM(py_frame_start_, i);
+        PyStructSequence_SET_ITEM(py_frame_start_, i, py_items[i]);
+        Py_XDECREF(py_previous);
+    }
+    return pyhelp::PyObjRef(py_frame_start_);
+}
+
+size_t raw_size(scs_value_type_t type) {
+    switch (type) {
+        case SCS_VALUE_TYPE_bool:
+            return sizeof(scs_value_bool_t);
+        case SCS_VALUE_TYPE_s32:
+            return sizeof(scs_value_s32_t);
+        case SCS_VALUE_TYPE_u32:
+            return sizeof(scs_value_u32_t);
+        case SCS_VALUE_TYPE_u64:
+            return sizeof(scs_value_u64_t);
+        case SCS_VALUE_TYPE_s64:
+            return sizeof(scs_value_s64_t);
+        case SCS_VALUE_TYPE_float:
+            return sizeof(scs_value_float_t);
+        case SCS_VALUE_TYPE_double:
+            return sizeof(scs_value_double_t);
+        case SCS_VALUE_TYPE_fvector:
+            return sizeof(scs_value_fvector_t);
+        case SCS_VALUE_TYPE_dvector:
+            return sizeof(scs_value_dvector_t);
+        case SCS_VALUE_TYPE_euler:
+            return sizeof(scs_value_euler_t);
+        case SCS_VALUE_TYPE_fplacement:
+            return sizeof(scs_value_fplacement_t);
+        case SCS_VALUE_TYPE_dplacement:
+            // Skip trailing padding
+            return sizeof(scs_value_dvector_t) + sizeof(scs_value_euler_t);
+        default:
+            return 0;
+    }
+}
+
+bool raw_equal(const scs_value_t &a, const scs_value_t &b) {
+    if (a.type != b.type) {
+        return false;
+    }
+    size_t size = raw_size(a.type);
+    // All union members start at the same address
+    return size != 0 && std::memcmp(&a.value_bool, &b.value_bool, size) == 0;
+}
+
+}
@@ -0,0 +1,60 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+// Conversion of SCS values to Python objects
+
+#ifndef _PYVALUE_HPP_
+#define _PYVALUE_HPP_
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include "scssdk_telemetry.h"
+
+#include "pyhelp.hpp"
+
+namespace pyvalue {
+
+// Creates the struct sequence types for vectors, eulers, placements and
+// the frame_start info and adds them to module. Returns false, with a Python error set,
+// on failure.
+bool add_types(PyObject *py_module);
+
+// Releases the types. Must be called before Py_Finalize().
+void clear_types();
+
+// Returns empty pyhelp::PyObjRef on error
+pyhelp::PyObjRef create(const scs_value_t *value);
+
+// Returns the info of the frame_start event. The object of the previous
+// frame is updated and returned again if no listener kept it. Returns
+// empty pyhelp::PyObjRef on error.
+pyhelp::PyObjRef create_frame_start(const scs_telemetry_frame_start_t *info);
+
+// Returns the number of bytes of the value in the scs_value_t union,
+// excluding trailing padding, or 0 if the type has no fixed size
+size_t raw_size(scs_value_type_t type);
+
+// Returns true if both values have the same type and raw value.
+// Strings are never considered equal.
+bool raw_equal(const scs_value_t &a, const scs_value_t &b);
+
+}
+
+#endif
@@ -0,0 +1,157 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+#include "recording.hpp"
+
+#include <cerrno>
+#include <chrono>
+#include <cstdio>
+#include <cstring>
+#include <vector>
+
+#include "log.hpp"
+#include "pyvalue.hpp"
+
+namespace recording {
+
+// Large buffer, so the game thread seldom waits for the disk
+static const size_t WRITE_BUFFER_SIZE = 1 << 20;
+
+static FILE *file_ = nullptr;
+static std::vector<bool> defined_channels_;
+static std::chrono::steady_clock::time_point start_time_;
+
+template <class T>
+static void put(const T &value) {
+    std::fwrite(&value, sizeof(value), 1, file_);
+}
+
+static void put_string(const char *value) {
+    size_t length = std::strlen(value);
+    if (length > UINT16_MAX) {
+        length = UINT16_MAX;
+    }
+    put(static_cast<uint16_t>(length));
+    std::fwrite(value, 1, length, file_);
+    std::fputc('\0', file_);
+}
+
+static void put_value(const scs_value_t &value) {
+    if (value.type == SCS_VALUE_TYPE_string) {
+        put_string(value.value_string.value);
+        return;
+    }
+    // All union members start at the same address
+    std::fwrite(&value.value_bool, 1, pyvalue::raw_size(value.type), file_);
+}
+
+bool start(const char *path, const char *game_id, const char *game_name,
+           scs_u32_t game_version) {
+    stop();
+    file_ = std::fopen(path, "wb");
+    if (file_ == nullptr) {
+        log_loader("Could not open recording \"%s\": %s", path,
+                   std::strerror(errno));
+        return false;
+    }
+    std::setvbuf(file_, nullptr, _IOFBF, WRITE_BUFFER_SIZE);
+    std::fwrite(RECORDING_MAGIC, 1, sizeof(RECORDING_MAGIC), file_);
+    put(RECORDING_VERSION);
+    put(static_cast<uint32_t>(game_version));
+    put_string(game_id);
+    put_string(game_name);
+    start_time_ = std::chrono::steady_clock::now();
+    log_loader("Recording telemetry to \"%s\"", path);
+    return true;
+}
+
+void stop() {
+    if (file_ == nullptr) {
+        return;
+    }
+    std::fclose(file_);
+    file_ = nullptr;
+    defined_channels_.clear();
+    log_loader("Recording stopped");
+}
+
+bool active() {
+    return file_ != nullptr;
+}
+
+void write_value(uint32_t channel_id, const char *name, scs_u32_t index,
+                 scs_value_type_t type, const scs_value_t *value) {
+    if (channel_id >= defined_channels_.size()) {
+        defined_channels_.resize(channel_id + 1, false);
+    }
+    if (!defined_channels_[channel_id]) {
+        put(RECORD_channel);
+        put(channel_id);
+        put(static_cast<uint32_t>(index));
+        put(static_cast<uint32_t>(type));
+        put_string(name);
+        defined_channels_[channel_id] = true;
+    }
+    if (value == nullptr || value->type == SCS_VALUE_TYPE_INVALID) {
+        put(RECORD_no_value);
+        put(channel_id);
+        return;
+    }
+    put(RECORD_value);
+    put(channel_id);
+    put_value(*value);
+}
+
+void write_event(scs_event_t event, const void *event_info) {
+    auto elapsed = std::chrono::steady_clock::now() - start_time_;
+    put(RECORD_event);
+    put(static_cast<uint32_t>(event));
+    put(static_cast<uint64_t>(
+            std::chrono::duration_cast<std::chrono::nanoseconds>(elapsed).count()));
+    if (event_info == nullptr) {
+        return;
+    }
+    if (event == SCS_TELEMETRY_EVENT_frame_start) {
+        auto frame = static_cast<const scs_telemetry_frame_start_t*>(event_info);
+        put(static_cast<uint32_t>(frame->flags));
+        put(static_cast<uint64_t>(frame->render_time));
+        put(static_cast<uint64_t>(frame->simulation_time));
+        put(static_cast<uint64_t>(frame->paused_simulation_time));
+    } else if (event == SCS_TELEMETRY_EVENT_configuration ||
+               event == SCS_TELEMETRY_EVENT_gameplay) {
+        // The struct layouts are the same
+        auto config = static_cast<const scs_telemetry_configuration_t*>(event_info);
+        put_string(config->id);
+        uint32_t count = 0;
+        for (const scs_named_value_t *attr = config->attributes;
+             attr->name != nullptr; ++attr) {
+            ++count;
+        }
+        put(count);
+        for (const scs_named_value_t *attr = config->attributes;
+             attr->name != nullptr; ++attr) {
+            put_string(attr->name);
+            put(static_cast<uint32_t>(attr->index));
+            put(static_cast<uint32_t>(attr->value.type));
+            put_value(attr->value);
+        }
+    }
+}
+
+}
@@ -0,0 +1,88 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+// Recording of telemetry to a binary file
+//
+// The file is append-only and can be read through mmap. All numbers are in
+// native byte order (little-endian on the supported platforms) and nothing
+// is padded. Strings are a u16 length followed by the bytes and a NUL, so
+// they can be used in place.
+//
+// Header:
+//   char[8] magic RECORDING_MAGIC
+//   u32 format version RECORDING_VERSION
+//   u32 game version
+//   string game id
+//   string game name
+//
+// Records, each starting with a u8 record kind:
+//   RECORD_channel: u32 channel id, u32 index, u32 value type, string name
+//     Defines a channel id. Written before the first value of the channel.
+//   RECORD_value: u32 channel id, value
+//     Value is the raw bytes of the scs_value_t member of the channel type,
+//     see pyvalue::raw_size(), or a string for string channels.
+//   RECORD_no_value: u32 channel id
+//     SCS_TELEMETRY_CHANNEL_FLAG_no_value
+//   RECORD_event: u32 event, u64 nanoseconds since recording start, info
+//     frame_start info: u32 flags, u64 render_time, u64 simulation_time,
+//       u64 paused_simulation_time
+//     configuration and gameplay info: string id, u32 attribute count,
+//       attributes of string name, u32 index, u32 value type, value
+//     Other events have no info.
+//
+// Frames are delimited by the frame_start and frame_end events.
+
+#ifndef _RECORDING_HPP_
+#define _RECORDING_HPP_
+
+#include <cstdint>
+
+#include "scssdk_telemetry.h"
+
+namespace recording {
+
+static const char RECORDING_MAGIC[8] = {'P', 'Y', 'E', 'T', 'S', '2', 'R', 'C'};
+static const uint32_t RECORDING_VERSION = 1;
+
+enum record_kind : uint8_t {
+    RECORD_channel = 1,
+    RECORD_value = 2,
+    RECORD_no_value = 3,
+    RECORD_event = 4,
+};
+
+// Opens path for writing, replacing any existing file. Returns false if
+// the file cannot be opened.
+bool start(const char *path, const char *game_id, const char *game_name,
+           scs_u32_t game_version);
+
+void stop();
+
+bool active();
+
+// channel_id identifies the channel in the file. The channel is defined
+// on first use.
+void write_value(uint32_t channel_id, const char *name, scs_u32_t index,
+                 scs_value_type_t type, const scs_value_t *value);
+
+void write_event(scs_event_t event, const void *event_info);
+
+}
+
+#endif
@@ -0,0 +1,385 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+// Replays a telemetry recording through the loader.
+//
+// Acts as the game, loading the plug-ins in ./plugins/python, and feeds the
+// channel values and events of a recording (see recording.hpp) to the
+// callbacks registered by the loader. The recording is memory-mapped, so
+// long sessions do not need to fit in RAM.
+//
+// Usage: replay [-f] [-s SPEED] RECORDING
+//   -f        Replay as fast as possible
+//   -s SPEED  Replay speed factor, 1 is real time (default)
+//
+// Prints a JSON object with replay statistics when done.
+
+#include <chrono>
+#include <cstdlib>
+#include <cstring>
+#include <iostream>
+#include <map>
+#include <string>
+#include <thread>
+#include <utility>
+#include <vector>
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <unistd.h>
+
+#include "scssdk_telemetry.h"
+#include "eurotrucks2/scssdk_eut2.h"
+#include "eurotrucks2/scssdk_telemetry_eut2.h"
+#include "amtrucks/scssdk_ats.h"
+#include "amtrucks/scssdk_telemetry_ats.h"
+
+#include "pyvalue.hpp"
+#include "recording.hpp"
+
+static void log(const scs_log_type_t type, const scs_string_t message) {
+    std::cerr << "LOG: " << message << std::endl;
+}
+
+struct channel_registration {
+    scs_telemetry_channel_callback_t callback;
+    scs_context_t context;
+};
+static std::map<std::pair<std::string, scs_u32_t>, channel_registration> channel_registrations_;
+// Incremented on each registration, so channel lookups can be redone
+static unsigned registration_count_ = 0;
+
+struct event_registration {
+    scs_telemetry_event_callback_t callback = nullptr;
+    scs_context_t context = nullptr;
+};
+static event_registration event_registrations_[SCS_TELEMETRY_EVENT_gameplay + 1];
+
+static SCSAPI_RESULT register_for_channel(const scs_string_t name, const scs_u32_t index, const scs_value_type_t type, const scs_u32_t flags, const scs_telemetry_channel_callback_t callback, const scs_context_t context) {
+    auto key = std::make_pair(std::string(name), index);
+    if (channel_registrations_.count(key) != 0) {
+        return SCS_RESULT_already_registered;
+    }
+    channel_registrations_[key] = {callback, context};
+    ++registration_count_;
+    return SCS_RESULT_ok;
+}
+
+static SCSAPI_RESULT register_for_event(const scs_event_t event, const scs_telemetry_event_callback_t callback, const scs_context_t context) {
+    if (event > SCS_TELEMETRY_EVENT_gameplay) {
+        return SCS_RESULT_unsupported;
+    }
+    if (event_registrations_[event].callback != nullptr) {
+        return SCS_RESULT_already_registered;
+    }
+    event_registrations_[event] = {callback, context};
+    return SCS_RESULT_ok;
+}
+
+static SCSAPI_RESULT unregister_from_channel(const scs_string_t name, const scs_u32_t index, const scs_value_type_t type) {
+    if (channel_registrations_.erase(std::make_pair(std::string(name), index)) == 0) {
+        return SCS_RESULT_not_found;
+    }
+    ++registration_count_;
+    return SCS_RESULT_ok;
+}
+
+static SCSAPI_RESULT unregister_from_event(const scs_event_t event) {
+    if (event > SCS_TELEMETRY_EVENT_gameplay ||
+        event_registrations_[event].callback == nullptr) {
+        return SCS_RESULT_not_found;
+    }
+    event_registrations_[event] = event_registration();
+    return SCS_RESULT_ok;
+}
+
+// Bounds checked reading of the mapped file
+class reader {
+public:
+    reader(const uint8_t *begin, const uint8_t *end) : pos_(begin), end_(end) {}
+
+    bool at_end() const {
+        return pos_ == end_;
+    }
+
+    bool ok() const {
+        return ok_;
+    }
+
+    template <class T>
+    T get() {
+        T value = T();
+        if (check(sizeof(T))) {
+            std::memcpy(&value, pos_, sizeof(T));
+            pos_ += sizeof(T);
+        }
+        return value;
+    }
+
+    // Returns a pointer to the NUL-terminated string in the file
+    const char *get_string() {
+        uint16_t length = get<uint16_t>();
+        if (!check(length + 1)) {
+            return "";
+        }
+        const char *value = reinterpret_cast<const char*>(pos_);
+        pos_ += length + 1;
+        return value;
+    }
+
+    void get_value(scs_value_type_t type, scs_value_t &value) {
+        value.type = type;
+        if (type == SCS_VALUE_TYPE_string) {
+            value.value_string.value = get_string();
+            return;
+        }
+        size_t size = pyvalue::raw_size(type);
+        if (size == 0) {
+            ok_ = false;
+        } else if (check(size)) {
+            std::memcpy(&value.value_bool, pos_, size);
+            pos_ += size;
+        }
+    }
+
+private:
+    bool check(size_t size) {
+        if (!ok_ || static_cast<size_t>(end_ - pos_) < size) {
+            ok_ = false;
+            return false;
+        }
+        return true;
+    }
+
+    const uint8_t *pos_;
+    const uint8_t *end_;
+    bool ok_ = true;
+};
+
+struct recorded_channel {
+    std::string name;
+    scs_u32_t index;
+    scs_value_type_t type;
+    const channel_registration *registration = nullptr;
+    unsigned registration_count = 0;
+};
+
+struct replay_stats {
+    uint64_t frames = 0;
+    uint64_t values = 0;
+    uint64_t events = 0;
+};
+
+static bool replay(reader &rec, double speed, replay_stats &stats) {
+    std::vector<recorded_channel> channels;
+    std::vector<scs_named_value_t> attributes;
+    auto start = std::chrono::steady_clock::now();
+
+    while (!rec.at_end() && rec.ok()) {
+        auto kind = rec.get<uint8_t>();
+        switch (kind) {
+            case recording::RECORD_channel: {
+                uint32_t channel_id = rec.get<uint32_t>();
+                if (channel_id >= channels.size()) {
+                    channels.resize(channel_id + 1);
+                }
+                recorded_channel &channel = channels[channel_id];
+                channel.index = rec.get<uint32_t>();
+                channel.type = rec.get<uint32_t>();
+                channel.name = rec.get_string();
+                channel.registration_count = registration_count_ - 1;
+                break;
+            }
+            case recording::RECORD_value:
+            case recording::RECORD_no_value: {
+                uint32_t channel_id = rec.get<uint32_t>();
+                if (channel_id >= channels.size()) {
+                    std::cerr << "Value of undefined channel " << channel_id << std::endl;
+                    return false;
+                }
+                recorded_channel &channel = channels[channel_id];
+                scs_value_t value;
+                if (kind == recording::RECORD_value) {
+                    rec.get_value(channel.type, value);
+                }
+                if (channel.registration_count != registration_count_) {
+                    auto it = channel_registrations_.find(
+                        std::make_pair(channel.name, channel.index));
+                    channel.registration = it == channel_registrations_.end() ?
+                        nullptr : &it->second;
+                    channel.registration_count = registration_count_;
+                }
+                if (channel.registration != nullptr && rec.ok()) {
+                    channel.registration->callback(
+                        channel.name.c_str(), channel.index,
+                        kind == recording::RECORD_value ? &value : nullptr,
+                        channel.registration->context);
+                    ++stats.values;
+                }
+                break;
+            }
+            case recording::RECORD_event: {
+                scs_event_t event = rec.get<uint32_t>();
+                uint64_t time_ns = rec.get<uint64_t>();
+                scs_telemetry_frame_start_t frame_start;
+                scs_telemetry_configuration_t config;
+                const void *event_info = nullptr;
+                if (event == SCS_TELEMETRY_EVENT_frame_start) {
+                    std::memset(&frame_start, 0, sizeof(frame_start));
+                    frame_start.flags = rec.get<uint32_t>();
+                    frame_start.render_time = rec.get<uint64_t>();
+                    frame_start.simulation_time = rec.get<uint64_t>();
+                    frame_start.paused_simulation_time = rec.get<uint64_t>();
+                    event_info = &frame_start;
+                    ++stats.frames;
+                } else if (event == SCS_TELEMETRY_EVENT_configuration ||
+                           event == SCS_TELEMETRY_EVENT_gameplay) {
+                    config.id = rec.get_string();
+                    uint32_t count = rec.get<uint32_t>();
+                    attributes.clear();
+                    for (uint32_t i = 0; i < count && rec.ok(); ++i) {
+                        scs_named_value_t attr;
+                        attr.name = rec.get_string();
+                        attr.index = rec.get<uint32_t>();
+                        rec.get_value(rec.get<uint32_t>(), attr.value);
+                        attributes.push_back(attr);
+                    }
+                    scs_named_value_t terminator;
+                    std::memset(&terminator, 0, sizeof(terminator));
+                    attributes.push_back(terminator);
+                    config.attributes = attributes.data();
+                    event_info = &config;
+                }
+                if (!rec.ok() || event > SCS_TELEMETRY_EVENT_gameplay) {
+                    break;
+                }
+                if (speed > 0) {
+                    std::this_thread::sleep_until(
+                        start + std::chrono::nanoseconds(
+                            static_cast<int64_t>(time_ns / speed)));
+                }
+                const event_registration &registration = event_registrations_[event];
+                if (registration.callback != nullptr) {
+                    registration.callback(event, event_info, registration.context);
+                    ++stats.events;
+                }
+                break;
+            }
+            default:
+                std::cerr << "Unknown record kind " << static_cast<int>(kind) << std::endl;
+                return false;
+        }
+    }
+    if (!rec.ok()) {
+        // A recording that was not closed properly can end mid-record
+        std::cerr << "Recording is truncated" << std::endl;
+    }
+    return true;
+}
+
+int main(int argc, char *argv[]) {
+    double speed = 1;
+    int opt;
+    while ((opt = getopt(argc, argv, "fs:")) != -1) {
+        switch (opt) {
+            case 'f':
+                speed = 0;
+                break;
+            case 's':
+                speed = std::atof(optarg);
+                break;
+            default:
+                std::cerr << "Usage: " << argv[0] << " [-f] [-s SPEED] RECORDING" << std::endl;
+                return 1;
+        }
+    }
+    if (optind != argc - 1) {
+        std::cerr << "Usage: " << argv[0] << " [-f] [-s SPEED] RECORDING" << std::endl;
+        return 1;
+    }
+    const char *path = argv[optind];
+
+    int fd = open(path, O_RDONLY);
+    struct stat file_stat;
+    if (fd < 0 || fstat(fd, &file_stat) != 0) {
+        std::cerr << "Cannot open " << path << std::endl;
+        return 1;
+    }
+    size_t size = file_stat.st_size;
+    void *data = size == 0 ? MAP_FAILED :
+        mmap(nullptr, size, PROT_READ, MAP_PRIVATE, fd, 0);
+    close(fd);
+    if (data == MAP_FAILED) {
+        std::cerr << "Cannot map " << path << std::endl;
+        return 1;
+    }
+    madvise(data, size, MADV_SEQUENTIAL);
+
+    const uint8_t *begin = static_cast<const uint8_t*>(data);
+    reader rec(begin, begin + size);
+    char magic[sizeof(recording::RECORDING_MAGIC)];
+    for (char &c : magic) {
+        c = rec.get<char>();
+    }
+    uint32_t version = rec.get<uint32_t>();
+    if (!rec.ok() ||
+        std::memcmp(magic, recording::RECORDING_MAGIC, sizeof(magic)) != 0 ||
+        version != recording::RECORDING_VERSION) {
+        std::cerr << "Not a version " << recording::RECORDING_VERSION
+                  << " recording: " << path << std::endl;
+        return 1;
+    }
+    scs_u32_t game_version = rec.get<uint32_t>();
+    std::string game_id = rec.get_string();
+    std::string game_name = rec.get_string();
+
+    scs_telemetry_init_params_v101_t params;
+    std::memset(&params, 0, sizeof(params));
+    params.common.game_name = game_name.c_str();
+    params.common.game_id = game_id.c_str();
+    params.common.game_version = game_version;
+    params.common.log = log;
+    params.register_for_channel = register_for_channel;
+    params.register_for_event = register_for_event;
+    params.unregister_from_channel = unregister_from_channel;
+    params.unregister_from_event = unregister_from_event;
+    if (scs_telemetry_init(SCS_TELEMETRY_VERSION_1_01, &params) != SCS_RESULT_ok) {
+        std::cerr << "Init failed" << std::endl;
+        return 1;
+    }
+
+    replay_stats stats;
+    auto start = std::chrono::steady_clock::now();
+    bool ok = replay(rec, speed, stats);
+    auto end = std::chrono::steady_clock::now();
+    double seconds = std::chrono::duration<double>(end - start).count();
+
+    scs_telemetry_shutdown();
+    munmap(data, size);
+
+    std::cout << "{\"replay\": \"" << path << "\""
+              << ", \"speed\": " << speed
+              << ", \"frames\": " << stats.frames
+              << ", \"values\": " << stats.values
+              << ", \"events\": " << stats.events
+              << ", \"seconds\": " << seconds
+              << "}" << std::endl;
+    return ok ? 0 : 1;
+}
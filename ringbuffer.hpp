@@ -0,0 +1,109 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+// Lock-free single-producer/single-consumer ring buffer
+
+#ifndef _RINGBUFFER_HPP_
+#define _RINGBUFFER_HPP_
+
+#include <atomic>
+#include <cstdint>
+#include <cstring>
+#include <type_traits>
+#include <vector>
+
+template <class T>
+class RingBuffer {
+    static_assert(std::is_trivially_copyable<T>::value,
+                  "Items are copied with memcpy");
+public:
+    // capacity is rounded up to a power of two
+    explicit RingBuffer(size_t capacity) : head_(0), tail_(0) {
+        size_t size = 1;
+        while (size < capacity) {
+            size <<= 1;
+        }
+        items_.resize(size);
+        mask_ = size - 1;
+    }
+
+    size_t capacity() const {
+        return items_.size();
+    }
+
+    size_t size() const {
+        return head_.load(std::memory_order_acquire) -
+            tail_.load(std::memory_order_acquire);
+    }
+
+    bool empty() const {
+        return size() == 0;
+    }
+
+    // Producer. Returns false if the buffer is full.
+    bool try_push(const T &item) {
+        uint64_t head = head_.load(std::memory_order_relaxed);
+        if (head - tail_.load(std::memory_order_acquire) >= items_.size()) {
+            return false;
+        }
+        std::memcpy(&items_[head & mask_], &item, sizeof(T));
+        head_.store(head + 1, std::memory_order_release);
+        return true;
+    }
+
+    // Producer. Makes room by discarding the oldest item if the buffer is
+    // full. Returns true if an item was discarded.
+    bool push_drop_oldest(const T &item) {
+        bool dropped = false;
+        uint64_t head = head_.load(std::memory_order_relaxed);
+        uint64_t tail = tail_.load(std::memory_order_acquire);
+        if (head - tail >= items_.size()) {
+            // If this fails, the consumer took the item and there is room
+            dropped = tail_.compare_exchange_strong(tail, tail + 1,
+                                                    std::memory_order_acq_rel);
+        }
+        std::memcpy(&items_[head & mask_], &item, sizeof(T));
+        head_.store(head + 1, std::memory_order_release);
+        return dropped;
+    }
+
+    // Consumer. Returns false if the buffer is empty.
+    bool try_pop(T &item) {
+        uint64_t tail = tail_.load(std::memory_order_acquire);
+        while (tail != head_.load(std::memory_order_acquire)) {
+            std::memcpy(&item, &items_[tail & mask_], sizeof(T));
+            // The producer moves tail when it discards the oldest item, in
+            // which case the copy might be overwritten. Retry then.
+            if (tail_.compare_exchange_weak(tail, tail + 1,
+                                            std::memory_order_acq_rel)) {
+                return true;
+            }
+        }
+        return false;
+    }
+
+private:
+    std::vector<T> items_;
+    size_t mask_;
+    // Monotonic counters, the item index is counter & mask_
+    std::atomic<uint64_t> head_;
+    std::atomic<uint64_t> tail_;
+};
+
+#endif
@@ -0,0 +1,237 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+#include "shm.hpp"
+
+#include <atomic>
+#include <cerrno>
+#include <cstring>
+#include <string>
+#include <utility>
+#include <vector>
+
+#include <fcntl.h>
+#include <sys/mman.h>
+#include <unistd.h>
+
+#include "log.hpp"
+#include "pyvalue.hpp"
+
+namespace shm {
+
+struct header {
+    char magic[8];
+    uint32_t version;
+    uint32_t header_size;
+    uint64_t sequence;
+    uint64_t frames;
+    uint64_t render_time;
+    uint64_t simulation_time;
+    uint64_t paused_simulation_time;
+    uint32_t directory_offset;
+    uint32_t channel_count;
+    uint32_t values_offset;
+    uint32_t values_size;
+    uint32_t configuration_offset;
+    uint32_t configuration_capacity;
+};
+
+static_assert(sizeof(header) == 80, "Header layout changed");
+static_assert(sizeof(std::atomic<uint64_t>) == sizeof(uint64_t) &&
+              std::atomic<uint64_t>::is_always_lock_free,
+              "Sequence must be a plain lock-free u64");
+
+static std::string name_;
+static uint8_t *segment_ = nullptr;
+static size_t segment_size_ = 0;
+static header *header_ = nullptr;
+static std::atomic<uint64_t> *sequence_ = nullptr;
+static scs_telemetry_frame_start_t frame_start_;
+// Serialized configurations by id, in the order they were first seen
+static std::vector<std::pair<std::string, std::vector<uint8_t>>> configurations_;
+static bool configurations_changed_ = false;
+
+static size_t align8(size_t size) {
+    return (size + 7) & ~static_cast<size_t>(7);
+}
+
+template <class T>
+static void put(std::vector<uint8_t> &buf, const T &value) {
+    const uint8_t *bytes = reinterpret_cast<const uint8_t*>(&value);
+    buf.insert(buf.end(), bytes, bytes + sizeof(value));
+}
+
+static void put_string(std::vector<uint8_t> &buf, const char *value) {
+    size_t length = std::strlen(value);
+    if (length > UINT16_MAX) {
+        length = UINT16_MAX;
+    }
+    put(buf, static_cast<uint16_t>(length));
+    buf.insert(buf.end(), value, value + length);
+    buf.push_back('\0');
+}
+
+static void put_value(std::vector<uint8_t> &buf, const scs_value_t &value) {
+    if (value.type == SCS_VALUE_TYPE_string) {
+        put_string(buf, value.value_string.value);
+        return;
+    }
+    // All union members start at the same address
+    const uint8_t *bytes = reinterpret_cast<const uint8_t*>(&value.value_bool);
+    buf.insert(buf.end(), bytes, bytes + pyvalue::raw_size(value.type));
+}
+
+bool start(const char *name, const void *directory, size_t directory_size,
+           uint32_t channel_count, size_t values_size) {
+    stop();
+    size_t directory_offset = sizeof(header);
+    size_t values_offset = align8(directory_offset + directory_size);
+    size_t configuration_offset = align8(values_offset + values_size);
+    size_t size = configuration_offset + CONFIGURATION_CAPACITY;
+
+    int fd = shm_open(name, O_CREAT | O_RDWR | O_TRUNC, 0600);
+    if (fd < 0) {
+        log_loader("Could not create shared memory \"%s\": %s", name,
+                   std::strerror(errno));
+        return false;
+    }
+    void *segment = MAP_FAILED;
+    if (ftruncate(fd, size) == 0) {
+        segment = mmap(nullptr, size, PROT_READ | PROT_WRITE, MAP_SHARED,
+                       fd, 0);
+    }
+    int error = errno;
+    close(fd);
+    if (segment == MAP_FAILED) {
+        log_loader("Could not map shared memory \"%s\": %s", name,
+                   std::strerror(error));
+        shm_unlink(name);
+        return false;
+    }
+
+    name_ = name;
+    segment_ = static_cast<uint8_t*>(segment);
+    segment_size_ = size;
+    // ftruncate() zero-fills, so the sequence starts at 0 and no
+    // configurations are published
+    header_ = reinterpret_cast<header*>(segment_);
+    std::memcpy(header_->magic, SHM_MAGIC, sizeof(SHM_MAGIC));
+    header_->version = SHM_VERSION;
+    header_->header_size = sizeof(header);
+    header_->directory_offset = directory_offset;
+    header_->channel_count = channel_count;
+    header_->values_offset = values_offset;
+    header_->values_size = values_size;
+    header_->configuration_offset = configuration_offset;
+    header_->configuration_capacity = CONFIGURATION_CAPACITY;
+    std::memcpy(segment_ + directory_offset, directory, directory_size);
+    sequence_ = reinterpret_cast<std::atomic<uint64_t>*>(&header_->sequence);
+    std::memset(&frame_start_, 0, sizeof(frame_start_));
+    log_loader("Publishing telemetry to shared memory \"%s\"", name);
+    return true;
+}
+
+void stop() {
+    if (segment_ == nullptr) {
+        return;
+    }
+    munmap(segment_, segment_size_);
+    shm_unlink(name_.c_str());
+    segment_ = nullptr;
+    segment_size_ = 0;
+    header_ = nullptr;
+    sequence_ = nullptr;
+    configurations_.clear();
+    configurations_changed_ = false;
+    log_loader("Shared memory publishing stopped");
+}
+
+bool active() {
+    return segment_ != nullptr;
+}
+
+void set_frame_start(const scs_telemetry_frame_start_t *frame_start) {
+    frame_start_ = *frame_start;
+}
+
+void set_configuration(const scs_telemetry_configuration_t *config) {
+    std::vector<uint8_t> buf;
+    put_string(buf, config->id);
+    size_t count_offset = buf.size();
+    uint32_t count = 0;
+    put(buf, count);
+    for (const scs_named_value_t *attr = config->attributes;
+         attr->name != nullptr; ++attr) {
+        put_string(buf, attr->name);
+        put(buf, static_cast<uint32_t>(attr->index));
+        put(buf, static_cast<uint32_t>(attr->value.type));
+        put_value(buf, attr->value);
+        ++count;
+    }
+    std::memcpy(&buf[count_offset], &count, sizeof(count));
+
+    for (auto &configuration : configurations_) {
+        if (configuration.first == config->id) {
+            if (configuration.second != buf) {
+                configuration.second = std::move(buf);
+                configurations_changed_ = true;
+            }
+            return;
+        }
+    }
+    configurations_.emplace_back(config->id, std::move(buf));
+    configurations_changed_ = true;
+}
+
+static void write_configurations() {
+    uint8_t *area = segment_ + header_->configuration_offset;
+    size_t used = 2 * sizeof(uint32_t);
+    uint32_t count = 0;
+    for (const auto &configuration : configurations_) {
+        const std::vector<uint8_t> &buf = configuration.second;
+        if (used + buf.size() > CONFIGURATION_CAPACITY) {
+            continue;
+        }
+        std::memcpy(area + used, buf.data(), buf.size());
+        used += buf.size();
+        ++count;
+    }
+    uint32_t used_u32 = used;
+    std::memcpy(area, &used_u32, sizeof(used_u32));
+    std::memcpy(area + sizeof(used_u32), &count, sizeof(count));
+}
+
+void publish(const void *values) {
+    uint64_t sequence = sequence_->load(std::memory_order_relaxed);
+    sequence_->store(sequence + 1, std::memory_order_relaxed);
+    // Keeps the writes below after the odd sequence
+    std::atomic_thread_fence(std::memory_order_release);
+    ++header_->frames;
+    header_->render_time = frame_start_.render_time;
+    header_->simulation_time = frame_start_.simulation_time;
+    header_->paused_simulation_time = frame_start_.paused_simulation_time;
+    std::memcpy(segment_ + header_->values_offset, values, header_->values_size);
+    if (configurations_changed_) {
+        write_configurations();
+        configurations_changed_ = false;
+    }
+    sequence_->store(sequence + 2, std::memory_order_release);
+}
+
+}
@@ -0,0 +1,87 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+// Publishing of the latest telemetry to POSIX shared memory, for readers
+// in other processes, see python/pyets2lib/shm_reader.py
+//
+// The segment is updated once per frame, at frame end, under a seqlock:
+// the sequence is odd while an update is in progress. Readers copy what
+// they need and retry if the sequence was odd or changed meanwhile. All
+// numbers are in native byte order. Strings are as in recording.hpp.
+//
+// Header:
+//   char[8] magic SHM_MAGIC
+//   u32 format version SHM_VERSION
+//   u32 header size
+//   u64 sequence
+//   u64 number of published frames
+//   u64 render_time, u64 simulation_time, u64 paused_simulation_time
+//     of the latest frame_start
+//   u32 directory offset, u32 channel count
+//   u32 values offset, u32 values size
+//   u32 configuration offset, u32 configuration capacity
+//
+// Directory, written once:
+//   u32 value offset in values, u32 index count, u32 value type,
+//   string name
+//   The values of a channel are index count slots of one valid byte
+//   followed by the raw value, like in pyets2lib.store.
+//
+// Configuration, the latest configuration event per id:
+//   u32 used size, u32 configuration count, configurations of
+//   string id, u32 attribute count, attributes of string name,
+//   u32 index, u32 value type, value
+//   Configurations that do not fit in the capacity are left out.
+
+#ifndef _SHM_HPP_
+#define _SHM_HPP_
+
+#include <cstddef>
+#include <cstdint>
+
+#include "scssdk_telemetry.h"
+
+namespace shm {
+
+static const char SHM_MAGIC[8] = {'P', 'Y', 'E', 'T', 'S', '2', 'S', 'M'};
+static const uint32_t SHM_VERSION = 1;
+static const size_t CONFIGURATION_CAPACITY = 64 * 1024;
+
+// Creates the segment name, e.g. "/pyets2_telemetry", replacing any
+// existing one. directory holds channel_count directory entries and
+// values_size is the size of the values copied by publish(). Returns
+// false if the segment cannot be created.
+bool start(const char *name, const void *directory, size_t directory_size,
+           uint32_t channel_count, size_t values_size);
+
+// Unmaps and removes the segment
+void stop();
+
+bool active();
+
+void set_frame_start(const scs_telemetry_frame_start_t *frame_start);
+
+void set_configuration(const scs_telemetry_configuration_t *config);
+
+// Copies values and any changed configuration to the segment
+void publish(const void *values);
+
+}
+
+#endif
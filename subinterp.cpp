@@ -0,0 +1,528 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+#include <atomic>
+#include <condition_variable>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <utility>
+#include <vector>
+
+#include "log.hpp"
+#include "pyhelp.hpp"
+#include "subinterp.hpp"
+
+namespace subinterp {
+
+// Records a host can fall behind by. Further records are dropped until
+// the host has caught up.
+static const size_t MAX_RECORDS = 65536;
+
+struct record {
+    bool is_event;
+    // Channel key, or the event
+    uint32_t key;
+    bool has_value;
+    scs_value_t value;
+    // Copy of a string value, as value only points to it during the SCS
+    // callback
+    std::string string_value;
+};
+
+struct host {
+    size_t index;
+    std::string plugin;
+    std::thread thread;
+    std::mutex mutex;
+    // Wakes the host at frame end or when stopping
+    std::condition_variable wake;
+    // Wakes start() when telemetry_init() of the plug-in has returned
+    std::condition_variable ready;
+    // Records queued by the game thread. Only the first record_count are
+    // valid, the rest are kept, so their strings are reused.
+    std::vector<record> records;
+    size_t record_count = 0;
+    // Records taken by the host, swapped with records
+    std::vector<record> taken;
+    size_t taken_count = 0;
+    bool frame_ended = false;
+    bool stopping = false;
+    bool started = false;
+    bool init_ok = false;
+    std::string error;
+    uint64_t queued = 0;
+    uint64_t dropped = 0;
+    // Host thread only
+    uint32_t next_key = 0;
+};
+
+// State of the _telemetry_isolated module of a subinterpreter
+struct module_state {
+    host *owner;
+};
+
+static std::vector<std::unique_ptr<host>> hosts_;
+static std::mutex requests_mutex_;
+static std::vector<request> requests_;
+static std::atomic<bool> have_requests_(false);
+
+bool supported() {
+    return PY_VERSION_HEX >= 0x030C0000;
+}
+
+// Returns the host of the subinterpreter of the _telemetry_isolated
+// module, or nullptr with an exception set
+static host *get_owner(PyObject *py_module) {
+    module_state *state = static_cast<module_state*>(PyModule_GetState(py_module));
+    if (state == nullptr || state->owner == nullptr) {
+        PyErr_SetString(PyExc_RuntimeError, "Not in an isolated plug-in");
+        return nullptr;
+    }
+    return state->owner;
+}
+
+static void queue_request(request &&req) {
+    std::lock_guard<std::mutex> lock(requests_mutex_);
+    requests_.push_back(std::move(req));
+    have_requests_ = true;
+}
+
+// Creates a plain Python value, as the pyets2lib.scsdefs value types of
+// the main interpreter cannot be shared
+static PyObject *py_value(const record &rec) {
+    if (!rec.has_value) {
+        Py_RETURN_NONE;
+    }
+    const scs_value_t &value = rec.value;
+    switch (value.type) {
+        case SCS_VALUE_TYPE_bool:
+            return PyBool_FromLong(value.value_bool.value);
+        case SCS_VALUE_TYPE_s32:
+            return PyLong_FromLong(value.value_s32.value);
+        case SCS_VALUE_TYPE_u32:
+            return PyLong_FromUnsignedLong(value.value_u32.value);
+        case SCS_VALUE_TYPE_u64:
+            return PyLong_FromUnsignedLongLong(value.value_u64.value);
+        case SCS_VALUE_TYPE_s64:
+            return PyLong_FromLongLong(value.value_s64.value);
+        case SCS_VALUE_TYPE_float:
+            return PyFloat_FromDouble(value.value_float.value);
+        case SCS_VALUE_TYPE_double:
+            return PyFloat_FromDouble(value.value_double.value);
+        case SCS_VALUE_TYPE_fvector:
+            return Py_BuildValue("(fff)", value.value_fvector.x,
+                                 value.value_fvector.y, value.value_fvector.z);
+        case SCS_VALUE_TYPE_dvector:
+            return Py_BuildValue("(ddd)", value.value_dvector.x,
+                                 value.value_dvector.y, value.value_dvector.z);
+        case SCS_VALUE_TYPE_euler:
+            return Py_BuildValue("(fff)", value.value_euler.heading,
+                                 value.value_euler.pitch, value.value_euler.roll);
+        case SCS_VALUE_TYPE_fplacement: {
+            const scs_value_fplacement_t &placement = value.value_fplacement;
+            return Py_BuildValue("((fff)(fff))", placement.position.x,
+                                 placement.position.y, placement.position.z,
+                                 placement.orientation.heading,
+                                 placement.orientation.pitch,
+                                 placement.orientation.roll);
+        }
+        case SCS_VALUE_TYPE_dplacement: {
+            const scs_value_dplacement_t &placement = value.value_dplacement;
+            return Py_BuildValue("((ddd)(fff))", placement.position.x,
+                                 placement.position.y, placement.position.z,
+                                 placement.orientation.heading,
+                                 placement.orientation.pitch,
+                                 placement.orientation.roll);
+        }
+        case SCS_VALUE_TYPE_string:
+            return PyUnicode_FromString(rec.string_value.c_str());
+        default:
+            Py_RETURN_NONE;
+    }
+}
+
+// _telemetry_isolated functions, called on the host thread
+
+static PyObject *log(PyObject *py_module, PyObject *arg) {
+    const char *message = PyUnicode_AsUTF8(arg);
+    if (message == nullptr) {
+        return nullptr;
+    }
+    log_py(message);
+    Py_RETURN_NONE;
+}
+
+static PyObject *register_for_channel(PyObject *py_module, PyObject *args) {
+    host *owner = get_owner(py_module);
+    if (owner == nullptr) {
+        return nullptr;
+    }
+    const char *name;
+    scs_u32_t index;
+    scs_value_type_t type;
+    if (!PyArg_ParseTuple(args, "sII", &name, &index, &type)) {
+        return nullptr;
+    }
+    request req;
+    req.host = owner->index;
+    req.is_event = false;
+    req.key = owner->next_key++;
+    req.name = name;
+    req.index = index;
+    req.type = type;
+    req.event = SCS_TELEMETRY_EVENT_invalid;
+    uint32_t key = req.key;
+    queue_request(std::move(req));
+    return PyLong_FromUnsignedLong(key);
+}
+
+static PyObject *register_for_event(PyObject *py_module, PyObject *args) {
+    host *owner = get_owner(py_module);
+    if (owner == nullptr) {
+        return nullptr;
+    }
+    scs_event_t event;
+    if (!PyArg_ParseTuple(args, "I", &event)) {
+        return nullptr;
+    }
+    // The other events have event info, which is not copied
+    if (event != SCS_TELEMETRY_EVENT_frame_start &&
+        event != SCS_TELEMETRY_EVENT_frame_end &&
+        event != SCS_TELEMETRY_EVENT_paused &&
+        event != SCS_TELEMETRY_EVENT_started) {
+        PyErr_Format(PyExc_ValueError,
+                     "Event %u is not available to isolated plug-ins", event);
+        return nullptr;
+    }
+    request req;
+    req.host = owner->index;
+    req.is_event = true;
+    req.key = 0;
+    req.index = SCS_U32_NIL;
+    req.type = SCS_VALUE_TYPE_INVALID;
+    req.event = event;
+    queue_request(std::move(req));
+    Py_RETURN_NONE;
+}
+
+static PyObject *wait(PyObject *py_module, PyObject *args) {
+    host *owner = get_owner(py_module);
+    if (owner == nullptr) {
+        return nullptr;
+    }
+    bool stopping;
+    Py_BEGIN_ALLOW_THREADS
+    {
+        std::unique_lock<std::mutex> lock(owner->mutex);
+        owner->wake.wait(lock, [owner] {
+            return owner->frame_ended || owner->stopping;
+        });
+        std::swap(owner->records, owner->taken);
+        owner->taken_count = owner->record_count;
+        owner->record_count = 0;
+        owner->frame_ended = false;
+        stopping = owner->stopping;
+    }
+    Py_END_ALLOW_THREADS
+    if (stopping && owner->taken_count == 0) {
+        Py_RETURN_NONE;
+    }
+    pyhelp::PyObjRef py_records(pyhelp::PyObjRef::steal(
+        PyList_New(owner->taken_count)));
+    if (py_records.get() == nullptr) {
+        return nullptr;
+    }
+    for (size_t i = 0; i < owner->taken_count; ++i) {
+        const record &rec = owner->taken[i];
+        PyObject *py_record = Py_BuildValue("(NIN)", PyBool_FromLong(rec.is_event),
+                                            rec.key, py_value(rec));
+        if (py_record == nullptr) {
+            return nullptr;
+        }
+        PyList_SET_ITEM(py_records.get(), i, py_record);
+    }
+    return py_records.release();
+}
+
+static PyMethodDef methods[] = {
+    {"log", log, METH_O,
+     "Log a message to ETS2 developer console."},
+    {"register_for_channel", register_for_channel, METH_VARARGS,
+     "Requests the values of specified telemetry channel and returns the key they are delivered with."},
+    {"register_for_event", register_for_event, METH_VARARGS,
+     "Requests specified event, which must not have event info."},
+    {"wait", wait, METH_NOARGS,
+     "Waits for the end of a frame and returns the records queued since, or None when stopping."},
+    {NULL, NULL, 0, NULL}
+};
+
+static PyModuleDef_Slot slots[] = {
+#if PY_VERSION_HEX >= 0x030C0000
+    {Py_mod_multiple_interpreters, Py_MOD_PER_INTERPRETER_GIL_SUPPORTED},
+#endif
+    {0, NULL}
+};
+
+static PyModuleDef module = {
+    PyModuleDef_HEAD_INIT, "_telemetry_isolated", NULL, sizeof(module_state),
+    methods, slots, NULL, NULL, NULL
+};
+
+PyObject *create_module() {
+    return PyModuleDef_Init(&module);
+}
+
+// Host thread
+
+// Creates the subinterpreter and makes it current. The GIL of the main
+// interpreter must be held, and is released if the subinterpreter gets
+// its own. Returns nullptr and sets error on failure.
+static PyThreadState *new_interpreter(std::string &error) {
+    PyThreadState *state = nullptr;
+#if PY_VERSION_HEX >= 0x030C0000
+    PyInterpreterConfig config = {};
+    config.use_main_obmalloc = 0;
+    config.allow_fork = 0;
+    config.allow_exec = 0;
+    config.allow_threads = 1;
+    config.allow_daemon_threads = 0;
+    // Refuse extension modules without support for subinterpreters
+    config.check_multi_interp_extensions = 1;
+    config.gil = PyInterpreterConfig_OWN_GIL;
+    PyStatus status = Py_NewInterpreterFromConfig(&state, &config);
+    if (PyStatus_Exception(status)) {
+        error = status.err_msg != nullptr ? status.err_msg :
+            "Could not create subinterpreter";
+        return nullptr;
+    }
+#else
+    state = Py_NewInterpreter();
+    if (state == nullptr) {
+        error = "Could not create subinterpreter";
+    }
+#endif
+    return state;
+}
+
+// Imports pyets2lib.isolated and runs telemetry_init() of the plug-in.
+// The GIL of the subinterpreter must be held.
+static pyhelp::PyObjRef init_plugin(host *owner, scs_u32_t version,
+                                    const std::string &game_name,
+                                    const std::string &game_id,
+                                    scs_u32_t game_version) {
+    pyhelp::PyObjRef py_module(pyhelp::PyObjRef::steal(
+        PyImport_ImportModule("_telemetry_isolated")));
+    if (py_module.get() == nullptr) {
+        pyhelp::log_and_clear_py_err();
+        return pyhelp::PyObjRef();
+    }
+    static_cast<module_state*>(PyModule_GetState(py_module.get()))->owner = owner;
+    pyhelp::PyObjRef py_isolated(pyhelp::PyObjRef::steal(
+        PyImport_ImportModule("pyets2lib.isolated")));
+    if (py_isolated.get() == nullptr) {
+        pyhelp::log_and_clear_py_err();
+        return pyhelp::PyObjRef();
+    }
+    pyhelp::PyObjRef py_ret(pyhelp::PyObjRef::steal(
+        PyObject_CallMethod(py_isolated.get(), "init", "sIssI",
+                            owner->plugin.c_str(), version, game_name.c_str(),
+                            game_id.c_str(), game_version)));
+    if (py_ret.get() == nullptr) {
+        pyhelp::log_and_clear_py_err();
+        return pyhelp::PyObjRef();
+    }
+    return py_isolated;
+}
+
+static void run_host(host *owner, scs_u32_t version, std::string game_name,
+                     std::string game_id, scs_u32_t game_version) {
+    PyThreadState *main_state = PyThreadState_New(PyInterpreterState_Main());
+    PyEval_RestoreThread(main_state);
+    PyThreadState *state = new_interpreter(owner->error);
+    if (state != nullptr) {
+        { // Make sure no pyhelp::PyObjRef ref counting happens after Py_EndInterpreter()
+            pyhelp::PyObjRef py_isolated(init_plugin(owner, version, game_name,
+                                                     game_id, game_version));
+            bool init_ok = py_isolated.get() != nullptr;
+            if (!init_ok) {
+                owner->error = "telemetry_init() failed in subinterpreter";
+            }
+            {
+                std::lock_guard<std::mutex> lock(owner->mutex);
+                owner->started = true;
+                owner->init_ok = init_ok;
+            }
+            owner->ready.notify_one();
+            if (init_ok) {
+                // Returns when stopping
+                pyhelp::PyObjRef py_ret(pyhelp::PyObjRef::steal(
+                    PyObject_CallMethod(py_isolated.get(), "run", nullptr)));
+                if (py_ret.get() == nullptr) {
+                    pyhelp::log_and_clear_py_err();
+                }
+            }
+        }
+        Py_EndInterpreter(state);
+        PyThreadState_Swap(main_state);
+    } else {
+        std::lock_guard<std::mutex> lock(owner->mutex);
+        owner->started = true;
+        owner->ready.notify_one();
+    }
+    PyThreadState_Clear(main_state);
+    PyThreadState_DeleteCurrent();
+}
+
+// Game thread
+
+ssize_t start(const std::string &plugin, scs_u32_t version,
+              const char *game_name, const char *game_id,
+              scs_u32_t game_version, std::string &error) {
+    if (!supported()) {
+        error = "Subinterpreters with their own GIL require Python 3.12";
+        return -1;
+    }
+    std::unique_ptr<host> owner(new host());
+    owner->index = hosts_.size();
+    owner->plugin = plugin;
+    owner->thread = std::thread(run_host, owner.get(), version,
+                                std::string(game_name), std::string(game_id),
+                                game_version);
+    bool init_ok;
+    {
+        std::unique_lock<std::mutex> lock(owner->mutex);
+        host *waited = owner.get();
+        owner->ready.wait(lock, [waited] { return waited->started; });
+        init_ok = owner->init_ok;
+    }
+    if (!init_ok) {
+        owner->thread.join();
+        error = owner->error;
+        // Drop the registrations made before the failure
+        std::lock_guard<std::mutex> lock(requests_mutex_);
+        for (size_t i = requests_.size(); i-- > 0;) {
+            if (requests_[i].host == owner->index) {
+                requests_.erase(requests_.begin() + i);
+            }
+        }
+        have_requests_ = !requests_.empty();
+        return -1;
+    }
+    hosts_.push_back(std::move(owner));
+    return hosts_.size() - 1;
+}
+
+void stop() {
+    for (auto &owner : hosts_) {
+        {
+            std::lock_guard<std::mutex> lock(owner->mutex);
+            owner->stopping = true;
+        }
+        owner->wake.notify_one();
+    }
+    for (auto &owner : hosts_) {
+        owner->thread.join();
+    }
+    hosts_.clear();
+    std::lock_guard<std::mutex> lock(requests_mutex_);
+    requests_.clear();
+    have_requests_ = false;
+}
+
+bool have_requests() {
+    return have_requests_;
+}
+
+void take_requests(std::vector<request> &requests) {
+    std::lock_guard<std::mutex> lock(requests_mutex_);
+    for (request &req : requests_) {
+        requests.push_back(std::move(req));
+    }
+    requests_.clear();
+    have_requests_ = false;
+}
+
+// Returns the next free record of the host, or nullptr if it is full.
+// The mutex of the host must be locked.
+static record *next_record(host &owner) {
+    if (owner.record_count == MAX_RECORDS) {
+        ++owner.dropped;
+        return nullptr;
+    }
+    if (owner.record_count == owner.records.size()) {
+        owner.records.emplace_back();
+    }
+    ++owner.queued;
+    return &owner.records[owner.record_count++];
+}
+
+void push_channel(size_t host_index, uint32_t key, const scs_value_t *value) {
+    host &owner = *hosts_[host_index];
+    std::lock_guard<std::mutex> lock(owner.mutex);
+    record *rec = next_record(owner);
+    if (rec == nullptr) {
+        return;
+    }
+    rec->is_event = false;
+    rec->key = key;
+    rec->has_value = value != nullptr;
+    if (value != nullptr) {
+        rec->value = *value;
+        if (value->type == SCS_VALUE_TYPE_string) {
+            rec->string_value = value->value_string.value;
+            rec->value.value_string.value = nullptr;
+        }
+    }
+}
+
+void push_event(size_t host_index, scs_event_t event) {
+    host &owner = *hosts_[host_index];
+    std::lock_guard<std::mutex> lock(owner.mutex);
+    record *rec = next_record(owner);
+    if (rec == nullptr) {
+        return;
+    }
+    rec->is_event = true;
+    rec->key = event;
+    rec->has_value = false;
+}
+
+void notify() {
+    for (auto &owner : hosts_) {
+        {
+            std::lock_guard<std::mutex> lock(owner->mutex);
+            owner->frame_ended = true;
+        }
+        owner->wake.notify_one();
+    }
+}
+
+counters get_counters() {
+    counters result = {hosts_.size(), 0, 0};
+    for (auto &owner : hosts_) {
+        std::lock_guard<std::mutex> lock(owner->mutex);
+        result.queued += owner->queued;
+        result.dropped += owner->dropped;
+    }
+    return result;
+}
+
+}
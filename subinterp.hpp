@@ -0,0 +1,98 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+// Plug-ins running in their own subinterpreter, with their own GIL
+// (PEP 684, Python 3.12+).
+//
+// Each isolated plug-in gets a host thread, which creates the
+// subinterpreter and runs the plug-in in it, see pyets2lib.isolated. The
+// game thread copies the values of the channels and events that the
+// plug-in registered for into a queue of the host, without taking any
+// GIL, and wakes the host at frame end. The callbacks of isolated
+// plug-ins thereby run in parallel with the game and with each other.
+
+#ifndef _SUBINTERP_HPP_
+#define _SUBINTERP_HPP_
+
+#include <cstdint>
+#include <string>
+#include <vector>
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include "scssdk_telemetry.h"
+
+namespace subinterp {
+
+// A registration made by an isolated plug-in. The loader applies it on
+// the game thread and copies the values to the host with push_channel()
+// or push_event().
+struct request {
+    size_t host;
+    bool is_event;
+    // Key assigned by the host to the channel
+    uint32_t key;
+    std::string name;
+    scs_u32_t index;
+    scs_value_type_t type;
+    scs_event_t event;
+};
+
+struct counters {
+    size_t hosts;
+    uint64_t queued;
+    // Records discarded because a host did not keep up
+    uint64_t dropped;
+};
+
+// True if the Python version has a GIL per interpreter
+bool supported();
+
+// Game thread, with the GIL released. Runs the telemetry_init() of the
+// plug-in package in a new subinterpreter and waits for it to return.
+// Returns the host index, or -1 and sets error.
+ssize_t start(const std::string &plugin, scs_u32_t version,
+              const char *game_name, const char *game_id,
+              scs_u32_t game_version, std::string &error);
+
+// Game thread, with the GIL released. Calls telemetry_shutdown() of the
+// isolated plug-ins and ends their subinterpreters.
+void stop();
+
+// Game thread. True if a host has made registrations since the last
+// take_requests().
+bool have_requests();
+void take_requests(std::vector<request> &requests);
+
+// Game thread. Queues a channel value or an event for a host.
+// value may be nullptr.
+void push_channel(size_t host, uint32_t key, const scs_value_t *value);
+void push_event(size_t host, scs_event_t event);
+
+// Game thread. Wakes the hosts, once per frame.
+void notify();
+
+counters get_counters();
+
+// Creates the _telemetry_isolated module, for PyImport_AppendInittab()
+PyObject *create_module();
+
+}
+
+#endif
@@ -17,7 +17,12 @@
 // along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
 //
 
+#include <cstdlib>
+#include <cstring>
 #include <iostream>
+#include <map>
+#include <string>
+#include <utility>
 
 #include <unistd.h>
 
@@ -27,22 +32,50 @@
 #include "amtrucks/scssdk_ats.h"
 #include "amtrucks/scssdk_telemetry_ats.h"
 
+// Test mode, see run_test()
+static std::string test_name_;
+static bool test_passed_ = false;
+static bool test_failed_ = false;
+
 //static SCSAPI_VOID_FPTR
 static void log(const scs_log_type_t type, const scs_string_t message) {
     std::cout << "LOG: " << message << std::endl;
+    if (!test_name_.empty() &&
+        std::strstr(message, (test_name_ + " test passed").c_str()) != nullptr) {
+        test_passed_ = true;
+    }
 }
 
+static void fail(const std::string &message) {
+    std::cout << test_name_ << " test FAILED: " << message << std::endl;
+    test_failed_ = true;
+}
+
+// All channels registered by the loader, for the test modes
+struct channel_registration {
+    scs_value_type_t type;
+    scs_telemetry_channel_callback_t callback;
+    scs_context_t context;
+};
+static std::map<std::pair<std::string, scs_u32_t>, channel_registration> channels_;
+// Channel for which unregister_from_channel() fails, like the game could
+static std::string unregister_failing_;
+
 static std::string channel_cb_name_;
 static scs_u32_t channel_cb_index_;
 static scs_value_type_t channel_cb_type_;
 static scs_telemetry_channel_callback_t channel_cb_callback_;
 static scs_context_t channel_cb_context_;
 
-static scs_event_t event_cb_event_;
-static scs_telemetry_event_callback_t event_cb_callback_;
-static scs_context_t event_cb_context_;
+static scs_telemetry_event_callback_t event_cb_callbacks_[SCS_TELEMETRY_EVENT_gameplay + 1];
+static scs_context_t event_cb_contexts_[SCS_TELEMETRY_EVENT_gameplay + 1];
 
 static SCSAPI_RESULT register_for_channel(const scs_string_t name, const scs_u32_t index, const scs_value_type_t type, const scs_u32_t flags, const scs_telemetry_channel_callback_t callback, const scs_context_t context) {
+    auto key = std::make_pair(std::string(name), index);
+    if (channels_.count(key) != 0) {
+        return SCS_RESULT_already_registered;
+    }
+    channels_[key] = {type, callback, context};
     if (type != SCS_VALUE_TYPE_u32) {
         return 0;
     }
@@ -55,16 +88,53 @@ static SCSAPI_RESULT register_for_channel(const scs_string_t name, const scs_u32
 }
 
 static SCSAPI_RESULT register_for_event(const scs_event_t event, const scs_telemetry_event_callback_t callback, const scs_context_t context) {
-    if (event != SCS_TELEMETRY_EVENT_configuration) {
-        return 0;
+    if (event > SCS_TELEMETRY_EVENT_gameplay) {
+        return SCS_RESULT_unsupported;
+    }
+    if (event_cb_callbacks_[event] != nullptr) {
+        return SCS_RESULT_already_registered;
     }
-    event_cb_event_ = event;
-    event_cb_callback_ = callback;
-    event_cb_context_ = context;
+    event_cb_callbacks_[event] = callback;
+    event_cb_contexts_[event] = context;
     return 0;
 }
 
-static void load() {
+static SCSAPI_RESULT unregister_from_channel(const scs_string_t name, const scs_u32_t index, const scs_value_type_t type) {
+    if (unregister_failing_ == name) {
+        return SCS_RESULT_generic_error;
+    }
+    if (channels_.erase(std::make_pair(std::string(name), index)) == 0) {
+        return SCS_RESULT_not_found;
+    }
+    if (channel_cb_callback_ != nullptr && channel_cb_name_ == name &&
+        channel_cb_index_ == index) {
+        channel_cb_callback_ = nullptr;
+    }
+    return 0;
+}
+
+static SCSAPI_RESULT unregister_from_event(const scs_event_t event) {
+    if (event > SCS_TELEMETRY_EVENT_gameplay || event_cb_callbacks_[event] == nullptr) {
+        return SCS_RESULT_not_found;
+    }
+    event_cb_callbacks_[event] = nullptr;
+    return 0;
+}
+
+static void call_event(const scs_event_t event, const void *event_info) {
+    if (event_cb_callbacks_[event] != nullptr) {
+        event_cb_callbacks_[event](event, event_info, event_cb_contexts_[event]);
+    }
+}
+
+static SCSAPI_RESULT init() {
+    channels_.clear();
+    unregister_failing_.clear();
+    channel_cb_callback_ = nullptr;
+    for (auto &callback : event_cb_callbacks_) {
+        callback = nullptr;
+    }
+
     scs_telemetry_init_params_v100_t params;
     params.common.game_name = "game";
     params.common.game_id = "id";
@@ -72,7 +142,49 @@ static void load() {
     params.common.log = log;
     params.register_for_channel = register_for_channel;
     params.register_for_event = register_for_event;
-    SCSAPI_RESULT result = scs_telemetry_init(SCS_TELEMETRY_VERSION_1_01, &params);
+    params.unregister_from_channel = unregister_from_channel;
+    params.unregister_from_event = unregister_from_event;
+    return scs_telemetry_init(SCS_TELEMETRY_VERSION_1_01, &params);
+}
+
+static void call_frame_start(scs_u64_t time) {
+    scs_telemetry_frame_start_t frame_start;
+    frame_start.flags = 0;
+    frame_start.render_time = time;
+    frame_start.simulation_time = time;
+    frame_start.paused_simulation_time = 0;
+    call_event(SCS_TELEMETRY_EVENT_frame_start, &frame_start);
+}
+
+// Calls the channel like the game, if the loader registered it. Returns
+// false if it did not.
+static bool call_channel(const char *name, scs_u32_t index,
+                         const scs_value_t &value) {
+    auto it = channels_.find(std::make_pair(std::string(name), index));
+    if (it == channels_.end()) {
+        return false;
+    }
+    it->second.callback(name, index, &value, it->second.context);
+    return true;
+}
+
+static scs_value_t u32_value(scs_u32_t u32) {
+    scs_value_t value;
+    value.type = SCS_VALUE_TYPE_u32;
+    value.value_u32.value = u32;
+    return value;
+}
+
+static void load() {
+    SCSAPI_RESULT result = init();
+
+    scs_telemetry_frame_start_t frame_start;
+    frame_start.flags = SCS_TELEMETRY_FRAME_START_FLAG_timer_restart;
+    frame_start.render_time = 0;
+    frame_start.simulation_time = 0;
+    frame_start.paused_simulation_time = 0;
+    std::cout << "Calling frame start" << std::endl;
+    call_event(SCS_TELEMETRY_EVENT_frame_start, &frame_start);
 
     if (channel_cb_callback_ != nullptr) {
         if (channel_cb_type_ == SCS_VALUE_TYPE_u32) {
@@ -85,8 +197,11 @@ static void load() {
         }
     }
 
-    if (event_cb_callback_ != nullptr) {
-        if (event_cb_event_ == SCS_TELEMETRY_EVENT_configuration) {
+    std::cout << "Calling frame end" << std::endl;
+    call_event(SCS_TELEMETRY_EVENT_frame_end, nullptr);
+
+    if (event_cb_callbacks_[SCS_TELEMETRY_EVENT_configuration] != nullptr) {
+        {
             std::cout << "Calling event callback" << std::endl;
             scs_telemetry_configuration_t config;
             config.id = "config";
@@ -102,8 +217,8 @@ static void load() {
             attributes[1].value.value_float.value = 6.3;
             attributes[2].name = nullptr;
             void *event_info = static_cast<void*>(&config);
-            event_cb_callback_(event_cb_event_, event_info, event_cb_context_);
-            event_cb_callback_(event_cb_event_, event_info, event_cb_context_);
+            call_event(SCS_TELEMETRY_EVENT_configuration, event_info);
+            call_event(SCS_TELEMETRY_EVENT_configuration, event_info);
         }
     }
     
@@ -114,7 +229,185 @@ static void load() {
     }
 }
 
+// Test modes. Each runs the plug-ins in tests/plugins/python with
+// PYETS2_TEST set to its name. The plug-in of the test checks the
+// deliveries and logs "<name> test passed", the others do nothing.
+
+// pyets2_test_frameclock
+static void run_frameclock() {
+    // The value is sampled in the first frame, and deferred to the second
+    call_frame_start(1000);
+    // SCS_TELEMETRY_TRUCK_CHANNEL_retarder_level
+    if (!call_channel("truck.brake.retarder", SCS_U32_NIL, u32_value(1))) {
+        fail("channel not registered");
+    }
+    call_event(SCS_TELEMETRY_EVENT_frame_end, nullptr);
+    call_frame_start(2000);
+    call_event(SCS_TELEMETRY_EVENT_frame_end, nullptr);
+}
+
+static scs_value_t float_value(float value_float) {
+    scs_value_t value;
+    value.type = SCS_VALUE_TYPE_float;
+    value.value_float.value = value_float;
+    return value;
+}
+
+// pyets2_test_filters
+static void run_filters() {
+    const scs_u32_t retarder[] = {1, 1, 2, 2, 2, 3};
+    const float speed[] = {10.0f, 10.5f, 11.5f, 12.6f, 13.0f, 13.0f};
+    for (scs_u32_t frame = 1; frame <= 6; ++frame) {
+        call_frame_start(frame * 50000);
+        // SCS_TELEMETRY_TRUCK_CHANNEL_retarder_level, _speed and _engine_rpm
+        if (!call_channel("truck.brake.retarder", SCS_U32_NIL, u32_value(retarder[frame - 1])) ||
+            !call_channel("truck.speed", SCS_U32_NIL, float_value(speed[frame - 1])) ||
+            !call_channel("truck.engine.rpm", SCS_U32_NIL, float_value(1000.0f + frame))) {
+            fail("channel not registered");
+        }
+        call_event(SCS_TELEMETRY_EVENT_frame_end, nullptr);
+    }
+}
+
+// pyets2_test_framesinks
+static void run_framesinks() {
+    for (scs_u32_t frame = 1; frame <= 2; ++frame) {
+        call_frame_start(frame * 1000);
+        // SCS_TELEMETRY_TRUCK_CHANNEL_retarder_level and _speed
+        if (!call_channel("truck.brake.retarder", SCS_U32_NIL, u32_value(frame)) ||
+            !call_channel("truck.speed", SCS_U32_NIL, float_value(frame * 10.0f))) {
+            fail("channel not registered");
+        }
+        call_event(SCS_TELEMETRY_EVENT_frame_end, nullptr);
+    }
+}
+
+// pyets2_test_derived
+static void run_derived() {
+    // The failed subscription to the fuel consumption must have released
+    // the fuel. SCS_TELEMETRY_TRUCK_CHANNEL_fuel
+    if (call_channel("truck.fuel.amount", SCS_U32_NIL, float_value(100.0f))) {
+        fail("fuel still registered");
+    }
+    const float odometer[] = {100.0f, 101.0f, 200.0f};
+    for (scs_u32_t frame = 1; frame <= 3; ++frame) {
+        call_frame_start(frame * 1000);
+        // SCS_TELEMETRY_TRUCK_CHANNEL_odometer
+        if (!call_channel("truck.odometer", SCS_U32_NIL, float_value(odometer[frame - 1]))) {
+            fail("channel not registered");
+        }
+        call_event(SCS_TELEMETRY_EVENT_frame_end, nullptr);
+    }
+}
+
+// Returns the registration of the channel, or nullptr
+static const channel_registration *find_channel(const char *name) {
+    auto it = channels_.find(std::make_pair(std::string(name), SCS_U32_NIL));
+    return it == channels_.end() ? nullptr : &it->second;
+}
+
+// pyets2_test_unregister
+static void run_unregister() {
+    // SCS_TELEMETRY_TRUCK_CHANNEL_retarder_level, _cruise_control and
+    // _engine_rpm, subscribed to in turn at frame end
+    const char *retarder = "truck.brake.retarder";
+    const char *cruise_control = "truck.cruise_control";
+    const char *rpm = "truck.engine.rpm";
+    call_frame_start(1000);
+    const channel_registration *registration = find_channel(retarder);
+    if (registration == nullptr) {
+        fail("channel not registered");
+        return;
+    }
+    scs_context_t retarder_context = registration->context;
+    call_channel(retarder, SCS_U32_NIL, u32_value(1));
+    call_event(SCS_TELEMETRY_EVENT_frame_end, nullptr);
+
+    call_frame_start(2000);
+    registration = find_channel(cruise_control);
+    if (find_channel(retarder) != nullptr || registration == nullptr) {
+        fail("channel not unregistered or not registered");
+        return;
+    }
+    if (registration->context != retarder_context) {
+        fail("released slot not reused");
+    }
+    call_channel(cruise_control, SCS_U32_NIL, float_value(2.0f));
+    unregister_failing_ = cruise_control;
+    call_event(SCS_TELEMETRY_EVENT_frame_end, nullptr);
+
+    call_frame_start(3000);
+    registration = find_channel(rpm);
+    if (registration == nullptr) {
+        fail("channel not registered");
+        return;
+    }
+    if (registration->context == find_channel(cruise_control)->context) {
+        fail("slot reused although still registered with the game");
+    }
+    // Still called by the game, as unregistering failed
+    call_channel(cruise_control, SCS_U32_NIL, float_value(3.0f));
+    call_channel(rpm, SCS_U32_NIL, float_value(4.0f));
+    call_event(SCS_TELEMETRY_EVENT_frame_end, nullptr);
+}
+
+// pyets2_test_scsdefs, which only needs telemetry_init()
+static void run_scsdefs() {
+}
+
+struct test_case {
+    const char *name;
+    void (*run)();
+};
+
+static const test_case TESTS[] = {
+    {"derived", run_derived},
+    {"filters", run_filters},
+    {"frameclock", run_frameclock},
+    {"framesinks", run_framesinks},
+    {"scsdefs", run_scsdefs},
+    {"unregister", run_unregister},
+};
+
+static bool run_test(const test_case &test) {
+    test_name_ = test.name;
+    test_passed_ = false;
+    test_failed_ = false;
+    setenv("PYETS2_TEST", test.name, 1);
+    if (init() != SCS_RESULT_ok) {
+        fail("init failed");
+        return false;
+    }
+    test.run();
+    scs_telemetry_shutdown();
+    bool passed = test_passed_ && !test_failed_;
+    std::cout << test.name << (passed ? " PASSED" : " FAILED") << std::endl;
+    return passed;
+}
+
+// Usage: test [all | <test name>]
 int main(int argc, char *argv[]) {
+    if (argc > 1) {
+        std::string test_dir = std::string(getenv("PWD")) + "/tests";
+        setenv("PWD", test_dir.c_str(), 1);
+        if (chdir(test_dir.c_str()) != 0) {
+            std::cerr << "Cannot enter " << test_dir << std::endl;
+            return 1;
+        }
+        bool found = false;
+        bool passed = true;
+        for (const test_case &test : TESTS) {
+            if (std::strcmp(argv[1], "all") == 0 ||
+                std::strcmp(argv[1], test.name) == 0) {
+                found = true;
+                passed = run_test(test) && passed;
+            }
+        }
+        if (!found) {
+            std::cerr << "Unknown test " << argv[1] << std::endl;
+        }
+        return found && passed ? 0 : 1;
+    }
     load();
     load();
     return 0;
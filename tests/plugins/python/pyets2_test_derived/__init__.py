@@ -0,0 +1,82 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Plug-in loaded by "test derived". Checks that a derived channel that is
+# subscribed to again starts from a new function state, and that a failed
+# subscription releases the inputs it had registered. The test binary
+# sends the odometer in three frames, and the plug-in subscribes again at
+# the start of the third.
+
+import os
+import pyets2lib.derived
+from pyets2lib.derived import DERIVED_CHANNEL_distance_km, DERIVED_CHANNEL_fuel_consumption
+from pyets2lib.scsdefs import *
+
+ACTIVE = os.environ.get('PYETS2_TEST') == 'derived'
+
+params_ = None
+frames_ = 0
+distances_ = []
+rolled_back_ = False
+
+def distance_cb(channel, index, value, context):
+    distances_.append(value)
+
+def frame_start_cb(event, event_info, context):
+    global frames_
+    frames_ += 1
+    if frames_ == 3:
+        params_.unregister_from_channel(DERIVED_CHANNEL_distance_km, distance_cb)
+        params_.register_for_channel(DERIVED_CHANNEL_distance_km, distance_cb)
+
+def subscribe_failing():
+    # Fails on the odometer, after the fuel has been registered
+    register_for_channel = pyets2lib.derived._telemetry.register_for_channel
+    def failing(name, *args):
+        if name == SCS_TELEMETRY_TRUCK_CHANNEL_odometer.name:
+            raise RuntimeError("failing test registration")
+        return register_for_channel(name, *args)
+    pyets2lib.derived._telemetry.register_for_channel = failing
+    try:
+        params_.register_for_channel(DERIVED_CHANNEL_fuel_consumption, distance_cb)
+    except RuntimeError:
+        return (not pyets2lib.derived.dependents_ and
+                not pyets2lib.derived.states_)
+    finally:
+        pyets2lib.derived._telemetry.register_for_channel = register_for_channel
+    return False
+
+def telemetry_init(version, params):
+    global params_, rolled_back_
+    if not ACTIVE:
+        return
+    params_ = params
+    rolled_back_ = subscribe_failing()
+    params.register_for_event(SCS_TELEMETRY_EVENT_frame_start, frame_start_cb)
+    params.register_for_channel(DERIVED_CHANNEL_distance_km, distance_cb)
+
+def telemetry_shutdown():
+    if not ACTIVE:
+        return
+    logger = params_.common.logger
+    if rolled_back_ and distances_ == [0.0, 1.0, 0.0]:
+        logger.info("derived test passed")
+    else:
+        logger.error("derived test FAILED: rolled back %s, distances %s" %
+                     (rolled_back_, distances_))
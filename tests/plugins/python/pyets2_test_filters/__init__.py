@@ -0,0 +1,74 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Plug-in loaded by "test filters". Checks the values delivered through an
+# on-change filter, a filter with both deadbands and a max_hz filter, and
+# the delivered and suppressed counters. The test binary sends the values
+# in six frames, 50 ms of render time apart.
+
+import os
+import pyets2lib.filters
+from pyets2lib.filters import ChannelFilter
+from pyets2lib.scsdefs import *
+
+ACTIVE = os.environ.get('PYETS2_TEST') == 'filters'
+
+# Filter and expected values by channel
+EXPECTED = {
+    SCS_TELEMETRY_TRUCK_CHANNEL_retarder_level:
+        (ChannelFilter(on_change=True), [1, 2, 3]),
+    # 12.6 exceeds the absolute deadband only
+    SCS_TELEMETRY_TRUCK_CHANNEL_speed:
+        (ChannelFilter(deadband=1.0, relative_deadband=0.1), [10.0, 11.5, 13.0]),
+    SCS_TELEMETRY_TRUCK_CHANNEL_engine_rpm:
+        (ChannelFilter(max_hz=10), [1001.0, 1003.0, 1005.0]),
+}
+
+params_ = None
+received_ = {}
+
+def channel_cb(channel, index, value, context):
+    received_.setdefault(channel, []).append(value)
+
+def telemetry_init(version, params):
+    global params_
+    if not ACTIVE:
+        return
+    params_ = params
+    for channel, (filter, values) in EXPECTED.items():
+        params.register_for_channel(channel, channel_cb, filter=filter)
+
+def telemetry_shutdown():
+    if not ACTIVE:
+        return
+    logger = params_.common.logger
+    failures = []
+    for channel, (filter, values) in EXPECTED.items():
+        if received_.get(channel) != values:
+            failures.append("%s: received %s" % (channel.name, received_.get(channel)))
+    counters = {stats.channel: (stats.delivered, stats.suppressed)
+                for stats in pyets2lib.filters.stats()}
+    for channel in EXPECTED:
+        if counters.get(channel) != (3, 3):
+            failures.append("%s: delivered, suppressed %s" %
+                            (channel.name, counters.get(channel)))
+    if failures:
+        logger.error("filters test FAILED: %s" % "; ".join(failures))
+    else:
+        logger.info("filters test passed")
@@ -0,0 +1,84 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Plug-in loaded by "test frameclock". Checks that a batched value that is
+# deferred over the frame time budget is delivered with the stamp of the
+# frame it was sampled in. The test binary sends a value in the first frame
+# only, and the critical listener uses up the budget of that frame. Also
+# checks the frame_start info, which is reused when not kept.
+
+import os
+import time
+import pyets2lib.loader
+from pyets2lib.scsdefs import *
+
+CHANNEL = SCS_TELEMETRY_TRUCK_CHANNEL_retarder_level
+ACTIVE = os.environ.get('PYETS2_TEST') == 'frameclock'
+
+params_ = None
+# (sequence, simulation_time) seen by the critical listener
+sampled_ = None
+# (sequence, simulation_time) seen by the frame sink, per call
+delivered_ = []
+# Fields of the frame_start info, and its ids
+frame_starts_ = []
+frame_start_ids_ = set()
+
+def frame_start_cb(event, event_info, context):
+    frame_starts_.append(tuple(event_info))
+    frame_start_ids_.add(id(event_info))
+
+def critical_cb(channel, index, value, context):
+    global sampled_
+    sampled_ = (params_.frame_clock.sequence, params_.frame_clock.simulation_time)
+    time.sleep(0.005)
+
+def frame_cb(values, context):
+    delivered_.append((params_.frame_clock.sequence,
+                       params_.frame_clock.simulation_time))
+
+def telemetry_init(version, params):
+    global params_
+    if not ACTIVE:
+        return
+    params_ = params
+    params.configure_budget(1)
+    params.register_for_event(SCS_TELEMETRY_EVENT_frame_start, frame_start_cb,
+                              priority=pyets2lib.loader.PRIORITY_CRITICAL)
+    params.register_for_frame(frame_cb)
+    params.register_for_channel(CHANNEL, None, batched=True)
+    params.register_for_channel(CHANNEL, critical_cb,
+                                priority=pyets2lib.loader.PRIORITY_CRITICAL)
+
+def telemetry_shutdown():
+    if not ACTIVE:
+        return
+    logger = params_.common.logger
+    deferred = pyets2lib.loader.budget_stats()['deferred']
+    current = params_.frame_clock.sequence
+    if (sampled_ is not None and delivered_ == [sampled_] and
+            deferred > 0 and current > sampled_[0] and
+            frame_starts_ == [(0, 1000, 1000, 0), (0, 2000, 2000, 0)] and
+            len(frame_start_ids_) == 1):
+        logger.info("frameclock test passed")
+    else:
+        logger.error("frameclock test FAILED: sampled %s, delivered %s, "
+                     "deferred %d, current frame %d, frame starts %s in %d objects" %
+                     (sampled_, delivered_, deferred, current, frame_starts_,
+                      len(frame_start_ids_)))
@@ -0,0 +1,73 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Plug-in loaded by "test framesinks". Subscribes to a derived channel from
+# a frame sink callback, which adds a frame sink while the sinks are being
+# delivered, and checks that both sinks of the plug-in and the derived
+# channel get their values. The test binary sends the speed and the
+# retarder level in two frames.
+
+import os
+import pyets2lib.derived
+import pyets2lib.loader
+from pyets2lib.scsdefs import *
+
+ACTIVE = os.environ.get('PYETS2_TEST') == 'framesinks'
+
+params_ = None
+first_ = []
+second_ = []
+derived_ = []
+
+def first_cb(values, context):
+    first_.extend(value for channel, index, value in values)
+    if len(first_) == 1:
+        params_.register_for_channel(pyets2lib.derived.DERIVED_CHANNEL_speed_kmh,
+                                     derived_cb)
+
+def second_cb(values, context):
+    second_.extend(value for channel, index, value in values)
+
+def derived_cb(channel, index, value, context):
+    derived_.append(value)
+
+def telemetry_init(version, params):
+    global params_
+    if not ACTIVE:
+        return
+    params_ = params
+    params.register_for_frame(first_cb)
+    params.register_for_channel(SCS_TELEMETRY_TRUCK_CHANNEL_retarder_level,
+                                None, batched=True)
+    # A second sink, like that of another plug-in
+    other = pyets2lib.loader.scs_telemetry_init_params_v100_t(params.common,
+                                                              params.store)
+    other.register_for_frame(second_cb)
+    other.register_for_channel(SCS_TELEMETRY_TRUCK_CHANNEL_speed, None,
+                               batched=True)
+
+def telemetry_shutdown():
+    if not ACTIVE:
+        return
+    logger = params_.common.logger
+    if first_ == [1, 2] and second_ == [10.0, 20.0] and derived_ == [72.0]:
+        logger.info("framesinks test passed")
+    else:
+        logger.error("framesinks test FAILED: first %s, second %s, derived %s" %
+                     (first_, second_, derived_))
@@ -0,0 +1,58 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Plug-in loaded by "test scsdefs". Checks that SCS_CHANNELS indexes like a
+# list, also for the ids reserved by ScsIndexedChannels.
+
+import os
+from pyets2lib.scsdefs import *
+
+ACTIVE = os.environ.get('PYETS2_TEST') == 'scsdefs'
+
+def _check():
+    count = len(SCS_CHANNELS)
+    for i in range(1, count + 1):
+        if SCS_CHANNELS[-i] is not SCS_CHANNELS[count - i]:
+            return "SCS_CHANNELS[-%d] is not SCS_CHANNELS[%d]" % (i, count - i)
+    for internal_id in range(count):
+        if SCS_CHANNELS[internal_id].internal_id != internal_id:
+            return "SCS_CHANNELS[%d] has id %d" % (
+                internal_id, SCS_CHANNELS[internal_id].internal_id)
+    if SCS_CHANNELS[-3:] != list(SCS_CHANNELS)[-3:]:
+        return "SCS_CHANNELS[-3:] differs from the list"
+    for internal_id in (count, -count - 1):
+        try:
+            SCS_CHANNELS[internal_id]
+        except IndexError:
+            continue
+        return "SCS_CHANNELS[%d] did not raise IndexError" % internal_id
+    return None
+
+def telemetry_init(version, params):
+    if not ACTIVE:
+        return
+    # Before any channel is created by iterating
+    error = _check()
+    if error is None:
+        params.common.logger.info("scsdefs test passed")
+    else:
+        params.common.logger.error("scsdefs test FAILED: %s" % error)
+
+def telemetry_shutdown():
+    pass
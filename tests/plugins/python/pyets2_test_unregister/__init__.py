@@ -0,0 +1,78 @@
+#
+# Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+#
+# This file is part of pyets2_telemetry.
+#
+# pyets2_telemetry is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pyets2_telemetry is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+#
+
+# Plug-in loaded by "test unregister". Subscribes to a channel, detaches
+# the subscription at frame end and subscribes to another channel, twice,
+# and checks that no values of the detached channels are delivered. The
+# game reuses the context of a released channel, and the second time the
+# test binary fails to unregister the channel and keeps calling it.
+# Detaching within a channel callback must be rejected.
+
+import os
+from pyets2lib.scsdefs import *
+
+ACTIVE = os.environ.get('PYETS2_TEST') == 'unregister'
+
+CHANNELS = (SCS_TELEMETRY_TRUCK_CHANNEL_retarder_level,
+            SCS_TELEMETRY_TRUCK_CHANNEL_cruise_control,
+            SCS_TELEMETRY_TRUCK_CHANNEL_engine_rpm)
+
+params_ = None
+subscriptions_ = []
+# Values received by each subscription
+received_ = [[] for channel in CHANNELS]
+rejected_ = False
+
+def channel_cb(channel, index, value, context):
+    global rejected_
+    received_[context].append(value)
+    try:
+        subscriptions_[context].detach()
+    except RuntimeError:
+        rejected_ = subscriptions_[context].attached
+
+def frame_end_cb(event, event_info, context):
+    if len(subscriptions_) == len(CHANNELS):
+        return
+    subscriptions_[-1].detach()
+    subscribe(len(subscriptions_))
+
+def subscribe(number):
+    subscription = params_.subscription()
+    subscription.add_channel(CHANNELS[number], channel_cb, context=number)
+    subscription.attach()
+    subscriptions_.append(subscription)
+
+def telemetry_init(version, params):
+    global params_
+    if not ACTIVE:
+        return
+    params_ = params
+    params.register_for_event(SCS_TELEMETRY_EVENT_frame_end, frame_end_cb)
+    subscribe(0)
+
+def telemetry_shutdown():
+    if not ACTIVE:
+        return
+    logger = params_.common.logger
+    if rejected_ and received_ == [[1], [2.0], [4.0]]:
+        logger.info("unregister test passed")
+    else:
+        logger.error("unregister test FAILED: rejected %s, received %s" %
+                     (rejected_, received_))
@@ -0,0 +1,422 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+#include <atomic>
+#include <condition_variable>
+#include <cstring>
+#include <deque>
+#include <memory>
+#include <mutex>
+#include <string>
+#include <thread>
+#include <vector>
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+
+#include "ringbuffer.hpp"
+#include "worker.hpp"
+
+namespace worker {
+
+// Channel slots that can hold a coalesced value. Values of slots above
+// this are dropped instead.
+static const size_t MAX_COALESCED_SLOTS = 4096;
+// Records delivered per GIL hold. The worker releases the GIL in between,
+// so the game thread never waits for more than one batch of listener calls.
+static const size_t BATCH_RECORDS = 64;
+
+// Event info and string values are only valid during the SCS callback, so
+// they are copied into a payload, which is passed to the worker next to
+// the ring buffer. This allocates, but only happens for configuration
+// and gameplay events, which are rare.
+struct payload {
+    uint64_t id;
+    // deque, so pointers stay valid when adding strings
+    std::deque<std::string> strings;
+    std::vector<scs_named_value_t> attributes;
+    scs_telemetry_configuration_t config;
+
+    const char *copy_string(const char *value) {
+        strings.emplace_back(value);
+        return strings.back().c_str();
+    }
+};
+
+// Latest value of a channel, written by the game thread when the ring
+// buffer is full. Protected by a sequence lock.
+struct coalesced_value {
+    std::atomic<uint32_t> sequence{0};
+    std::atomic<bool> pending{false};
+    frameclock::stamp stamp;
+    scs_value_t value;
+};
+
+static size_t capacity_ = 4096;
+static overflow_policy policy_ = OVERFLOW_drop_oldest;
+static dispatch_function dispatch_ = nullptr;
+
+static std::unique_ptr<RingBuffer<record>> ring_;
+static std::unique_ptr<coalesced_value[]> coalesced_;
+static std::atomic<bool> coalesced_pending_{false};
+
+static std::mutex payload_mutex_;
+static std::deque<std::unique_ptr<payload>> payloads_;
+static uint64_t next_payload_id_ = 1;
+
+static std::thread thread_;
+static std::mutex wake_mutex_;
+static std::condition_variable wake_cv_;
+static std::atomic<bool> sleeping_{false};
+static bool stop_ = false;
+// The game thread waits here for room with OVERFLOW_block
+static std::mutex room_mutex_;
+static std::condition_variable room_cv_;
+static std::atomic<bool> waiting_for_room_{false};
+
+static std::atomic<uint64_t> queued_{0};
+static std::atomic<uint64_t> delivered_{0};
+static std::atomic<uint64_t> dropped_{0};
+static std::atomic<uint64_t> coalesced_count_{0};
+static std::atomic<uint64_t> blocked_{0};
+
+static void wake() {
+    // Pairs with the fence in run(), so either the worker sees the new
+    // record or we see that it sleeps
+    std::atomic_thread_fence(std::memory_order_seq_cst);
+    if (sleeping_.load(std::memory_order_relaxed)) {
+        std::lock_guard<std::mutex> lock(wake_mutex_);
+        wake_cv_.notify_one();
+    }
+}
+
+// Worker. Wakes the game thread if it waits for room.
+static void notify_room() {
+    // Pairs with the fence in wait_for_room()
+    std::atomic_thread_fence(std::memory_order_seq_cst);
+    if (waiting_for_room_.load(std::memory_order_relaxed)) {
+        std::lock_guard<std::mutex> lock(room_mutex_);
+        room_cv_.notify_one();
+    }
+}
+
+// Game thread. Waits until rec fits in the ring buffer.
+static void wait_for_room(const record &rec) {
+    std::unique_lock<std::mutex> lock(room_mutex_);
+    waiting_for_room_.store(true, std::memory_order_relaxed);
+    std::atomic_thread_fence(std::memory_order_seq_cst);
+    room_cv_.wait(lock, [&rec] { return ring_->try_push(rec); });
+    waiting_for_room_.store(false, std::memory_order_relaxed);
+}
+
+static void push_payload(record &rec, std::unique_ptr<payload> pl) {
+    std::lock_guard<std::mutex> lock(payload_mutex_);
+    pl->id = next_payload_id_++;
+    rec.payload_id = pl->id;
+    payloads_.push_back(std::move(pl));
+}
+
+// Returns the payload with id. Payloads of dropped records are skipped
+// and freed.
+static std::unique_ptr<payload> take_payload(uint64_t id) {
+    std::lock_guard<std::mutex> lock(payload_mutex_);
+    while (!payloads_.empty() && payloads_.front()->id < id) {
+        payloads_.pop_front();
+    }
+    if (payloads_.empty() || payloads_.front()->id != id) {
+        return nullptr;
+    }
+    std::unique_ptr<payload> pl = std::move(payloads_.front());
+    payloads_.pop_front();
+    return pl;
+}
+
+static bool coalesce(const record &rec) {
+    if (rec.kind != RECORD_channel || rec.payload_id != 0 ||
+        rec.slot_index >= MAX_COALESCED_SLOTS) {
+        return false;
+    }
+    coalesced_value &slot = coalesced_[rec.slot_index];
+    uint32_t sequence = slot.sequence.load(std::memory_order_relaxed);
+    slot.sequence.store(sequence + 1, std::memory_order_relaxed);
+    std::atomic_thread_fence(std::memory_order_release);
+    slot.stamp = rec.stamp;
+    std::memcpy(&slot.value, &rec.value, sizeof(slot.value));
+    slot.sequence.store(sequence + 2, std::memory_order_release);
+    if (slot.pending.exchange(true, std::memory_order_acq_rel)) {
+        // Replaced a value that was never delivered
+        coalesced_count_.fetch_add(1, std::memory_order_relaxed);
+    }
+    coalesced_pending_.store(true, std::memory_order_release);
+    return true;
+}
+
+static void push(const record &rec) {
+    queued_.fetch_add(1, std::memory_order_relaxed);
+    // A coalesced value is newer than anything in the ring buffer, so
+    // keep updating it until the worker has taken it
+    if (policy_ == OVERFLOW_coalesce && rec.kind == RECORD_channel &&
+        rec.slot_index < MAX_COALESCED_SLOTS &&
+        coalesced_[rec.slot_index].pending.load(std::memory_order_acquire) &&
+        coalesce(rec)) {
+        return;
+    }
+    if (!ring_->try_push(rec)) {
+        switch (policy_) {
+            case OVERFLOW_coalesce:
+                if (coalesce(rec)) {
+                    break;
+                }
+                // Intentional fall-through
+            case OVERFLOW_drop_oldest:
+                if (ring_->push_drop_oldest(rec)) {
+                    dropped_.fetch_add(1, std::memory_order_relaxed);
+                }
+                break;
+            case OVERFLOW_block:
+                blocked_.fetch_add(1, std::memory_order_relaxed);
+                wake();
+                wait_for_room(rec);
+                break;
+        }
+    }
+    if (ring_->size() >= ring_->capacity() / 2) {
+        wake();
+    }
+}
+
+void push_channel(uint32_t slot_index, const scs_value_t *value) {
+    record rec;
+    rec.kind = RECORD_channel;
+    rec.slot_index = slot_index;
+    rec.event = SCS_U32_NIL;
+    rec.payload_id = 0;
+    rec.stamp = frameclock::current();
+    if (value == nullptr) {
+        // SCS_TELEMETRY_CHANNEL_FLAG_no_value
+        rec.value.type = SCS_VALUE_TYPE_INVALID;
+    } else {
+        rec.value = *value;
+        if (value->type == SCS_VALUE_TYPE_string) {
+            std::unique_ptr<payload> pl(new payload());
+            pl->copy_string(value->value_string.value);
+            push_payload(rec, std::move(pl));
+        }
+    }
+    push(rec);
+}
+
+void push_event(uint32_t slot_index, scs_event_t event,
+                const void *event_info) {
+    record rec;
+    rec.kind = RECORD_event;
+    rec.slot_index = slot_index;
+    rec.event = event;
+    rec.payload_id = 0;
+    rec.stamp = frameclock::current();
+    if (event == SCS_TELEMETRY_EVENT_frame_start && event_info != nullptr) {
+        rec.frame_start = *static_cast<const scs_telemetry_frame_start_t*>(event_info);
+    } else if ((event == SCS_TELEMETRY_EVENT_configuration ||
+                event == SCS_TELEMETRY_EVENT_gameplay) &&
+               event_info != nullptr) {
+        // The struct layouts are the same
+        auto config = static_cast<const scs_telemetry_configuration_t*>(event_info);
+        std::unique_ptr<payload> pl(new payload());
+        pl->config.id = pl->copy_string(config->id);
+        for (const scs_named_value_t *attr = config->attributes;
+             attr->name != nullptr; ++attr) {
+            scs_named_value_t attr_copy = *attr;
+            attr_copy.name = pl->copy_string(attr->name);
+            if (attr->value.type == SCS_VALUE_TYPE_string) {
+                attr_copy.value.value_string.value =
+                    pl->copy_string(attr->value.value_string.value);
+            }
+            pl->attributes.push_back(attr_copy);
+        }
+        scs_named_value_t terminator;
+        std::memset(&terminator, 0, sizeof(terminator));
+        pl->attributes.push_back(terminator);
+        pl->config.attributes = pl->attributes.data();
+        push_payload(rec, std::move(pl));
+    }
+    push(rec);
+}
+
+void notify() {
+    if (ring_ && (!ring_->empty() ||
+                  coalesced_pending_.load(std::memory_order_relaxed))) {
+        wake();
+    }
+}
+
+// The GIL must be held
+static void deliver(record &rec) {
+    std::unique_ptr<payload> pl;
+    if (rec.payload_id != 0) {
+        pl = take_payload(rec.payload_id);
+        if (!pl) {
+            return;
+        }
+    }
+    const void *event_info = nullptr;
+    if (rec.kind == RECORD_channel) {
+        if (pl) {
+            rec.value.value_string.value = pl->strings.front().c_str();
+        }
+    } else if (pl) {
+        event_info = &pl->config;
+    } else if (rec.event == SCS_TELEMETRY_EVENT_frame_start) {
+        event_info = &rec.frame_start;
+    }
+    dispatch_(rec, event_info);
+    delivered_.fetch_add(1, std::memory_order_relaxed);
+}
+
+// Takes the GIL for each batch of values
+static void deliver_coalesced() {
+    if (!coalesced_pending_.exchange(false, std::memory_order_acq_rel)) {
+        return;
+    }
+    record rec;
+    rec.kind = RECORD_channel;
+    rec.event = SCS_U32_NIL;
+    rec.payload_id = 0;
+    size_t count = 0;
+    PyGILState_STATE gil_state = PyGILState_Ensure();
+    for (uint32_t i = 0; i < MAX_COALESCED_SLOTS; ++i) {
+        coalesced_value &slot = coalesced_[i];
+        if (!slot.pending.exchange(false, std::memory_order_acq_rel)) {
+            continue;
+        }
+        uint32_t sequence;
+        do {
+            sequence = slot.sequence.load(std::memory_order_acquire);
+            rec.stamp = slot.stamp;
+            std::memcpy(&rec.value, &slot.value, sizeof(rec.value));
+            std::atomic_thread_fence(std::memory_order_acquire);
+        } while ((sequence & 1) ||
+                 sequence != slot.sequence.load(std::memory_order_relaxed));
+        rec.slot_index = i;
+        deliver(rec);
+        if (++count % BATCH_RECORDS == 0) {
+            PyGILState_Release(gil_state);
+            gil_state = PyGILState_Ensure();
+        }
+    }
+    PyGILState_Release(gil_state);
+}
+
+static bool have_work() {
+    return !ring_->empty() || coalesced_pending_.load(std::memory_order_acquire);
+}
+
+static void run() {
+    record rec;
+    while (true) {
+        {
+            std::unique_lock<std::mutex> lock(wake_mutex_);
+            sleeping_.store(true, std::memory_order_relaxed);
+            std::atomic_thread_fence(std::memory_order_seq_cst);
+            wake_cv_.wait(lock, [] { return stop_ || have_work(); });
+            sleeping_.store(false, std::memory_order_relaxed);
+            if (stop_) {
+                break;
+            }
+        }
+
+        // Bounded, so coalesced values are not starved by a busy producer
+        size_t count = 0;
+        while (count < ring_->capacity() && !ring_->empty()) {
+            PyGILState_STATE gil_state = PyGILState_Ensure();
+            for (size_t i = 0; i < BATCH_RECORDS && ring_->try_pop(rec); ++i) {
+                deliver(rec);
+                ++count;
+            }
+            PyGILState_Release(gil_state);
+            notify_room();
+        }
+        if (policy_ == OVERFLOW_coalesce) {
+            deliver_coalesced();
+        }
+    }
+}
+
+bool configure(size_t capacity, overflow_policy policy) {
+    if (running()) {
+        return false;
+    }
+    capacity_ = capacity;
+    policy_ = policy;
+    return true;
+}
+
+void start(dispatch_function dispatch) {
+    if (running()) {
+        return;
+    }
+    dispatch_ = dispatch;
+    ring_.reset(new RingBuffer<record>(capacity_));
+    if (policy_ == OVERFLOW_coalesce) {
+        coalesced_.reset(new coalesced_value[MAX_COALESCED_SLOTS]);
+    }
+    stop_ = false;
+    queued_ = 0;
+    delivered_ = 0;
+    dropped_ = 0;
+    coalesced_count_ = 0;
+    blocked_ = 0;
+    thread_ = std::thread(run);
+}
+
+void stop() {
+    if (!running()) {
+        return;
+    }
+    {
+        std::lock_guard<std::mutex> lock(wake_mutex_);
+        stop_ = true;
+    }
+    wake_cv_.notify_one();
+    thread_.join();
+
+    ring_.reset();
+    coalesced_.reset();
+    coalesced_pending_ = false;
+    payloads_.clear();
+    capacity_ = 4096;
+    policy_ = OVERFLOW_drop_oldest;
+}
+
+bool running() {
+    return thread_.joinable();
+}
+
+counters get_counters() {
+    counters result;
+    result.capacity = ring_ ? ring_->capacity() : 0;
+    result.pending = ring_ ? ring_->size() : 0;
+    result.queued = queued_.load(std::memory_order_relaxed);
+    result.delivered = delivered_.load(std::memory_order_relaxed);
+    result.dropped = dropped_.load(std::memory_order_relaxed);
+    result.coalesced = coalesced_count_.load(std::memory_order_relaxed);
+    result.blocked = blocked_.load(std::memory_order_relaxed);
+    return result;
+}
+
+}
@@ -0,0 +1,116 @@
+//
+// Copyright 2019 Thomas Axelsson <thomasa88@gmail.com>
+//
+// This file is part of pyets2_telemetry.
+//
+// pyets2_telemetry is free software: you can redistribute it and/or modify
+// it under the terms of the GNU General Public License as published by
+// the Free Software Foundation, either version 3 of the License, or
+// (at your option) any later version.
+//
+// pyets2_telemetry is distributed in the hope that it will be useful,
+// but WITHOUT ANY WARRANTY; without even the implied warranty of
+// MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+// GNU General Public License for more details.
+//
+// You should have received a copy of the GNU General Public License
+// along with pyets2_telemetry.  If not, see <https://www.gnu.org/licenses/>.
+//
+
+// Delivery of channel values and events to Python on a worker thread.
+//
+// The game thread only copies raw records into a lock-free ring buffer.
+// The worker thread drains it, holding the GIL once per batch, and
+// dispatches the records through the function given to start().
+
+#ifndef _WORKER_HPP_
+#define _WORKER_HPP_
+
+#include <cstdint>
+
+#include "scssdk_telemetry.h"
+
+#include "frameclock.hpp"
+
+namespace worker {
+
+// What to do when the ring buffer is full
+enum overflow_policy {
+    // Discard the oldest record
+    OVERFLOW_drop_oldest = 0,
+    // Keep only the latest value of each channel until there is room.
+    // Events are handled like OVERFLOW_drop_oldest.
+    OVERFLOW_coalesce = 1,
+    // Make the game thread wait for the worker
+    OVERFLOW_block = 2,
+};
+
+enum record_kind {
+    RECORD_channel,
+    RECORD_event,
+};
+
+struct record {
+    record_kind kind;
+    // Index in the channel or event slots of the loader
+    uint32_t slot_index;
+    scs_event_t event;
+    // Id of the copied event info or string value, 0 if there is none
+    uint64_t payload_id;
+    // Frame of the value or event
+    frameclock::stamp stamp;
+    union {
+        scs_value_t value;
+        scs_telemetry_frame_start_t frame_start;
+    };
+};
+
+// Called on the worker thread, with the GIL held. event_info is the event
+// info for event records. String values in rec point to copies that are
+// valid during the call.
+typedef void (*dispatch_function)(const record &rec, const void *event_info);
+
+struct counters {
+    size_t capacity;
+    // Records waiting in the ring buffer
+    size_t pending;
+    uint64_t queued;
+    uint64_t delivered;
+    // Records discarded because the ring buffer was full
+    uint64_t dropped;
+    // Channel values replaced by a later value of the same channel
+    uint64_t coalesced;
+    // Number of times the game thread had to wait for room
+    uint64_t blocked;
+};
+
+// Sets the ring buffer capacity and overflow policy. Returns false if the
+// worker is already running.
+bool configure(size_t capacity, overflow_policy policy);
+
+// Starts the worker thread. Does nothing if it is already running.
+void start(dispatch_function dispatch);
+
+// Stops the worker thread, discarding undelivered records.
+// The GIL must not be held, as the worker might be waiting for it.
+void stop();
+
+bool running();
+
+// Game thread. Queues a channel value. value may be nullptr.
+void push_channel(uint32_t slot_index, const scs_value_t *value);
+
+// Game thread. Queues an event, copying the event info.
+void push_event(uint32_t slot_index, scs_event_t event,
+                const void *event_info);
+
+// Game thread. Wakes the worker if it is waiting. The worker is also woken
+// when the ring buffer is half full, so this only needs to be called once
+// per frame.
+void notify();
+
+counters get_counters();
+
+}
+
+#endif